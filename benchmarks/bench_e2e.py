@@ -0,0 +1,479 @@
+"""
+端到端负载测试：驱动 handle_group 处理合成的群消息，测量吞吐、延迟与资源占用。
+
+完全离线运行：
+- 本地 HTTP 桩服务提供 b23 短链重定向与预先生成的 DASH 音视频（需要 ffmpeg）；
+- 伪造的 Bot 记录 send_group_msg 调用，可按 --upload-mbps 模拟上传耗时；
+- 插件数据目录位于临时目录，不影响真实数据。
+
+每个并发度下按闭环方式运行：每个并发槽位独占一个群，发出一条消息后等到视频发出
+（或收到失败提示）再发下一条，所有消息使用不同的视频ID，不命中缓存。
+
+用法：
+    python benchmarks/bench_e2e.py [--concurrency 1,4,8] [--messages 16]
+        [--short-ratio 0.3] [--media-seconds 6] [--upload-mbps 0]
+        [--set download_workers=4 --set download_process_workers=2]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# =========================
+# 本地桩服务
+# =========================
+
+
+def make_media(www: Path, ffmpeg: str, seconds: float, size: str) -> None:
+    """用 ffmpeg 生成测试画面与音频，切成 DASH 分段"""
+    dash = www / "dash"
+    dash.mkdir(parents=True, exist_ok=True)
+    cmd = [
+        ffmpeg,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc=size={size}:rate=25:duration={seconds}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=440:duration={seconds}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        "-c:a",
+        "aac",
+        "-f",
+        "dash",
+        "-seg_duration",
+        "2",
+        "-use_template",
+        "1",
+        "-use_timeline",
+        "1",
+        str(dash / "manifest.mpd"),
+    ]
+    subprocess.run(cmd, check=True)
+
+
+class StubHandler(SimpleHTTPRequestHandler):
+    """
+    /b23/<BV号>        302 跳转到对应的视频页链接（模拟 b23.tv 短链）
+    /dash/<视频ID>.mpd 任意视频ID都返回同一份 DASH 清单
+    /dash/<分段>       静态分段文件
+    """
+
+    def _redirect(self) -> bool:
+        if not self.path.startswith("/b23/"):
+            return False
+        code = self.path[5:].split("?", 1)[0]
+        self.send_response(302)
+        self.send_header("Location", f"https://www.bilibili.com/video/{code}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def do_HEAD(self) -> None:
+        if not self._redirect():
+            super().do_HEAD()
+
+    def do_GET(self) -> None:
+        if not self._redirect():
+            super().do_GET()
+
+    def translate_path(self, path: str) -> str:
+        path = path.split("?", 1)[0]
+        if path.startswith("/dash/") and path.endswith(".mpd"):
+            path = "/dash/manifest.mpd"
+        return super().translate_path(path)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def start_stub(www: Path) -> Tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(StubHandler, directory=str(www))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# =========================
+# 合成消息
+# =========================
+
+
+def random_bvid(rng: random.Random) -> str:
+    return "BV1" + "".join(rng.choices(string.ascii_letters + string.digits, k=9))
+
+
+def make_segments(kind: str, url: str, title: str) -> List[Dict[str, Any]]:
+    """按消息类型构造包含链接的消息段"""
+    if kind == "text":
+        return [{"type": "text", "data": {"text": f"看看这个 {url} 哈哈"}}]
+    if kind == "json":
+        card = {
+            "app": "com.tencent.miniapp_01",
+            "prompt": f"[QQ小程序]{title}",
+            "meta": {
+                "detail_1": {
+                    "appid": "1109937557",
+                    "title": "哔哩哔哩",
+                    "desc": title,
+                    "qqdocurl": url + "?share_medium=android&share_source=qq",
+                }
+            },
+        }
+        data = json.dumps(card, ensure_ascii=False).replace("/", "\\/")
+        return [{"type": "json", "data": {"data": data}}]
+    if kind == "xml":
+        data = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<msg serviceID="1" brief="[分享]{title}" url="{url}">'
+            f"<item><title>{title}</title></item></msg>"
+        )
+        return [{"type": "xml", "data": {"data": data}}]
+    return [{"type": "share", "data": {"url": url, "title": title}}]
+
+
+def make_event(group_id: int, message_id: int, segments: List[Dict[str, Any]]):
+    from nonebot.compat import type_validate_python
+    from nonebot.adapters.onebot.v11 import GroupMessageEvent
+
+    return type_validate_python(
+        GroupMessageEvent,
+        {
+            "time": int(time.time()),
+            "self_id": 10000,
+            "post_type": "message",
+            "sub_type": "normal",
+            "user_id": 20000 + message_id,
+            "message_type": "group",
+            "message_id": message_id,
+            "message": segments,
+            "original_message": segments,
+            "raw_message": "",
+            "font": 0,
+            "sender": {"user_id": 20000 + message_id},
+            "to_me": False,
+            "group_id": group_id,
+        },
+    )
+
+
+# =========================
+# 伪造 Bot
+# =========================
+
+
+class FakeBot:
+    """只实现插件用到的接口；每个群的下一次 send_group_msg 完成对应的等待"""
+
+    def __init__(self, upload_mbps: float = 0) -> None:
+        self.self_id = "10000"
+        self.upload_mbps = upload_mbps
+        self.sent: List[Dict[str, Any]] = []
+        self._waiters: Dict[int, asyncio.Future] = {}
+
+    def expect(self, group_id: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[group_id] = fut
+        return fut
+
+    async def send_group_msg(self, group_id: int, message, **kwargs) -> Dict[str, Any]:
+        video = next((seg for seg in message if seg.type == "video"), None)
+        size = 0
+        if video is not None:
+            file = str(video.data.get("file", ""))
+            path = file[7:] if file.startswith("file://") else file
+            with contextlib.suppress(OSError):
+                size = os.path.getsize(path)
+            if self.upload_mbps:
+                await asyncio.sleep(size / 1024 / 1024 / self.upload_mbps)
+        self.sent.append({"group_id": group_id, "video": video is not None})
+        fut = self._waiters.pop(group_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result((video is not None, size))
+        return {"message_id": len(self.sent)}
+
+    async def call_api(self, api: str, **kwargs) -> Any:
+        if api == "send_group_msg":
+            return await self.send_group_msg(**kwargs)
+        return {}
+
+    async def send(self, event, message, **kwargs) -> Dict[str, Any]:
+        return {"message_id": 0}
+
+
+# =========================
+# 资源采样
+# =========================
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    for task in Path(f"/proc/{pid}/task").glob("*/children"):
+        with contextlib.suppress(OSError):
+            for child in task.read_text().split():
+                pids += _process_tree(int(child))
+    return pids
+
+
+def _rss_bytes() -> int:
+    """本进程及子进程（下载进程池、ffmpeg）的常驻内存之和"""
+    if not Path("/proc/self/status").exists():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    total = 0
+    for pid in _process_tree(os.getpid()):
+        with contextlib.suppress(OSError):
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+                    break
+    return total
+
+
+def _open_fds() -> int:
+    with contextlib.suppress(OSError):
+        return len(os.listdir("/proc/self/fd"))
+    return -1
+
+
+class Sampler:
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+            self.peak_fds = max(self.peak_fds, _open_fds())
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self) -> "Sampler":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        assert self._task is not None
+        self._task.cancel()
+
+
+# =========================
+# 负载
+# =========================
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_level(
+    M, bot: FakeBot, stub: str, concurrency: int, args, rng: random.Random
+) -> Dict[str, Any]:
+    kinds = ["text", "json", "xml", "share"]
+    counter = iter(range(args.messages))
+    latencies: List[float] = []
+    failures = 0
+    sent_bytes = 0
+
+    async def slot(group_id: int) -> None:
+        nonlocal failures, sent_bytes
+        M.enabled_groups.add(group_id)
+        for message_id in counter:
+            bvid = random_bvid(rng)
+            if rng.random() < args.short_ratio:
+                url = f"https://b23.tv/{bvid}"
+            else:
+                url = f"https://www.bilibili.com/video/{bvid}"
+            event = make_event(
+                group_id,
+                message_id,
+                make_segments(rng.choice(kinds), url, f"测试视频{message_id}"),
+            )
+            done = bot.expect(group_id)
+            start = time.perf_counter()
+            await M.handle_group(bot, event)
+            try:
+                ok, size = await asyncio.wait_for(done, args.timeout)
+            except asyncio.TimeoutError:
+                ok, size = False, 0
+            if ok:
+                latencies.append(time.perf_counter() - start)
+                sent_bytes += size
+            else:
+                failures += 1
+
+    start = time.perf_counter()
+    with Sampler() as sampler:
+        await asyncio.gather(*(slot(900000 + i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "failed": failures,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "mbps": sent_bytes / 1024 / 1024 / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "peak_rss": sampler.peak_rss,
+        "peak_fds": sampler.peak_fds,
+    }
+
+
+def route_to_stub(M, stub: str) -> None:
+    """把短链展开、下载前预检与视频下载指向本地桩服务，其余流程保持不变"""
+    from nonebot_plugin_bili2mp4.links import canonical_video_id
+
+    fetch_location = M._resolver._fetch_location
+
+    async def fetch_stub_location(u: str) -> str:
+        return await fetch_location(u.replace("https://b23.tv", f"{stub}/b23"))
+
+    M._resolver._fetch_location = fetch_stub_location
+
+    def stub_url(url: str) -> str:
+        return f"{stub}/dash/{canonical_video_id(url) or 'unknown'}.mpd"
+
+    # 启用优先级调度或时长上限时下载前会先预检，同样不能访问真实的B站
+    probe = M._probe
+
+    async def probe_stub(job: Dict) -> Any:
+        return await probe(dict(job, url=stub_url(job["url"])))
+
+    M._probe = probe_stub
+
+    submit = M._submit_download
+
+    async def submit_stub(job: Dict) -> Any:
+        return await submit(dict(job, url=stub_url(job["url"])))
+
+    M._submit_download = submit_stub
+
+
+def parse_settings(items: List[str]) -> Dict[str, Any]:
+    settings: Dict[str, Any] = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        try:
+            settings[key] = json.loads(value)
+        except ValueError:
+            settings[key] = value
+    return settings
+
+
+async def bench(args, workdir: Path) -> List[Dict[str, Any]]:
+    from nonebot_plugin_bili2mp4 import main as M
+
+    # 数据目录放在临时目录中
+    data_dir = workdir / "data"
+    data_dir.mkdir()
+    M.store.get_plugin_data_dir = lambda **_: data_dir
+
+    _, stub = start_stub(workdir / "www")
+    await M._on_startup()
+    route_to_stub(M, stub)
+    bot = FakeBot(args.upload_mbps)
+    rng = random.Random(args.seed)
+    results = []
+    try:
+        for level in args.concurrency:
+            # yt-dlp 的进度输出写到 stdout，运行期间丢弃
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results.append(await run_level(M, bot, stub, level, args, rng))
+    finally:
+        await M._on_shutdown()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--concurrency",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[1, 4, 8],
+        help="逗号分隔的并发度列表",
+    )
+    parser.add_argument("--messages", type=int, default=16, help="每个并发度的消息数")
+    parser.add_argument(
+        "--short-ratio", type=float, default=0.3, help="使用 b23 短链的消息占比"
+    )
+    parser.add_argument("--media-seconds", type=float, default=6)
+    parser.add_argument("--media-size", default="640x360")
+    parser.add_argument(
+        "--upload-mbps", type=float, default=0, help="模拟上传速度（MB/s），0 为瞬时"
+    )
+    parser.add_argument("--timeout", type=float, default=120, help="单条消息超时（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ffmpeg", default=shutil.which("ffmpeg"))
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="插件配置项，如 download_workers=4",
+    )
+    args = parser.parse_args()
+    if not args.ffmpeg:
+        parser.error("未找到 ffmpeg，请用 --ffmpeg 指定")
+
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter
+
+    settings = {"ffmpeg_path": str(Path(args.ffmpeg).parent), "log_level": "WARNING"}
+    settings.update(parse_settings(args.set))
+    nonebot.init(**settings)
+    nonebot.get_driver().register_adapter(Adapter)
+    nonebot.load_plugin("nonebot_plugin_bili2mp4")
+
+    with tempfile.TemporaryDirectory(prefix="bili2mp4-bench-") as tmp:
+        workdir = Path(tmp)
+        make_media(workdir / "www", args.ffmpeg, args.media_seconds, args.media_size)
+        results = asyncio.run(bench(args, workdir))
+
+    print(
+        f"{'并发':>4}{'成功':>6}{'失败':>6}{'耗时s':>8}{'条/s':>8}{'MB/s':>8}"
+        f"{'p50 s':>8}{'p95 s':>8}{'RSS MB':>9}{'fds':>6}"
+    )
+    for r in results:
+        print(
+            f"{r['concurrency']:>4}{r['ok']:>6}{r['failed']:>6}{r['elapsed']:>8.2f}"
+            f"{r['throughput']:>8.2f}{r['mbps']:>8.2f}{r['p50']:>8.2f}"
+            f"{r['p95']:>8.2f}{r['peak_rss'] / 1024 / 1024:>9.1f}{r['peak_fds']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
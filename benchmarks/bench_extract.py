@@ -0,0 +1,168 @@
+"""
+群消息链接提取微基准：对比旧版（正则 + json.loads + 递归遍历）与当前单遍提取器。
+
+用法：
+    python benchmarks/bench_extract.py [--rounds 2000] [--chatter-ratio 0.9]
+
+语料位于 benchmarks/data/messages.json，包含QQ小程序、结构化分享、XML 卡片、
+分享段、纯文本链接以及普通聊天消息。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List
+from urllib.parse import parse_qs, unquote, urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import nonebot  # noqa: E402
+
+nonebot.init()
+
+from nonebot.adapters.onebot.v11 import Message, MessageSegment  # noqa: E402
+
+from nonebot_plugin_bili2mp4.links import (  # noqa: E402
+    BILI_URL_RE,
+    _normalize,
+    extract_bili_urls,
+)
+
+# =========================
+# 旧版实现（保留用于对比）
+# =========================
+
+
+def legacy_find_urls_in_text(text: str) -> List[str]:
+    urls = []
+    for m in BILI_URL_RE.findall(text or ""):
+        if m not in urls:
+            urls.append(m)
+    try:
+        parsed = urlparse(text)
+        if parsed and parsed.query:
+            qs = parse_qs(parsed.query)
+            for key in ("url", "qqdocurl", "jumpUrl", "webpageUrl"):
+                for v in qs.get(key, []):
+                    v = unquote(v)
+                    for u in BILI_URL_RE.findall(v):
+                        if u not in urls:
+                            urls.append(u)
+    except Exception:
+        pass
+    return urls
+
+
+def legacy_walk_strings(obj) -> List[str]:
+    out: List[str] = []
+    if isinstance(obj, dict):
+        for v in obj.values():
+            out.extend(legacy_walk_strings(v))
+    elif isinstance(obj, list):
+        for it in obj:
+            out.extend(legacy_walk_strings(it))
+    elif isinstance(obj, str):
+        out.append(obj)
+    return out
+
+
+def legacy_extract(message: Message) -> List[str]:
+    urls: List[str] = []
+    for seg in message:
+        if seg.type == "text":
+            found = legacy_find_urls_in_text(seg.data.get("text", ""))
+        elif seg.type == "json":
+            raw = seg.data.get("data") or seg.data.get("content") or ""
+            found = legacy_find_urls_in_text(raw)
+            try:
+                for s in legacy_walk_strings(json.loads(raw)):
+                    found += legacy_find_urls_in_text(s)
+            except Exception:
+                pass
+        elif seg.type == "xml":
+            raw = seg.data.get("data") or seg.data.get("content") or ""
+            found = legacy_find_urls_in_text(raw)
+        elif seg.type == "share":
+            found = legacy_find_urls_in_text(seg.data.get("url") or "")
+        else:
+            found = legacy_find_urls_in_text(str(seg))
+        for u in found:
+            if u not in urls:
+                urls.append(u)
+    return urls
+
+
+# =========================
+# 基准
+# =========================
+
+
+def load_corpus() -> List[dict]:
+    with (Path(__file__).parent / "data" / "messages.json").open(encoding="utf-8") as f:
+        docs = json.load(f)
+    for doc in docs:
+        doc["message"] = Message(
+            MessageSegment(s["type"], s["data"]) for s in doc["segments"]
+        )
+    return docs
+
+
+def bench(func, messages: List[Message], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for m in messages:
+            func(m)
+    return (time.perf_counter() - start) / (rounds * len(messages)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument(
+        "--chatter-ratio",
+        type=float,
+        default=0.9,
+        help="混合负载中不含链接的普通消息占比",
+    )
+    args = parser.parse_args()
+
+    docs = load_corpus()
+
+    print("== 结果一致性 ==")
+    for doc in docs:
+        legacy = {r[0] for r in map(_normalize, legacy_extract(doc["message"])) if r}
+        current = {_normalize(u)[0] for u in extract_bili_urls(doc["message"])}
+        flag = "OK " if legacy <= current else "DIFF"
+        print(f"{flag} {doc['name']:<16} legacy={sorted(legacy)} new={sorted(current)}")
+
+    print("\n== 单条耗时（µs/消息） ==")
+    print(f"{'corpus':<16}{'legacy':>10}{'new':>10}{'speedup':>10}")
+    for doc in docs:
+        old = bench(legacy_extract, [doc["message"]], args.rounds)
+        new = bench(extract_bili_urls, [doc["message"]], args.rounds)
+        print(f"{doc['name']:<16}{old:>10.2f}{new:>10.2f}{old / new:>9.1f}x")
+
+    rng = random.Random(0)
+    chatter = [d["message"] for d in docs if not extract_bili_urls(d["message"])]
+    cards = [d["message"] for d in docs if extract_bili_urls(d["message"])]
+    mix = [
+        rng.choice(chatter if rng.random() < args.chatter_ratio else cards)
+        for _ in range(500)
+    ]
+    rounds = max(1, args.rounds // 50)
+    old = bench(legacy_extract, mix, rounds)
+    new = bench(extract_bili_urls, mix, rounds)
+    print(
+        f"\n混合负载（普通消息 {args.chatter_ratio:.0%}）: "
+        f"legacy={old:.2f}µs new={new:.2f}µs speedup={old / new:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
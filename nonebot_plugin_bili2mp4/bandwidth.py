@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class BandwidthGovernor:
+    """
+    所有下载任务共享的总带宽上限。
+
+    总预算按当前进行中的下载任务平分，写入各任务的 control["ratelimit"]
+    （yt-dlp 的 ratelimit，字节/秒）；任务开始、结束或有视频正在发送时重新分配。
+    发送期间预留 send_headroom 比例的带宽给上传，避免 OneBot 连接超时。
+    """
+
+    def __init__(self, limit: float = 0, send_headroom: float = 0.3) -> None:
+        self.limit = max(0.0, float(limit))
+        self.send_headroom = min(max(0.0, float(send_headroom)), 0.9)
+        self._controls: List[Dict[str, Any]] = []
+        self._sending = 0
+        self._listeners: List[Callable[[], None]] = []
+
+    def on_change(self, fn: Callable[[], None]) -> None:
+        """限速变化时的回调（如下发给下载进程）"""
+        self._listeners.append(fn)
+
+    @property
+    def budget(self) -> float:
+        """当前可用于下载的总速度（字节/秒），0 表示不限制"""
+        if not self.limit:
+            return 0.0
+        if self._sending:
+            return self.limit * (1 - self.send_headroom)
+        return self.limit
+
+    def share(self) -> Optional[float]:
+        if not self.limit or not self._controls:
+            return None
+        return self.budget / len(self._controls)
+
+    def set_limit(self, limit: float) -> None:
+        self.limit = max(0.0, float(limit))
+        self._rebalance()
+
+    def _rebalance(self) -> None:
+        rate = self.share()
+        changed = False
+        for control in self._controls:
+            if control.get("ratelimit") != rate:
+                control["ratelimit"] = rate
+                changed = True
+        if changed:
+            for fn in self._listeners:
+                fn()
+
+    @contextmanager
+    def download(self) -> Iterator[Dict[str, Any]]:
+        """登记一个下载任务，返回随分配变化的 control 字典"""
+        control: Dict[str, Any] = {"ratelimit": None}
+        self._controls.append(control)
+        self._rebalance()
+        try:
+            yield control
+        finally:
+            self._controls.remove(control)
+            self._rebalance()
+
+    @contextmanager
+    def sending(self) -> Iterator[None]:
+        """发送视频期间为上传预留带宽"""
+        self._sending += 1
+        if self._sending == 1:
+            self._rebalance()
+        try:
+            yield
+        finally:
+            self._sending -= 1
+            if self._sending == 0:
+                self._rebalance()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "budget": self.budget,
+            "downloads": len(self._controls),
+            "sending": self._sending,
+            "share": self.share(),
+        }
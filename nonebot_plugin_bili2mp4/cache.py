@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from nonebot import logger
+
+_UNSAFE_CHARS_RE = re.compile(r"[^\w.-]+")
+
+
+class VideoCache:
+    """
+    以「视频ID + 清晰度/大小参数」为键的本地视频缓存。
+
+    索引保存在缓存目录下的 index.json 中，超出容量上限时按最近最少使用淘汰；
+    仍在发送的文件（hold）不会被淘汰。索引的修改先记在内存中，合并后在线程中延迟写入。
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self.index_path = self.root / "index.json"
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._held: Dict[str, int] = {}
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        self._write_lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(video_id: str, height_limit: int, size_limit_mb: int) -> str:
+        return f"{video_id}|h{int(height_limit or 0)}|s{int(size_limit_mb or 0)}"
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(int(e.get("size", 0)) for e in self.entries.values())
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with self.index_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            items = sorted(
+                data.get("entries", {}).items(),
+                key=lambda kv: kv[1].get("last_access", 0),
+            )
+            for key, entry in items:
+                if (self.root / entry.get("file", "")).is_file():
+                    self.entries[key] = entry
+        except Exception as e:
+            logger.warning(f"bili2mp4: 缓存索引加载失败，将重建: {e}")
+            self.entries.clear()
+
+    def _dump(self) -> str:
+        return json.dumps({"entries": dict(self.entries)}, ensure_ascii=False)
+
+    def _write(self, text: str) -> None:
+        with self._write_lock:
+            tmp = self.index_path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, self.index_path)
+
+    def _save(self) -> None:
+        self._dirty = False
+        try:
+            self._write(self._dump())
+        except Exception as e:
+            logger.warning(f"bili2mp4: 缓存索引保存失败: {e}")
+
+    def _schedule_save(self) -> None:
+        """合并短时间内的多次访问时间更新，在线程中写入索引"""
+        self._dirty = True
+        if self._save_task is not None and not self._save_task.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._save()
+            return
+
+        async def save_later():
+            await asyncio.sleep(5)
+            # 写入期间的更新在下一轮写入
+            while self._dirty:
+                self._dirty = False
+                try:
+                    await asyncio.to_thread(self._write, self._dump())
+                except Exception as e:
+                    logger.warning(f"bili2mp4: 缓存索引保存失败: {e}")
+                    return
+
+        self._save_task = asyncio.create_task(save_later())
+
+    async def close(self) -> None:
+        """取消等待中的延迟写入，立即保存未写入的修改"""
+        task = self._save_task
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            # 可能在写入途中被取消，加锁后再完整写一次
+            self._dirty = True
+        if self._dirty:
+            self._save()
+
+    def hold(self, path: str) -> None:
+        """标记缓存文件仍在使用（发送中），使用期间不会被淘汰"""
+        name = Path(path).name
+        self._held[name] = self._held.get(name, 0) + 1
+
+    def release(self, path: str) -> None:
+        name = Path(path).name
+        left = self._held.get(name, 0) - 1
+        if left > 0:
+            self._held[name] = left
+            return
+        self._held.pop(name, None)
+        # 之前因占用而推迟的淘汰
+        if self.total_bytes > self.max_bytes and self._evict():
+            self._schedule_save()
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """命中时返回 (文件路径, 标题)，并刷新最近访问时间"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            path = self.root / entry["file"]
+            if path.is_file():
+                entry["last_access"] = time.time()
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self._schedule_save()
+                return str(path), entry.get("title", "")
+            # 文件已丢失，移除失效条目
+            self.entries.pop(key, None)
+            self._schedule_save()
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, src_path: str, title: str) -> str:
+        """将下载好的文件移入缓存目录，返回缓存内的路径"""
+        src = Path(src_path)
+        name = _UNSAFE_CHARS_RE.sub("_", key) + (src.suffix or ".mp4")
+        dst = self.root / name
+        # 跨文件系统时是整文件复制，放到线程中进行
+        size = await asyncio.to_thread(self._move_in, src, dst)
+
+        now = time.time()
+        self.entries[key] = {
+            "file": name,
+            "title": title,
+            "size": size,
+            "created": now,
+            "last_access": now,
+        }
+        self.entries.move_to_end(key)
+        self._evict(keep=key)
+        self._schedule_save()
+        return str(dst)
+
+    @staticmethod
+    def _move_in(src: Path, dst: Path) -> int:
+        if src.resolve() != dst.resolve():
+            shutil.move(str(src), str(dst))
+        return dst.stat().st_size
+
+    def _evict(self, keep: Optional[str] = None) -> bool:
+        """按最近最少使用淘汰到容量以内，跳过 keep 与仍在使用的文件；返回是否有淘汰"""
+        total = self.total_bytes
+        evicted = False
+        for key, entry in list(self.entries.items()):
+            if total <= self.max_bytes:
+                break
+            if key == keep or self._held.get(entry["file"]):
+                continue
+            self.entries.pop(key)
+            evicted = True
+            total -= int(entry.get("size", 0))
+            try:
+                (self.root / entry["file"]).unlink()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.debug(f"bili2mp4: 删除缓存文件失败 {entry.get('file')}: {e}")
+            logger.info(f"bili2mp4: 缓存淘汰: {key}")
+        return evicted
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
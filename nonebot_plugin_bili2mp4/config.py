@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -9,3 +9,170 @@ class Config(BaseModel):
         default=None,
         description="FFmpeg可执行文件所在目录路径，不是ffmpeg文件本身的路径",
     )
+    video_cache_max_gb: float = Field(
+        default=2.0,
+        description="视频缓存容量上限（GB），相同视频再次出现时直接发送缓存，0 表示不缓存",
+    )
+    download_workers: int = Field(default=2, description="同时进行的下载任务数（全局）")
+    download_group_limit: int = Field(
+        default=1, description="单个群同时进行的下载任务数，0 表示不限制"
+    )
+    download_queue_size: int = Field(
+        default=20, description="等待下载的任务队列长度上限，0 表示不限制"
+    )
+    download_queue_overflow: Literal["reject", "drop_oldest"] = Field(
+        default="reject",
+        description="队列已满时的处理策略：reject 拒绝新任务并回复，drop_oldest 丢弃最早排队的任务",
+    )
+    priority_scheduling: bool = Field(
+        default=False,
+        description="按预估大小调度排队任务（短任务优先，等待越久优先级越高），下载前先解析视频信息",
+    )
+    schedule_aging_mb: float = Field(
+        default=20,
+        description="优先级调度中每等待一分钟抵扣的预估大小（MB），防止大视频一直排不上",
+    )
+    max_duration_minutes: int = Field(
+        default=0,
+        description="视频时长上限（分钟），下载前检查，超过的不下载，0 表示不限制",
+    )
+    preflight_workers: int = Field(
+        default=2,
+        description="同时进行的下载前预检数，预检使用独立的线程/进程，不占用下载并发",
+    )
+    download_process_workers: int = Field(
+        default=0,
+        description="yt-dlp 下载进程数，大于 0 时在独立的常驻进程中下载，0 表示在线程中下载",
+    )
+    short_link_cache_size: int = Field(
+        default=1024, description="b23.tv 短链解析结果缓存条数，0 表示不缓存"
+    )
+    short_link_cache_ttl_hours: float = Field(
+        default=168, description="短链解析结果缓存有效期（小时）"
+    )
+    short_link_cache_persist: bool = Field(
+        default=True, description="是否将短链解析缓存保存到数据目录"
+    )
+    ffprobe_timeout: float = Field(
+        default=30, description="ffprobe 检查视频分辨率的超时时间（秒）"
+    )
+    transcode_enabled: bool = Field(
+        default=False,
+        description="视频超出大小或清晰度限制时是否用ffmpeg重新编码，而不是直接丢弃",
+    )
+    transcode_preset: str = Field(
+        default="veryfast", description="x264 编码预设，越慢压缩率越高"
+    )
+    transcode_threads: int = Field(
+        default=0, description="单个转码任务使用的线程数，0 表示由ffmpeg自动决定"
+    )
+    transcode_workers: int = Field(
+        default=1, description="同时进行的转码任务数，与下载并发分开计算"
+    )
+    transcode_two_pass: bool = Field(
+        default=False, description="按目标大小转码时是否使用两遍编码（更准确但更慢）"
+    )
+    metrics_window: int = Field(
+        default=500, description="每个阶段保留用于计算耗时分位数的最近样本数"
+    )
+    metrics_file: Optional[str] = Field(
+        default=None,
+        description="定期写入 Prometheus 文本格式指标的文件路径，留空则不写入",
+    )
+    metrics_port: int = Field(
+        default=0, description="本地 /metrics HTTP 端口，0 表示不启动"
+    )
+    metrics_host: str = Field(default="127.0.0.1", description="/metrics 监听地址")
+    job_store_enabled: bool = Field(
+        default=True,
+        description="是否将任务记录到数据目录的 SQLite 中，重启后恢复未完成的任务",
+    )
+    job_resume_max_age_hours: float = Field(
+        default=6, description="重启后只恢复该时间内提交的未完成任务（小时）"
+    )
+    job_max_attempts: int = Field(
+        default=3, description="单个任务因重启中断后最多执行的次数"
+    )
+    job_retention_days: float = Field(default=7, description="已结束任务记录的保留天数")
+    job_retention_max_rows: int = Field(
+        default=5000, description="已结束任务记录的最大保留条数，0 表示不限制"
+    )
+    download_dir_max_gb: float = Field(
+        default=5.0,
+        description="下载目录（不含缓存）的磁盘预算（GB），超出时从最旧的文件开始清理，0 表示不限制",
+    )
+    download_file_max_age_hours: float = Field(
+        default=6, description="下载目录中文件的最长保留时间（小时），0 表示不限制"
+    )
+    disk_min_free_mb: int = Field(
+        default=500, description="磁盘剩余空间低于该值（MB）时拒绝新任务，0 表示不检查"
+    )
+    janitor_interval_seconds: float = Field(
+        default=600, description="下载目录定期清理的间隔（秒）"
+    )
+    download_connections: int = Field(
+        default=4,
+        description="单个下载任务的并发连接数（分片并发数，以及 aria2c 每个文件的连接数）",
+    )
+    download_parallel_streams: bool = Field(
+        default=True, description="是否同时下载视频流与音频流后再合并（需要ffmpeg）"
+    )
+    download_http_chunk_size_mb: float = Field(
+        default=0,
+        description="按该大小（MB）分块请求媒体文件，可绕过部分CDN对单连接的限速，0 表示不分块",
+    )
+    download_external_downloader: Optional[Literal["aria2c"]] = Field(
+        default=None,
+        description="外部下载器，目前支持 aria2c，未安装时自动使用内置下载器",
+    )
+    download_stream_remux: bool = Field(
+        default=False,
+        description="音视频流经管道直接送入 ffmpeg 封装为最终文件，不生成中间文件（仅 POSIX）",
+    )
+    bandwidth_limit_mb: float = Field(
+        default=0,
+        description="所有下载任务共享的总带宽上限（MB/s），按进行中的任务平分，0 表示不限制",
+    )
+    bandwidth_send_headroom: float = Field(
+        default=0.3, description="有视频正在发送时为上传预留的带宽比例（0~0.9）"
+    )
+    file_server_enabled: bool = Field(
+        default=False,
+        description="是否启用内置文件服务，发送视频时传递签名链接而非本地路径（OneBot 实现与机器人不在同一文件系统时使用）",
+    )
+    file_server_host: str = Field(default="0.0.0.0", description="文件服务监听地址")
+    file_server_port: int = Field(default=8090, description="文件服务监听端口")
+    file_server_public_url: Optional[str] = Field(
+        default=None,
+        description="OneBot 实现访问文件服务使用的地址，如 http://bot:8090，留空则使用监听地址",
+    )
+    file_server_url_ttl: int = Field(default=600, description="签名链接的有效期（秒）")
+    send_timeout_base: float = Field(
+        default=60, description="发送视频的基础超时时间（秒）"
+    )
+    send_timeout_per_mb: float = Field(
+        default=2.0, description="发送视频时每 MB 额外增加的超时时间（秒）"
+    )
+    send_retries: int = Field(default=2, description="发送视频失败后的重试次数")
+    send_retry_backoff: float = Field(
+        default=5, description="发送重试的初始等待时间（秒），之后每次翻倍"
+    )
+    send_confirm_wait: float = Field(
+        default=30,
+        description="发送超时后查询群消息记录确认是否已发出的最长等待时间（秒）",
+    )
+    max_videos_per_message: int = Field(
+        default=3,
+        description="单条消息最多处理的视频数（含番剧季/合集展开的分集），超出的忽略",
+    )
+    native_resolver: bool = Field(
+        default=False,
+        description="普通视频先直接请求 view/playurl 接口解析 DASH 流，失败时改用 yt-dlp",
+    )
+    bili_api_base: str = Field(
+        default="https://api.bilibili.com", description="快速解析使用的B站 API 地址"
+    )
+    info_cache_ttl: int = Field(
+        default=1800,
+        description="视频解析结果缓存时间（秒），流地址失效时自动重新解析，0 表示不缓存",
+    )
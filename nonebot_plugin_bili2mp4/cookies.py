@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from nonebot import logger
+
+DEFAULT_ACCOUNT = "default"
+
+# 触发风控/限流时的冷却时间（秒）
+RATE_LIMIT_COOLDOWN = 600
+_RATE_LIMIT_MARKERS = (
+    "http error 412",
+    "http error 429",
+    "precondition failed",
+    "too many requests",
+    "-352",
+    "-412",
+)
+
+
+def is_rate_limited(err: Exception) -> bool:
+    msg = str(err).lower()
+    return any(k in msg for k in _RATE_LIMIT_MARKERS)
+
+
+def cookie_to_netscape(cookie_string: str) -> Optional[str]:
+    """将 Cookie 字符串转为 Netscape 格式文本，无有效字段时返回 None"""
+    cookie_string = (cookie_string or "").strip().strip(";")
+    pairs = []
+    for part in cookie_string.split(";"):
+        part = part.strip()
+        if "=" not in part:
+            continue
+        k, v = part.split("=", 1)
+        if k and v:
+            pairs.append((k.strip(), v.strip()))
+    if not pairs:
+        return None
+
+    expiry = int(time.time()) + 180 * 24 * 3600
+    lines = [
+        "# Netscape HTTP Cookie File",
+        "# Generated by nonebot_plugin_bili2mp4",
+        "",
+    ]
+    for k, v in pairs:
+        # domain include_subdomains path secure expiry name value
+        lines.append(f".bilibili.com\tTRUE\t/\tFALSE\t{expiry}\t{k}\t{v}")
+    return "\n".join(lines) + "\n"
+
+
+class CookieAccount:
+    """一个B站账号的 Cookie 及其使用情况"""
+
+    def __init__(self, name: str, cookie: str, cookiefile: Optional[str]) -> None:
+        self.name = name
+        self.cookie = cookie
+        self.cookiefile = cookiefile
+        self.last_used = 0.0
+        self.uses = 0
+        self.ok = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def cooling(self) -> bool:
+        return self.cooldown_until > time.time()
+
+
+class CookiePool:
+    """
+    多账号 Cookie 池。
+
+    每个账号的 Cookie 文件只在设置或修改时写入一次，下载时按最久未使用选择账号，
+    遇到 412/风控的账号进入冷却，期间优先使用其他账号。
+    """
+
+    def __init__(self, cookie_dir: Path) -> None:
+        self.cookie_dir = cookie_dir
+        self.cookie_dir.mkdir(parents=True, exist_ok=True)
+        self.accounts: Dict[str, CookieAccount] = {}
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    def _path(self, name: str) -> Path:
+        return self.cookie_dir / f"{name}.txt"
+
+    def set(self, name: str, cookie: str) -> None:
+        """添加或更新账号；Cookie 未变化时不重写文件"""
+        cookie = (cookie or "").strip()
+        old = self.accounts.get(name)
+        if old is not None and old.cookie == cookie:
+            return
+        path = self._path(name)
+        text = cookie_to_netscape(cookie)
+        cookiefile: Optional[str] = None
+        if text is not None:
+            try:
+                tmp = path.with_suffix(".tmp")
+                tmp.write_text(text, encoding="utf-8")
+                os.replace(tmp, path)
+                cookiefile = str(path)
+            except Exception as e:
+                logger.warning(f"bili2mp4: 写入 Cookie 文件失败（{name}）: {e}")
+        account = CookieAccount(name, cookie, cookiefile)
+        if old is not None:
+            account.last_used, account.uses = old.last_used, old.uses
+            account.ok, account.failures = old.ok, old.failures
+            account.rate_limited = old.rate_limited
+        self.accounts[name] = account
+        logger.info(f"bili2mp4: Cookie 已设置（账号 {name}）")
+
+    def remove(self, name: str) -> bool:
+        if self.accounts.pop(name, None) is None:
+            return False
+        self._path(name).unlink(missing_ok=True)
+        return True
+
+    def sync(self, cookies: Dict[str, str]) -> None:
+        """按给定的 账号->Cookie 更新账号池，删除不在其中的账号及其文件"""
+        for name in list(self.accounts):
+            if name not in cookies:
+                self.remove(name)
+        for name, cookie in cookies.items():
+            if cookie:
+                self.set(name, cookie)
+        # 清理上次运行遗留的文件
+        for f in self.cookie_dir.glob("*.txt"):
+            if f.stem not in self.accounts:
+                f.unlink(missing_ok=True)
+
+    def candidates(self, prefer: Optional[CookieAccount] = None) -> List[CookieAccount]:
+        """
+        按优先顺序返回账号：未冷却的在前，各自按最久未使用排序。
+
+        prefer 为任务预留的账号，仍在池中且未冷却时排在最前。
+        """
+        accounts = sorted(
+            self.accounts.values(), key=lambda a: (a.cooling, a.last_used)
+        )
+        if prefer is not None and self.accounts.get(prefer.name) is prefer:
+            if not prefer.cooling:
+                accounts.remove(prefer)
+                accounts.insert(0, prefer)
+        return accounts
+
+    def reserve(self) -> Optional[CookieAccount]:
+        """为一个任务选定账号（最久未使用），预检与下载使用同一账号"""
+        accounts = self.candidates()
+        if not accounts:
+            return None
+        self.mark_used(accounts[0])
+        return accounts[0]
+
+    def mark_used(self, account: CookieAccount) -> None:
+        account.last_used = time.time()
+        account.uses += 1
+
+    def report(self, account: CookieAccount, err: Optional[Exception]) -> None:
+        if err is None:
+            account.ok += 1
+            return
+        account.failures += 1
+        if is_rate_limited(err):
+            account.rate_limited += 1
+            account.cooldown_until = time.time() + RATE_LIMIT_COOLDOWN
+            logger.warning(
+                f"bili2mp4: 账号 {account.name} 触发风控，冷却 {RATE_LIMIT_COOLDOWN}s"
+            )
+
+    def stats(self) -> List[Dict]:
+        now = time.time()
+        return [
+            {
+                "name": a.name,
+                "uses": a.uses,
+                "ok": a.ok,
+                "failures": a.failures,
+                "rate_limited": a.rate_limited,
+                "cooldown": max(0.0, a.cooldown_until - now),
+                "idle": now - a.last_used if a.last_used else None,
+            }
+            for a in self.accounts.values()
+        ]
@@ -0,0 +1,1158 @@
+"""
+yt-dlp 下载逻辑。
+
+本模块只依赖标准库与 yt-dlp，既可在插件进程的线程池中调用，
+也可作为独立的下载进程运行（见 procpool.py），因此不能使用相对导入或 nonebot。
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+# 以 runpy 运行时 __name__ 为 __main__，因此固定日志名；插件进程中由 main.py 转发到 nonebot 日志
+_log = logging.getLogger("nonebot_plugin_bili2mp4.downloader")
+
+
+class SizeLimitExceeded(RuntimeError):
+    """预估大小超过限制，放弃下载"""
+
+
+class DurationLimitExceeded(SizeLimitExceeded):
+    """视频时长超过限制，放弃下载"""
+
+
+def build_browser_like_headers() -> dict:
+    return {
+        "User-Agent": (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/120.0.0.0 Safari/537.36"
+        ),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+        "Referer": "https://www.bilibili.com/",
+        "Origin": "https://www.bilibili.com",
+        "Connection": "keep-alive",
+        "Upgrade-Insecure-Requests": "1",
+        "Sec-Fetch-Site": "same-origin",
+        "Sec-Fetch-Mode": "navigate",
+        "Sec-Fetch-Dest": "document",
+    }
+
+
+def _build_format_candidates(
+    height_limit: int, size_limit_mb: int, allow_oversize: bool = False
+) -> List[str]:
+    """
+    构建兜底的格式选择串（本地选格式失败时使用）。
+
+    设置大小限制时按 filesize/filesize_approx 过滤，大小未知的格式放行，由下载后的检查兜底；
+    allow_oversize 为 True（下载后会转码）时最后仍退回不限大小的格式。
+    """
+    h = height_limit if height_limit and height_limit > 0 else None
+    size = ""
+    if size_limit_mb and size_limit_mb > 0:
+        size = f"[filesize<?{size_limit_mb}MiB][filesize_approx<?{size_limit_mb}MiB]"
+
+    candidates = []
+    if h:
+        # 优先不超过清晰度限制的格式
+        candidates.append(f"bv*[height<={h}]{size}+ba/best[height<={h}]{size}")
+    # 退回任意清晰度，由下载后的检查兜底
+    candidates.append(f"bv*{size}+ba/best{size}")
+    if size and allow_oversize:
+        candidates.append("bv*+ba/best")
+    return candidates
+
+
+def _estimate_bytes(fmt: Dict[str, Any], duration: Optional[float]) -> Optional[float]:
+    """按 filesize / filesize_approx / 码率×时长 估算格式大小（字节）"""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return float(size)
+    tbr = fmt.get("tbr") or ((fmt.get("vbr") or 0) + (fmt.get("abr") or 0))
+    if tbr and duration:
+        return float(tbr) * 1000 / 8 * float(duration)
+    return None
+
+
+def _select_format(
+    info: Dict[str, Any],
+    height_limit: int,
+    size_limit_mb: int,
+    allow_oversize: bool = False,
+) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    在 info["formats"] 中选出满足清晰度与大小限制的最佳 视频+音频 组合。
+
+    返回 (yt-dlp 格式串, 预估字节数)；格式信息不足时返回 None 交给 yt-dlp 自行选择；
+    所有组合都超出大小限制时抛出 SizeLimitExceeded，allow_oversize 为 True
+    （下载后会转码）时改为返回预估最小的组合。
+    """
+    formats = info.get("formats") or []
+    duration = info.get("duration")
+    videos = [f for f in formats if f.get("vcodec") not in (None, "none")]
+    audios = [
+        f
+        for f in formats
+        if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")
+    ]
+    if not videos:
+        return None
+
+    if height_limit and height_limit > 0:
+        within = [f for f in videos if (f.get("height") or 0) <= height_limit]
+        videos = within or [min(videos, key=lambda f: f.get("height") or 0)]
+    videos.sort(key=lambda f: (f.get("height") or 0, f.get("tbr") or 0), reverse=True)
+    audios.sort(key=lambda f: f.get("abr") or f.get("tbr") or 0, reverse=True)
+
+    limit = size_limit_mb * 1024 * 1024 if size_limit_mb and size_limit_mb > 0 else 0
+    smallest: Optional[float] = None
+    smallest_spec = ""
+    for v in videos:
+        # 自带音轨的格式无需再配音频
+        if v.get("acodec") not in (None, "none") or not audios:
+            pairs = [(v["format_id"], _estimate_bytes(v, duration))]
+        else:
+            pairs = []
+            for a in audios:
+                vs, as_ = _estimate_bytes(v, duration), _estimate_bytes(a, duration)
+                est = vs + as_ if vs is not None and as_ is not None else None
+                pairs.append((f"{v['format_id']}+{a['format_id']}", est))
+        for spec, est in pairs:
+            if not limit or est is None or est <= limit:
+                return spec, est
+            if smallest is None or est < smallest:
+                smallest, smallest_spec = est, spec
+
+    if allow_oversize:
+        return smallest_spec, smallest
+    raise SizeLimitExceeded(
+        f"预估大小 {smallest / 1024 / 1024:.1f}MB 超过限制 {size_limit_mb}MB"
+    )
+
+
+def _check_duration(info: Dict[str, Any], max_duration: float) -> None:
+    """时长（秒）超过 max_duration 时抛出 DurationLimitExceeded，0 表示不限制"""
+    duration = info.get("duration")
+    if max_duration and max_duration > 0 and duration and duration > max_duration:
+        raise DurationLimitExceeded(
+            f"时长 {duration / 60:.1f} 分钟超过限制 {max_duration / 60:g} 分钟"
+        )
+
+
+@contextmanager
+def _private_cookiefile(cookiefile: Optional[str]) -> Iterator[Optional[str]]:
+    """
+    yt-dlp 关闭时会把 Cookie 写回 cookiefile（先清空再写入），
+    并发任务共用同一文件时可能读到空文件，因此每次使用一份临时副本，用完删除。
+    """
+    if not cookiefile:
+        yield cookiefile
+        return
+    fd, tmp = tempfile.mkstemp(prefix="bili2mp4-cookies-", suffix=".txt")
+    os.close(fd)
+    try:
+        try:
+            shutil.copyfile(cookiefile, tmp)
+        except OSError as e:
+            _log.warning(f"bili2mp4: 复制 Cookie 文件失败，改用 Cookie 请求头: {e}")
+            yield None
+        else:
+            yield tmp
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _build_ydl_opts(job: Dict[str, Any], out_dir: Path) -> Dict[str, Any]:
+    headers = build_browser_like_headers()
+    ydl_opts = {
+        "outtmpl": str(out_dir / "%(title).80s [%(id)s].%(ext)s"),
+        "noplaylist": True,
+        "merge_output_format": "mp4",
+        # 文件名由标题和ID确定，重启后可接着 .part 文件续传
+        "continuedl": True,
+        "quiet": False,
+        "no_warnings": False,
+        "http_headers": headers,
+        "extractor_args": {
+            "bili": {
+                "player_client": ["android", "web"],
+                "lang": ["zh-CN"],
+            }
+        },
+    }
+
+    if job.get("ffmpeg_dir"):
+        ydl_opts["ffmpeg_location"] = job["ffmpeg_dir"]
+
+    # 分片格式（HLS/DASH 分段）并发下载的分片数
+    connections = max(1, int(job.get("connections") or 1))
+    ydl_opts["concurrent_fragment_downloads"] = connections
+    if job.get("http_chunk_size"):
+        ydl_opts["http_chunk_size"] = int(job["http_chunk_size"])
+    if job.get("ratelimit"):
+        ydl_opts["ratelimit"] = float(job["ratelimit"])
+
+    # 外部下载器（目前支持 aria2c），未安装时使用内置下载器
+    external = job.get("external_downloader")
+    if external == "aria2c" and shutil.which("aria2c"):
+        ydl_opts["external_downloader"] = {"default": "aria2c"}
+        ydl_opts["external_downloader_args"] = {
+            "aria2c": [
+                f"--max-connection-per-server={min(connections, 16)}",
+                f"--split={connections}",
+                "--min-split-size=1M",
+                "--file-allocation=none",
+                "--summary-interval=0",
+            ]
+        }
+
+    # 设置 Cookie
+    if job.get("cookiefile"):
+        ydl_opts["cookiefile"] = job["cookiefile"]
+    elif job.get("cookie"):
+        headers["Cookie"] = job["cookie"]
+    return ydl_opts
+
+
+def _is_format_error(err: Exception) -> bool:
+    """仅「格式不可用」类错误值得换下一个候选格式重试"""
+    msg = str(err).lower()
+    return any(
+        k in msg
+        for k in (
+            "requested format is not available",
+            "no video formats found",
+            "format is not available",
+        )
+    )
+
+
+class _StageClock:
+    """通过 yt-dlp 的进度与后处理钩子记录解析、下载、合并各阶段耗时"""
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {"extract": 0.0, "download": 0.0, "merge": 0.0}
+        self.bytes = 0
+        self._marks: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.timings[stage] += seconds
+
+    def progress_hook(self, d: Dict[str, Any]) -> None:
+        # 按文件计时，音视频并行下载时由调用方改用整体耗时
+        now = time.monotonic()
+        key = f"download:{d.get('filename')}"
+        if d.get("status") == "downloading":
+            self._marks.setdefault(key, now)
+        elif d.get("status") == "finished":
+            start = self._marks.pop(key, now)
+            self.add("download", now - start)
+            self.bytes += int(d.get("total_bytes") or d.get("downloaded_bytes") or 0)
+
+    def postprocessor_hook(self, d: Dict[str, Any]) -> None:
+        if d.get("postprocessor") != "Merger":
+            return
+        now = time.monotonic()
+        if d.get("status") == "started":
+            self._marks["merge"] = now
+        elif d.get("status") == "finished":
+            self.add("merge", now - self._marks.pop("merge", now))
+
+
+class _RateControl:
+    """
+    在下载过程中应用调用方下发的限速（control["ratelimit"]，字节/秒）。
+
+    yt-dlp 的 HTTP 下载器每个数据块都会读取 ydl.params["ratelimit"]，
+    因此在进度钩子中更新即可实时生效；并行下载多个流时平分该速度。
+    """
+
+    def __init__(self, ydl, control: Optional[Dict[str, Any]]) -> None:
+        self.ydl = ydl
+        self.control = control
+        self.streams = 1
+
+    def apply(self, d: Optional[Dict[str, Any]] = None) -> None:
+        if self.control is None:
+            return
+        rate = self.control.get("ratelimit")
+        self.ydl.params["ratelimit"] = rate / self.streams if rate else None
+
+
+def _ffmpeg_exe(ffmpeg_dir: Optional[str]) -> str:
+    exe = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
+    return str(Path(ffmpeg_dir) / exe) if ffmpeg_dir else exe
+
+
+def _merge_streams(ffmpeg_dir: Optional[str], video: str, audio: str, out: str) -> None:
+    tmp = out + ".merging.mp4"
+    proc = subprocess.run(
+        [_ffmpeg_exe(ffmpeg_dir), "-y", "-loglevel", "error", "-i", video, "-i", audio]
+        + ["-map", "0:v:0", "-map", "1:a:0", "-c", "copy"]
+        + ["-movflags", "+faststart", tmp],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        Path(tmp).unlink(missing_ok=True)
+        raise RuntimeError(f"合并失败: {proc.stderr.decode(errors='replace')[-300:]}")
+    os.replace(tmp, out)
+
+
+def _download_streams_parallel(
+    ydl,
+    info: Dict[str, Any],
+    job: Dict[str, Any],
+    clock: "_StageClock",
+    rate: _RateControl,
+) -> Optional[Dict[str, Any]]:
+    """
+    视频流与音频流同时下载后用 ffmpeg 合并，返回带 filepath 的结果信息。
+
+    选中的不是 视频+音频 组合时返回 None，交给 yt-dlp 按常规流程下载。
+    """
+    result = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    formats = result.get("requested_formats") or []
+    if len(formats) != 2:
+        return None
+
+    final = os.path.splitext(ydl.prepare_filename(result))[0] + ".mp4"
+    root = os.path.splitext(final)[0]
+    parts = []
+    for f in formats:
+        part = dict(result)
+        part.pop("requested_formats", None)
+        part.update(f)
+        parts.append((f"{root}.f{f['format_id']}.{f['ext']}", part))
+
+    start = time.monotonic()
+    rate.streams = 2
+    rate.apply()
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            ok = list(pool.map(lambda p: ydl.dl(p[0], p[1]), parts))
+    finally:
+        rate.streams = 1
+        rate.apply()
+    clock.timings["download"] = time.monotonic() - start
+    if not all(ok):
+        raise RuntimeError("音视频流下载失败")
+
+    start = time.monotonic()
+    _merge_streams(job.get("ffmpeg_dir"), parts[0][0], parts[1][0], final)
+    clock.add("merge", time.monotonic() - start)
+    for name, _ in parts:
+        Path(name).unlink(missing_ok=True)
+    result["filepath"] = final
+    return result
+
+
+# =========================
+# playurl 快速解析
+# =========================
+
+DEFAULT_API_BASE = "https://api.bilibili.com"
+_NATIVE_URL_RE = re.compile(r"/video/(BV[0-9A-Za-z]{10}|av\d+)", flags=re.IGNORECASE)
+_NATIVE_PAGE_RE = re.compile(r"[?&]p=(\d+)")
+
+
+def _cookie_header(job: Dict[str, Any]) -> str:
+    """由 Netscape Cookie 文件或 Cookie 字符串生成请求头"""
+    cookiefile = job.get("cookiefile")
+    if cookiefile:
+        pairs = []
+        try:
+            with open(cookiefile, encoding="utf-8") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 7 and not line.startswith("#"):
+                        pairs.append(f"{fields[5]}={fields[6]}")
+        except OSError:
+            pass
+        return "; ".join(pairs)
+    return job.get("cookie") or ""
+
+
+def _api_get(base: str, path: str, params: Dict[str, Any], headers: Dict[str, str]):
+    url = f"{base.rstrip('/')}{path}?{urlencode(params)}"
+    with urlopen(Request(url, headers=headers), timeout=10) as resp:
+        body = json.loads(resp.read().decode("utf-8"))
+    if body.get("code") != 0:
+        raise RuntimeError(f"{path} 返回 {body.get('code')}: {body.get('message')}")
+    return body.get("data") or {}
+
+
+def _native_extract(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    直接请求 view 与 playurl 接口，构造与 yt-dlp 解析结果同结构的视频信息。
+
+    只支持 BV/av 普通视频的 DASH 流；其他情况抛出异常，由调用方改用 yt-dlp。
+    """
+    m = _NATIVE_URL_RE.search(job["url"])
+    if not m:
+        raise ValueError("不支持的链接")
+    vid = m.group(1)
+    pm = _NATIVE_PAGE_RE.search(job["url"])
+    page = max(1, int(pm.group(1))) if pm else 1
+
+    headers = {
+        "User-Agent": build_browser_like_headers()["User-Agent"],
+        "Referer": "https://www.bilibili.com/",
+        "Origin": "https://www.bilibili.com",
+    }
+    cookie = _cookie_header(job)
+    if cookie:
+        headers["Cookie"] = cookie
+    base = job.get("api_base") or DEFAULT_API_BASE
+    key = ("aid", vid[2:]) if vid.lower().startswith("av") else ("bvid", vid)
+
+    view = _api_get(base, "/x/web-interface/view", dict([key]), headers)
+    pages = view.get("pages") or []
+    if page > len(pages):
+        raise ValueError(f"分P {page} 不存在")
+    part = pages[page - 1]
+    play = _api_get(
+        base,
+        "/x/player/playurl",
+        {key[0]: key[1], "cid": part["cid"], "qn": 127, "fnval": 4048, "fourk": 1},
+        headers,
+    )
+    dash = play.get("dash")
+    if not dash or not dash.get("video"):
+        raise ValueError("无 DASH 流")
+
+    duration = part.get("duration") or view.get("duration")
+    # CDN 校验 Referer，下载时不带 Cookie
+    media_headers = {k: v for k, v in headers.items() if k != "Cookie"}
+    formats = []
+    for v in dash.get("video") or []:
+        formats.append(
+            {
+                "format_id": f"{v['id']}-{v.get('codecid', 0)}",
+                "url": v.get("baseUrl") or v.get("base_url"),
+                "ext": "mp4",
+                "width": v.get("width"),
+                "height": v.get("height"),
+                "fps": float(v.get("frameRate") or 0) or None,
+                "vcodec": v.get("codecs") or "avc1",
+                "acodec": "none",
+                "tbr": (v.get("bandwidth") or 0) / 1000,
+                "http_headers": media_headers,
+            }
+        )
+    for a in dash.get("audio") or []:
+        formats.append(
+            {
+                "format_id": str(a["id"]),
+                "url": a.get("baseUrl") or a.get("base_url"),
+                "ext": "m4a",
+                "vcodec": "none",
+                "acodec": a.get("codecs") or "mp4a",
+                "abr": (a.get("bandwidth") or 0) / 1000,
+                "tbr": (a.get("bandwidth") or 0) / 1000,
+                "http_headers": media_headers,
+            }
+        )
+
+    title = view.get("title") or "B站视频"
+    video_id = view.get("bvid") or vid
+    if len(pages) > 1:
+        title = f"{title} p{page:02d} {part.get('part') or ''}".strip()
+        video_id = f"{video_id}_p{page}"
+    return {
+        "_type": "video",
+        "id": video_id,
+        "title": title,
+        "duration": duration,
+        "webpage_url": job["url"],
+        "extractor": "bilibili:native",
+        "extractor_key": "BiliBiliNative",
+        "http_headers": media_headers,
+        "formats": formats,
+    }
+
+
+# =========================
+# 解析结果缓存
+# =========================
+
+_DEADLINE_RE = re.compile(r"[?&]deadline=(\d+)")
+# 流地址剩余有效期不足该秒数时视为过期
+_STREAM_EXPIRY_MARGIN = 120
+_STALE_MARKERS = ("http error 403", "http error 410", "forbidden", "expired")
+
+
+def _is_stale_error(err: Exception) -> bool:
+    """流地址失效类错误：缓存的解析结果需要重新获取"""
+    msg = str(err).lower()
+    return any(k in msg for k in _STALE_MARKERS)
+
+
+def _stream_deadline(info: Dict[str, Any]) -> Optional[float]:
+    """各格式流地址中最早的 deadline 参数（B站 CDN 链接的过期时间）"""
+    deadlines = []
+    for fmt in info.get("formats") or []:
+        m = _DEADLINE_RE.search(fmt.get("url") or "")
+        if m:
+            deadlines.append(float(m.group(1)))
+    return min(deadlines) if deadlines else None
+
+
+class InfoCache:
+    """
+    已清理（sanitize）的视频解析结果缓存：进程内 LRU + 磁盘 TTL。
+
+    以规范链接与 Cookie 身份为键，超过 ttl 或流地址临近过期的条目视为失效；
+    下载遇到 403 等错误时由调用方 drop 后重新解析。
+    """
+
+    def __init__(
+        self, directory: Optional[Path], ttl: float, max_entries: int = 128
+    ) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, cookie: str = "") -> str:
+        identity = hashlib.sha1(cookie.encode()).hexdigest()[:12] if cookie else "anon"
+        return hashlib.sha1(f"{url}|{identity}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Optional[Path]:
+        return self.directory / f"{key}.json" if self.directory else None
+
+    def _fresh(self, created: float, info: Dict[str, Any]) -> bool:
+        now = time.time()
+        if now - created > self.ttl:
+            return False
+        deadline = _stream_deadline(info)
+        return deadline is None or deadline - now > _STREAM_EXPIRY_MARGIN
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            path = self._path(key)
+            try:
+                if path is not None and path.exists():
+                    with path.open(encoding="utf-8") as f:
+                        entry = (path.stat().st_mtime, json.load(f))
+            except (OSError, ValueError):
+                entry = None
+        if entry is None or not self._fresh(*entry):
+            if entry is not None:
+                self.drop(key)
+            self.misses += 1
+            return None
+        self._remember(key, entry)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def _remember(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key: str, info: Dict[str, Any]) -> None:
+        self._remember(key, (time.time(), copy.deepcopy(info)))
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            tmp = path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump(info, f, ensure_ascii=False, default=str)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            _log.warning(f"bili2mp4: 写入解析缓存失败: {e}")
+        self._puts += 1
+        if self._puts % 50 == 0:
+            self.prune()
+
+    def drop(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        path = self._path(key)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def prune(self) -> None:
+        """删除磁盘上已超过 ttl 的条目"""
+        if self.directory is None:
+            return
+        cutoff = time.time() - self.ttl
+        for f in self.directory.glob("*.json"):
+            try:
+                if f.stat().st_mtime < cutoff:
+                    f.unlink()
+            except OSError:
+                pass
+
+
+_info_cache: Optional[InfoCache] = None
+
+
+def _get_info_cache(job: Dict[str, Any]) -> Optional[InfoCache]:
+    """按任务中的设置获取（或重建）本进程的解析缓存，ttl 为 0 时不缓存"""
+    global _info_cache
+    ttl = float(job.get("info_cache_ttl") or 0)
+    if ttl <= 0:
+        return None
+    directory = Path(job["info_cache_dir"]) if job.get("info_cache_dir") else None
+    cache = _info_cache
+    if cache is None or cache.ttl != ttl or cache.directory != directory:
+        cache = _info_cache = InfoCache(directory, ttl)
+    return cache
+
+
+def _pipe(size: int = 1 << 20) -> Tuple[int, int]:
+    """创建管道，尽量调大缓冲区以减少读写双方互相等待"""
+    r, w = os.pipe()
+    try:
+        import fcntl
+
+        fcntl.fcntl(w, getattr(fcntl, "F_SETPIPE_SZ", 1031), size)
+    except (ImportError, OSError):
+        pass
+    return r, w
+
+
+def _download_streams_piped(
+    ydl,
+    info: Dict[str, Any],
+    job: Dict[str, Any],
+    clock: "_StageClock",
+    rate: _RateControl,
+) -> Optional[Dict[str, Any]]:
+    """
+    视频流与音频流边下载边经管道送入同一个 ffmpeg 封装，直接写出带 faststart 的最终文件。
+
+    不落地中间文件，磁盘写入与峰值占用约为分别下载后合并的一半；
+    只支持直连 http(s) 的 视频+音频 组合（如B站 DASH 流），其他情况返回 None。
+    """
+    try:
+        from yt_dlp.networking import Request  # type: ignore
+    except ImportError:
+        from urllib.request import Request
+
+    result = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    formats = result.get("requested_formats") or []
+    if len(formats) != 2 or any(
+        f.get("protocol") not in ("http", "https") for f in formats
+    ):
+        return None
+    formats = sorted(formats, key=lambda f: f.get("vcodec") in (None, "none"))
+
+    final = os.path.splitext(ydl.prepare_filename(result))[0] + ".mp4"
+    tmp = final + ".muxing.mp4"
+    pipes = [_pipe(), _pipe()]
+    cmd = [_ffmpeg_exe(job.get("ffmpeg_dir")), "-y", "-loglevel", "error"]
+    for r, _ in pipes:
+        cmd += ["-i", f"pipe:{r}"]
+    cmd += ["-map", "0:v:0", "-map", "1:a:0", "-c", "copy"]
+    cmd += ["-movflags", "+faststart", tmp]
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            pass_fds=[r for r, _ in pipes],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+    except BaseException:
+        for _, w in pipes:
+            os.close(w)
+        raise
+    finally:
+        for r, _ in pipes:
+            os.close(r)
+
+    lock = threading.Lock()
+    rate.streams = 2
+
+    def pump(fmt: Dict[str, Any], fd: int) -> None:
+        # 与 yt-dlp 下载器一致，每个数据块都按当前限速检查
+        start = time.monotonic()
+        sent = 0
+        with os.fdopen(fd, "wb") as out:
+            req = Request(fmt["url"], headers=fmt.get("http_headers") or {})
+            with ydl.urlopen(req) as resp:
+                while True:
+                    chunk = resp.read(256 * 1024)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    sent += len(chunk)
+                    with lock:
+                        clock.bytes += len(chunk)
+                    rate.apply()
+                    limit = ydl.params.get("ratelimit")
+                    if limit:
+                        ahead = sent / limit - (time.monotonic() - start)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+    start = time.monotonic()
+    rate.apply()
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(pump, f, w) for f, (_, w) in zip(formats, pipes)]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # 结束 ffmpeg，另一路写入随之因管道断开而退出
+                proc.kill()
+                raise
+        clock.timings["download"] = time.monotonic() - start
+        # 两路数据写完后 ffmpeg 收尾并执行 faststart 重排，计为合并耗时
+        mux_start = time.monotonic()
+        _, err = proc.communicate()
+        clock.add("merge", time.monotonic() - mux_start)
+    except BaseException:
+        proc.wait()
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    finally:
+        rate.streams = 1
+        rate.apply()
+    if proc.returncode != 0:
+        Path(tmp).unlink(missing_ok=True)
+        raise RuntimeError(f"流式封装失败: {err.decode(errors='replace')[-300:]}")
+    os.replace(tmp, final)
+    result["filepath"] = final
+    result["pipeline"] = "stream"
+    return result
+
+
+def _resolve_info(ydl, job: Dict[str, Any], native: bool) -> Tuple[Dict[str, Any], str]:
+    """
+    解析视频信息，返回 (已清理的 info, 实际使用的解析方式)。
+
+    native 为真时先用 playurl 接口直接解析，失败再交给 yt-dlp（记为 fallback）。
+    """
+    from yt_dlp.utils import ExtractorError  # type: ignore
+    from yt_dlp.utils import DownloadError  # type: ignore
+
+    if native:
+        try:
+            return _native_extract(job), "native"
+        except Exception as e:
+            _log.warning(f"bili2mp4: 快速解析失败，改用 yt-dlp: {e}")
+    try:
+        info = ydl.extract_info(job["url"], download=False)
+    except (DownloadError, ExtractorError) as e:
+        raise RuntimeError(str(e))
+    resolver = "fallback" if native else "yt-dlp"
+    return ydl.sanitize_info(info, remove_private_keys=True), resolver
+
+
+def probe_video(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    下载前的预检：只解析视频信息，返回 title、duration 与 estimated_bytes。
+
+    job 字段与 download_video 相同，另有 max_duration（秒）；解析结果写入解析缓存，
+    随后的下载直接复用。时长超限抛出 DurationLimitExceeded，预估大小超限抛出
+    SizeLimitExceeded。
+    """
+    try:
+        from yt_dlp import YoutubeDL  # type: ignore
+    except Exception:
+        raise ImportError("yt_dlp not installed")
+
+    info_cache = _get_info_cache(job)
+    cache_key = InfoCache.key(job["url"], job.get("cookie") or "")
+    info = info_cache.get(cache_key) if info_cache is not None else None
+    resolver = "cache"
+    if info is None:
+        with _private_cookiefile(job.get("cookiefile")) as cookiefile:
+            opts = _build_ydl_opts(
+                dict(job, cookiefile=cookiefile), Path(job["out_dir"])
+            )
+            with YoutubeDL(opts) as ydl:
+                info, resolver = _resolve_info(ydl, job, bool(job.get("native")))
+        if info_cache is not None:
+            info_cache.put(cache_key, info)
+
+    _check_duration(info, job.get("max_duration") or 0)
+    picked = _select_format(
+        info,
+        job.get("height_limit", 0),
+        job.get("size_limit_mb", 0),
+        bool(job.get("allow_oversize")),
+    )
+    return {
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "estimated_bytes": picked[1] if picked else None,
+        "resolver": resolver,
+    }
+
+
+def download_video(
+    job: Dict[str, Any], control: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    下载单个视频，返回 (文件路径, 标题, 元数据)。
+
+    只解析一次视频信息，在本地按清晰度/大小限制选定格式后下载；
+    job 字段：url、cookie、cookiefile、out_dir、height_limit、size_limit_mb、
+    allow_oversize、max_duration、ffmpeg_dir、connections、parallel_streams、
+    http_chunk_size、external_downloader、stream_remux、ratelimit、native、api_base、
+    info_cache_ttl、info_cache_dir；control 为可在下载中途修改的限速设置。
+    native 为真时先用 playurl 接口直接解析，失败再交给 yt-dlp；
+    info_cache_ttl 大于 0 时复用缓存的解析结果，流地址失效时重新解析
+    """
+    try:
+        from yt_dlp import YoutubeDL  # type: ignore
+        from yt_dlp.utils import ExtractorError, ReExtractInfo  # type: ignore
+        from yt_dlp.utils import DownloadError  # type: ignore
+    except Exception:
+        raise ImportError("yt_dlp not installed")
+
+    out_dir = Path(job["out_dir"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    height_limit = job.get("height_limit", 0)
+    size_limit_mb = job.get("size_limit_mb", 0)
+
+    clock = _StageClock()
+    # yt-dlp 只读写 Cookie 文件的临时副本，见 _private_cookiefile
+    with _private_cookiefile(job.get("cookiefile")) as cookiefile, YoutubeDL(
+        _build_ydl_opts(dict(job, cookiefile=cookiefile), out_dir)
+    ) as ydl:
+        ydl.add_progress_hook(clock.progress_hook)
+        ydl.add_postprocessor_hook(clock.postprocessor_hook)
+        rate = _RateControl(ydl, control)
+        ydl.add_progress_hook(rate.apply)
+        extractions = 0
+        resolver = "native" if job.get("native") else "yt-dlp"
+        info_cache = _get_info_cache(job)
+        cache_key = InfoCache.key(job["url"], job.get("cookie") or "")
+        from_cache = False
+
+        def extract(fresh: bool = False) -> Dict[str, Any]:
+            nonlocal from_cache
+            if info_cache is not None and not fresh:
+                start = time.monotonic()
+                info = info_cache.get(cache_key)
+                clock.add("extract", time.monotonic() - start)
+                if info is not None:
+                    from_cache = True
+                    return info
+            from_cache = False
+            info = resolve()
+            if info_cache is not None:
+                info_cache.put(cache_key, info)
+            return info
+
+        def resolve() -> Dict[str, Any]:
+            nonlocal extractions, resolver
+            extractions += 1
+            start = time.monotonic()
+            try:
+                info, used = _resolve_info(ydl, job, resolver == "native")
+            finally:
+                clock.add("extract", time.monotonic() - start)
+            if resolver != "fallback":
+                resolver = used
+            return info
+
+        def plan(info: Dict[str, Any]) -> Tuple[List[str], Optional[float]]:
+            # 本地选定格式，预估超限则不下载任何媒体数据
+            candidates: List[str] = []
+            estimated: Optional[float] = None
+            picked = _select_format(
+                info, height_limit, size_limit_mb, bool(job.get("allow_oversize"))
+            )
+            if picked:
+                candidates.append(picked[0])
+                estimated = picked[1]
+            candidates += [
+                c
+                for c in _build_format_candidates(
+                    height_limit, size_limit_mb, bool(job.get("allow_oversize"))
+                )
+                if c not in candidates
+            ]
+            return candidates, estimated
+
+        info = extract()
+        # 未经预检的任务在这里检查时长，超限则不下载任何媒体数据
+        _check_duration(info, job.get("max_duration") or 0)
+        candidates, estimated = plan(info)
+
+        has_ffmpeg = bool(job.get("ffmpeg_dir") or shutil.which("ffmpeg"))
+        parallel = bool(job.get("parallel_streams")) and has_ffmpeg
+        piped = bool(job.get("stream_remux")) and has_ffmpeg and os.name == "posix"
+
+        def fetch(info: Dict[str, Any]) -> Dict[str, Any]:
+            if piped:
+                try:
+                    result = _download_streams_piped(ydl, info, job, clock, rate)
+                    if result is not None:
+                        return result
+                except Exception as e:
+                    _log.warning(f"bili2mp4: 流式封装失败，改用分别下载: {e}")
+            if parallel:
+                try:
+                    result = _download_streams_parallel(ydl, info, job, clock, rate)
+                    if result is not None:
+                        return result
+                except (DownloadError, ExtractorError, ReExtractInfo):
+                    raise
+                except Exception as e:
+                    # 并行下载失败时退回常规流程，已下载的分片可续传
+                    _log.warning(f"bili2mp4: 并行下载失败，改用常规下载: {e}")
+            return ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+        last_err: Optional[Exception] = None
+        attempts = 0
+        while candidates:
+            fmt = candidates.pop(0)
+            attempts += 1
+            ydl.format_selector = ydl.build_format_selector(fmt)
+            try:
+                try:
+                    result = fetch(info)
+                except ReExtractInfo:
+                    # 流地址过期等情况需要重新解析
+                    info = extract(fresh=True)
+                    result = fetch(info)
+            except Exception as e:
+                if from_cache and _is_stale_error(e):
+                    # 缓存的流地址已失效，重新解析后从头选择格式
+                    _log.info(f"bili2mp4: 缓存的解析结果已失效，重新解析: {e}")
+                    assert info_cache is not None
+                    info_cache.drop(cache_key)
+                    info = extract(fresh=True)
+                    candidates, estimated = plan(info)
+                    continue
+                if resolver == "native":
+                    # 快速解析得到的流下载失败时，整体交给 yt-dlp 重新解析
+                    _log.warning(f"bili2mp4: 快速解析的流下载失败，改用 yt-dlp: {e}")
+                    resolver = "fallback"
+                    info = extract(fresh=True)
+                    candidates, estimated = plan(info)
+                    continue
+                if isinstance(e, (DownloadError, ExtractorError)):
+                    if _is_format_error(e):
+                        last_err = e
+                        continue
+                    raise RuntimeError(str(e))
+                raise
+
+            title = result.get("title") or "B站视频"
+
+            # 定位文件
+            final_path = _locate_final_file(ydl, result)
+            if not final_path or not Path(final_path).exists():
+                raise RuntimeError("未找到已下载的视频文件，可能未安装 ffmpeg")
+            metadata = {
+                "id": result.get("id"),
+                "format": fmt,
+                "format_id": result.get("format_id"),
+                "width": result.get("width"),
+                "height": result.get("height") or 0,
+                "duration": result.get("duration"),
+                "estimated_bytes": estimated,
+                "attempts": attempts,
+                "extractions": extractions,
+                "resolver": "cache" if from_cache else resolver,
+                "pipeline": result.get("pipeline") or "files",
+                "timings": clock.timings,
+                "bytes": clock.bytes,
+            }
+            return final_path, title, metadata
+
+    if last_err:
+        raise RuntimeError(str(last_err))
+    raise RuntimeError("无法下载该视频")
+
+
+def list_entries(
+    url: str, limit: int, cookiefile: Optional[str] = None, cookie: str = ""
+) -> List[str]:
+    """
+    列出番剧季/合集中前 limit 个视频的链接。
+
+    只请求列表接口（extract_flat），不解析各视频的播放信息。
+    """
+    try:
+        from yt_dlp import YoutubeDL  # type: ignore
+        from yt_dlp.utils import ExtractorError  # type: ignore
+        from yt_dlp.utils import DownloadError  # type: ignore
+    except Exception:
+        raise ImportError("yt_dlp not installed")
+
+    headers = build_browser_like_headers()
+    opts: Dict[str, Any] = {
+        "extract_flat": "in_playlist",
+        "playlistend": max(1, int(limit)),
+        "quiet": True,
+        "no_warnings": True,
+        "http_headers": headers,
+    }
+    with _private_cookiefile(cookiefile) as private:
+        if private:
+            opts["cookiefile"] = private
+        elif cookie:
+            headers["Cookie"] = cookie
+        with YoutubeDL(opts) as ydl:
+            try:
+                info = ydl.extract_info(url, download=False)
+            except (DownloadError, ExtractorError) as e:
+                raise RuntimeError(str(e))
+    urls: List[str] = []
+    for entry in (info or {}).get("entries") or []:
+        if len(urls) >= limit:
+            break
+        entry_url = (entry or {}).get("url") or (entry or {}).get("webpage_url")
+        if entry_url:
+            urls.append(entry_url)
+    return urls
+
+
+def _locate_final_file(ydl, info) -> Optional[str]:
+    for key in ("requested_downloads", "requested_formats"):
+        arr = info.get(key)
+        if isinstance(arr, list):
+            for it in arr:
+                fp = it.get("filepath")
+                if fp and os.path.exists(fp):
+                    return fp
+    for key in ("filepath", "_filename"):
+        fp = info.get(key)
+        if fp and os.path.exists(fp):
+            return fp
+    # 预测合并后 mp4
+    base = ydl.prepare_filename(info)
+    root, _ = os.path.splitext(base)
+    candidate = root + ".mp4"
+    if os.path.exists(candidate):
+        return candidate
+    # 兜底：按视频ID在目录中搜
+    vid = info.get("id") or ""
+    if vid:
+        dirpath = Path(os.path.dirname(base) or os.getcwd())
+        try:
+            files = [dirpath / f for f in os.listdir(dirpath) if vid in f]
+            if files:
+                files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+                return str(files[0])
+        except Exception:
+            pass
+    return None
+
+
+# =========================
+# 下载进程入口
+# =========================
+
+
+def _worker_main() -> None:
+    """
+    下载进程主循环：从 stdin 逐行读取 JSON 任务，结果写回 stdout。
+
+    action 为 probe 的任务只做下载前预检，其余任务执行下载。
+
+    yt-dlp 自身的输出被重定向到 stderr，避免污染结果通道。
+    """
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    # 预先导入 yt-dlp，后续任务无需重复加载
+    try:
+        import yt_dlp  # type: ignore # noqa: F401
+    except Exception:
+        pass
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s | %(message)s",
+    )
+
+    channel.write(json.dumps({"ready": True}) + "\n")
+    channel.flush()
+
+    # 读取线程：任务放入队列，{"id", "control"} 行实时更新对应任务的限速等设置
+    jobs: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+    control: Dict[str, Any] = {}
+    current: Dict[str, Any] = {"id": None}
+
+    def reader() -> None:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            msg = json.loads(line)
+            if "control" in msg:
+                if msg.get("id") == current["id"]:
+                    control.update(msg["control"])
+            else:
+                jobs.put(msg)
+        jobs.put(None)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        current["id"] = job.get("id")
+        control.clear()
+        control["ratelimit"] = job.get("ratelimit")
+        try:
+            if job.get("action") == "probe":
+                result: Any = probe_video(job)
+            else:
+                result = list(download_video(job, control))
+            reply = {"id": job.get("id"), "ok": True, "result": result}
+        except Exception as e:
+            reply = {
+                "id": job.get("id"),
+                "ok": False,
+                "error": str(e),
+                "kind": type(e).__name__,
+            }
+        channel.write(json.dumps(reply, ensure_ascii=False, default=str) + "\n")
+        channel.flush()
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from nonebot import logger
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CONTENT_TYPES = {".mp4": "video/mp4", ".m4a": "audio/mp4", ".webm": "video/webm"}
+
+
+class FileServer:
+    """
+    向 OneBot 实现提供下载目录中视频文件的内置 HTTP 服务。
+
+    只接受带签名且未过期的链接（/v/<相对路径>?e=<过期时间>&s=<签名>），
+    支持 Range 请求，文件内容通过 sendfile 零拷贝发送。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        host: str,
+        port: int,
+        public_url: Optional[str] = None,
+        ttl: float = 600,
+    ) -> None:
+        self.root = root.resolve()
+        self.host = host
+        self.port = port
+        if not public_url:
+            public_host = "127.0.0.1" if host in ("0.0.0.0", "::", "") else host
+            public_url = f"http://{public_host}:{port}"
+        self.public_url = public_url.rstrip("/")
+        self.ttl = ttl
+        self.served_bytes = 0
+        self.requests = 0
+        self._secret = os.urandom(32)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _signature(self, rel: str, expires: int) -> str:
+        msg = f"{rel}|{expires}".encode()
+        return hmac.new(self._secret, msg, hashlib.sha256).hexdigest()[:32]
+
+    def sign(self, path: str) -> str:
+        """返回文件的短期签名链接"""
+        rel = Path(path).resolve().relative_to(self.root).as_posix()
+        expires = int(time.time() + self.ttl)
+        sig = self._signature(rel, expires)
+        return f"{self.public_url}/v/{quote(rel)}?e={expires}&s={sig}"
+
+    def _resolve(self, target: str) -> Optional[Path]:
+        parts = urlsplit(target)
+        if not parts.path.startswith("/v/"):
+            return None
+        rel = unquote(parts.path[3:])
+        qs = parse_qs(parts.query)
+        try:
+            expires = int(qs["e"][0])
+            sig = qs["s"][0]
+        except (KeyError, ValueError):
+            return None
+        if expires < time.time():
+            return None
+        if not hmac.compare_digest(sig, self._signature(rel, expires)):
+            return None
+        path = (self.root / rel).resolve()
+        if self.root not in path.parents or not path.is_file():
+            return None
+        return path
+
+    @staticmethod
+    def _parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+        """解析单段 Range，返回 [start, end]；不合法返回 None"""
+        m = _RANGE_RE.match(value.strip())
+        if not m or (not m.group(1) and not m.group(2)):
+            return None
+        if not m.group(1):
+            length = int(m.group(2))
+            if length == 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+        if start >= size or end < start:
+            return None
+        return start, min(end, size - 1)
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=30)
+            headers: Dict[str, str] = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=30)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+                await self._reply(writer, "405 Method Not Allowed")
+                return
+            path = self._resolve(parts[1])
+            if path is None:
+                await self._reply(writer, "404 Not Found")
+                return
+            self.requests += 1
+
+            size = path.stat().st_size
+            start, end = 0, size - 1
+            status = "200 OK"
+            extra = ""
+            if "range" in headers and size:
+                rng = self._parse_range(headers["range"], size)
+                if rng is None:
+                    await self._reply(
+                        writer,
+                        "416 Range Not Satisfiable",
+                        f"Content-Range: bytes */{size}\r\n",
+                    )
+                    return
+                start, end = rng
+                status = "206 Partial Content"
+                extra = f"Content-Range: bytes {start}-{end}/{size}\r\n"
+            length = end - start + 1 if size else 0
+
+            content_type = _CONTENT_TYPES.get(
+                path.suffix.lower(), "application/octet-stream"
+            )
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {length}\r\n"
+                    "Accept-Ranges: bytes\r\n"
+                    f"{extra}"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+            )
+            await writer.drain()
+            if parts[0] == "HEAD" or not length:
+                return
+            loop = asyncio.get_running_loop()
+            with path.open("rb") as f:
+                sent = await loop.sendfile(writer.transport, f, start, length)
+            self.served_bytes += sent
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.debug(f"bili2mp4: 文件服务请求失败: {e}")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _reply(
+        writer: asyncio.StreamWriter, status: str, extra: str = ""
+    ) -> None:
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n{extra}"
+                "Content-Length: 0\r\nConnection: close\r\n\r\n"
+            ).encode()
+        )
+        await writer.drain()
+
+    async def start(self) -> bool:
+        try:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port
+            )
+        except Exception as e:
+            logger.warning(f"bili2mp4: 文件服务 {self.host}:{self.port} 启动失败: {e}")
+            return False
+        logger.info(f"bili2mp4: 文件服务已启动，对外地址 {self.public_url}")
+        return True
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from nonebot import logger
+
+
+class DiskJanitor:
+    """
+    下载目录清理。
+
+    定期删除超过最长保留时间的文件，并在目录总大小超出预算时从最旧的文件开始删除；
+    仍被任务引用（hold）或最近仍在写入的文件不会被删除。缓存目录由 VideoCache 自行管理。
+
+    jobs_dir 下是每个任务的独立下载目录，任务进行中整个目录被 hold，
+    其中的 .part 与等待合并的音视频流不会被删除；任务结束后的空目录随清理删除。
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        budget_bytes: int = 0,
+        max_age: float = 0,
+        min_free_bytes: int = 0,
+        grace: float = 600,
+        jobs_dir: Optional[Path] = None,
+    ) -> None:
+        self.root = root
+        self.jobs_dir = jobs_dir
+        self.budget_bytes = max(0, int(budget_bytes))
+        self.max_age = max(0.0, float(max_age))
+        self.min_free_bytes = max(0, int(min_free_bytes))
+        self.grace = grace
+        self.reclaimed_bytes = 0
+        self.removed_files = 0
+        self.rejected = 0
+        self._held: Dict[str, int] = {}
+
+    def hold(self, path: str) -> None:
+        """标记文件（或任务下载目录）仍被任务使用"""
+        key = str(Path(path).resolve())
+        self._held[key] = self._held.get(key, 0) + 1
+
+    def release(self, path: str) -> None:
+        key = str(Path(path).resolve())
+        left = self._held.get(key, 0) - 1
+        if left > 0:
+            self._held[key] = left
+        else:
+            self._held.pop(key, None)
+
+    def free_bytes(self) -> int:
+        try:
+            return shutil.disk_usage(self.root).free
+        except OSError:
+            return 0
+
+    def has_space(self) -> bool:
+        """剩余空间是否足够接收新任务"""
+        return not self.min_free_bytes or self.free_bytes() >= self.min_free_bytes
+
+    def _held_file(self, f: Path) -> bool:
+        key = str(f.resolve())
+        return key in self._held or str(Path(key).parent) in self._held
+
+    def _job_dirs(self) -> List[Path]:
+        if self.jobs_dir is None or not self.jobs_dir.is_dir():
+            return []
+        return [d for d in self.jobs_dir.iterdir() if d.is_dir()]
+
+    def _candidates(self) -> List[Tuple[float, int, Path]]:
+        files = []
+        for d in [self.root] + self._job_dirs():
+            try:
+                entries = list(d.iterdir())
+            except OSError:
+                continue
+            for f in entries:
+                try:
+                    if not f.is_file():
+                        continue
+                    st = f.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, f))
+        files.sort(key=lambda x: x[0])
+        return files
+
+    def _remove_empty_job_dirs(self) -> None:
+        for d in self._job_dirs():
+            if str(d.resolve()) in self._held:
+                continue
+            try:
+                d.rmdir()
+            except OSError:
+                # 非空或正被使用
+                pass
+
+    def sweep(self) -> int:
+        """执行一次清理，返回本次释放的字节数"""
+        now = time.time()
+        files = self._candidates()
+        total = sum(size for _, size, _ in files)
+        need_free = self.min_free_bytes and self.free_bytes() < self.min_free_bytes
+        reclaimed = 0
+        for mtime, size, f in files:
+            age = now - mtime
+            expired = self.max_age and age > self.max_age
+            over_budget = self.budget_bytes and total > self.budget_bytes
+            if not (expired or over_budget or need_free):
+                continue
+            if age < self.grace or self._held_file(f):
+                continue
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.debug(f"bili2mp4: 清理文件失败 {f.name}: {e}")
+                continue
+            total -= size
+            reclaimed += size
+            self.removed_files += 1
+            if need_free:
+                need_free = self.free_bytes() < self.min_free_bytes
+        self._remove_empty_job_dirs()
+        if reclaimed:
+            self.reclaimed_bytes += reclaimed
+            logger.info(
+                f"bili2mp4: 下载目录清理释放 {reclaimed / 1024 / 1024:.1f}MB，"
+                f"剩余 {total / 1024 / 1024:.1f}MB"
+            )
+        return reclaimed
+
+    async def run(self, interval: float) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.warning(f"bili2mp4: 下载目录清理失败: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "removed_files": self.removed_files,
+            "rejected": self.rejected,
+            "free_bytes": self.free_bytes(),
+        }
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from nonebot import logger
+
+# 未结束的状态，重启后需要恢复
+PENDING_STATES = ("queued", "running")
+# 结束状态
+FINAL_STATES = ("done", "failed", "skipped", "expired")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bot_id TEXT NOT NULL,
+    group_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    video_id TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated);
+"""
+
+
+class JobStore:
+    """
+    持久化的任务记录（SQLite）。
+
+    每个群视频任务的状态变化都会写入数据库，机器人重启后可找回未完成的任务重新执行；
+    已结束的任务按保留天数与条数定期清理。单条写入在 WAL 模式下耗时很短，直接在事件循环中执行。
+    """
+
+    def __init__(
+        self, path: Path, retention_days: float = 7, max_rows: int = 5000
+    ) -> None:
+        self.path = path
+        self.retention = retention_days * 24 * 3600
+        self.max_rows = max(0, int(max_rows))
+        self._writes = 0
+        self._db = sqlite3.connect(str(path), isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def add(self, bot_id: str, group_id: int, url: str, video_id: Optional[str]) -> int:
+        now = time.time()
+        cur = self._db.execute(
+            "INSERT INTO jobs"
+            " (bot_id, group_id, url, video_id, state, created, updated)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (str(bot_id), int(group_id), url, video_id, now, now),
+        )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self.prune()
+        return int(cur.lastrowid)
+
+    def mark_running(self, job_id: int) -> None:
+        self._db.execute(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ?"
+            " WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+    def finish(self, job_id: int, state: str, error: Optional[str] = None) -> None:
+        self._db.execute(
+            "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+            (state, error, time.time(), job_id),
+        )
+
+    def interrupted(self, max_age: float, max_attempts: int) -> List[Dict[str, Any]]:
+        """
+        返回上次运行中断、仍值得重试的任务。
+
+        超过 max_age 秒的任务标记为 expired，已尝试 max_attempts 次的标记为 failed。
+        """
+        now = time.time()
+        placeholders = ",".join("?" * len(PENDING_STATES))
+        self._db.execute(
+            f"UPDATE jobs SET state = 'expired', updated = ?"
+            f" WHERE state IN ({placeholders}) AND created < ?",
+            (now, *PENDING_STATES, now - max_age),
+        )
+        self._db.execute(
+            "UPDATE jobs SET state = 'failed', error = 'too many attempts',"
+            " updated = ?"
+            f" WHERE state IN ({placeholders}) AND attempts >= ?",
+            (now, *PENDING_STATES, max_attempts),
+        )
+        rows = self._db.execute(
+            f"SELECT * FROM jobs WHERE state IN ({placeholders}) ORDER BY id",
+            PENDING_STATES,
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def prune(self) -> int:
+        """删除超过保留期或超出条数上限的已结束任务，返回删除条数"""
+        placeholders = ",".join("?" * len(FINAL_STATES))
+        deleted = self._db.execute(
+            f"DELETE FROM jobs WHERE state IN ({placeholders}) AND updated < ?",
+            (*FINAL_STATES, time.time() - self.retention),
+        ).rowcount
+        if self.max_rows:
+            deleted += self._db.execute(
+                f"DELETE FROM jobs WHERE state IN ({placeholders}) AND id NOT IN"
+                f" (SELECT id FROM jobs ORDER BY id DESC LIMIT ?)",
+                (*FINAL_STATES, self.max_rows),
+            ).rowcount
+        if deleted:
+            logger.debug(f"bili2mp4: 清理任务记录 {deleted} 条")
+        return deleted
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        return {state: n for state, n in rows}
+
+    def close(self) -> None:
+        try:
+            self._db.close()
+        except Exception:
+            pass
@@ -0,0 +1,150 @@
+"""
+群消息中的B站链接提取。
+
+这是群消息的热路径：先用廉价的子串判断跳过不含B站链接的消息段，
+只对候选内容做一次解码和一次正则扫描，并直接规范化为视频ID去重。
+"""
+
+from __future__ import annotations
+
+import html
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+
+# 预筛选标记：消息段中不含其中任何一个即不可能有B站链接
+_MARKERS = ("bilibili", "b23", "BV")
+
+# 视频ID匹配
+BV_ID_RE = re.compile(r"(BV[0-9A-Za-z]{10})")
+AV_ID_RE = re.compile(r"/video/av(\d+)", flags=re.IGNORECASE)
+EP_ID_RE = re.compile(r"/bangumi/play/ep(\d+)", flags=re.IGNORECASE)
+SS_ID_RE = re.compile(r"/bangumi/play/ss(\d+)", flags=re.IGNORECASE)
+# 空间合集/视频列表：collectiondetail?sid=、seriesdetail?sid= 或 /lists/<sid>[?type=series]
+SPACE_LIST_RE = re.compile(
+    r"space\.bilibili\.com/(\d+)/"
+    r"(?:channel/(collection|series)detail/?\?(?:[^#]*&)?sid=|lists/)(\d+)",
+    flags=re.IGNORECASE,
+)
+PAGE_RE = re.compile(r"[?&]p=(\d+)")
+SHORT_RE = re.compile(r"^https?://(?:www\.)?b23\.tv/([\w-]+)", flags=re.IGNORECASE)
+
+# 域名匹配
+BILI_URL_RE = re.compile(
+    r"(https?://(?:[\w-]+\.)?(?:bilibili\.com|b23\.tv)/[^\s\"'<>\\]+)",
+    flags=re.IGNORECASE,
+)
+
+
+def has_candidate(text: str) -> bool:
+    """不分配新对象的快速预判"""
+    for marker in _MARKERS:
+        if marker in text:
+            return True
+    return False
+
+
+def _page_of(url: str) -> int:
+    m = PAGE_RE.search(url)
+    return max(1, int(m.group(1))) if m else 1
+
+
+def _list_id(url: str) -> Optional[str]:
+    """番剧季 ss123、空间合集 col<mid>-<sid> 与视频列表 ser<mid>-<sid>"""
+    m = SS_ID_RE.search(url)
+    if m:
+        return f"ss{m.group(1)}"
+    m = SPACE_LIST_RE.search(url)
+    if not m:
+        return None
+    kind = m.group(2) or ("series" if "type=series" in url else "collection")
+    prefix = "ser" if kind.lower() == "series" else "col"
+    return f"{prefix}{m.group(1)}-{m.group(3)}"
+
+
+def canonical_video_id(url: str) -> Optional[str]:
+    """
+    从（已展开的）链接中提取规范视频ID，形如 BVxxxx、av123、ep456，分P追加 _p2；
+    番剧季与合集返回列表ID（见 is_list_id）。
+    """
+    m = BV_ID_RE.search(url)
+    if m:
+        vid = m.group(1)
+    else:
+        m = AV_ID_RE.search(url)
+        if m:
+            vid = f"av{m.group(1)}"
+        else:
+            m = EP_ID_RE.search(url)
+            return f"ep{m.group(1)}" if m else _list_id(url)
+    page = _page_of(url)
+    return f"{vid}_p{page}" if page > 1 else vid
+
+
+def is_list_id(video_id: str) -> bool:
+    """是否为需要展开为多个视频的番剧季/合集ID"""
+    return video_id.startswith(("ss", "col", "ser"))
+
+
+def canonical_url(video_id: str) -> str:
+    """由规范视频ID还原下载用的链接"""
+    if video_id.startswith(("ep", "ss")):
+        return f"https://www.bilibili.com/bangumi/play/{video_id}"
+    if video_id.startswith(("col", "ser")):
+        mid, _, sid = video_id[3:].partition("-")
+        kind = "collection" if video_id.startswith("col") else "series"
+        return f"https://space.bilibili.com/{mid}/channel/{kind}detail?sid={sid}"
+    vid, _, page = video_id.partition("_p")
+    url = f"https://www.bilibili.com/video/{vid}/"
+    return f"{url}?p={page}" if page else url
+
+
+def _normalize(url: str) -> Optional[Tuple[str, str]]:
+    """返回 (去重键, 链接)；短链保留原样待展开，非视频链接返回 None"""
+    m = SHORT_RE.match(url)
+    if m:
+        return f"b23:{m.group(1)}", f"https://b23.tv/{m.group(1)}"
+    video_id = canonical_video_id(url)
+    if not video_id:
+        return None
+    return video_id, canonical_url(video_id)
+
+
+def _decode(raw: str) -> str:
+    """只对候选内容做必要的解码：JSON 转义斜杠、URL 编码、XML 实体"""
+    if "\\/" in raw:
+        raw = raw.replace("\\/", "/")
+    if "%2F" in raw or "%2f" in raw:
+        raw = unquote(raw)
+    if "&amp;" in raw or "&#" in raw:
+        raw = html.unescape(raw)
+    return raw
+
+
+def _segment_text(seg) -> str:
+    t = seg.type
+    if t == "text":
+        return seg.data.get("text", "") or ""
+    if t in ("json", "xml"):
+        return seg.data.get("data") or seg.data.get("content") or ""
+    if t == "share":
+        return seg.data.get("url") or ""
+    return str(seg)
+
+
+def extract_bili_urls(segments: Iterable) -> List[str]:
+    """
+    从消息段中提取B站视频链接，按规范视频ID去重并保持出现顺序。
+
+    完整链接返回规范化后的视频链接，b23.tv 短链原样返回，由调用方展开。
+    """
+    found: Dict[str, str] = {}
+    for seg in segments:
+        raw = _segment_text(seg)
+        if not raw or not has_candidate(raw):
+            continue
+        for m in BILI_URL_RE.finditer(_decode(raw)):
+            ref = _normalize(m.group(1))
+            if ref and ref[0] not in found:
+                found[ref[0]] = ref[1]
+    return list(found.values())
@@ -1,18 +1,19 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import json
+import logging
 import os
 import re
 import shutil
-import subprocess
 import time
-import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Set, Tuple
-from urllib.parse import parse_qs, unquote, urlparse
+from typing import Deque, Dict, List, Optional, Set, Tuple
 
-from nonebot import logger, on_message, require
+from nonebot import get_driver, logger, on_message, require
 from nonebot.adapters.onebot.v11 import (
     Bot,
     Event,
@@ -21,26 +22,86 @@ from nonebot.adapters.onebot.v11 import (
     MessageSegment,
     PrivateMessageEvent,
 )
+from nonebot.adapters.onebot.v11.exception import NetworkError
+from nonebot.log import LoguruHandler
 from nonebot.plugin import get_plugin_config
 
 require("nonebot_plugin_localstore")
 import nonebot_plugin_localstore as store
 
+from .bandwidth import BandwidthGovernor
+from .cache import VideoCache
 from .config import Config
+from .cookies import CookiePool, CookieAccount, DEFAULT_ACCOUNT, is_rate_limited
+from .downloader import (
+    probe_video,
+    list_entries,
+    download_video,
+    SizeLimitExceeded,
+    DurationLimitExceeded,
+)
+from .fileserver import FileServer
+from .janitor import DiskJanitor
+from .jobstore import JobStore
+from .links import is_list_id, canonical_url, extract_bili_urls, canonical_video_id
+from .media import probe_stats, video_resolution, transcode_to_fit
+from .metrics import metrics, export_file_loop, start_http_exporter
+from .procpool import DownloadProcessPool
+from .resolver import is_short_url, ShortLinkResolver
+from .scheduler import QueueFullError, JobDroppedError, DownloadScheduler
 
 PLUGIN_NAME = "nonebot_plugin_bili2mp4"
+
+# 线程池中下载时，下载模块的标准库日志转发到 nonebot 日志
+_downloader_log = logging.getLogger(f"{PLUGIN_NAME}.downloader")
+_downloader_log.setLevel(logging.INFO)
+_downloader_log.propagate = False
+_downloader_log.addHandler(LoguruHandler())
 DATA_DIR: Optional[Path] = None
 STATE_PATH: Optional[Path] = None
 DOWNLOAD_DIR: Optional[Path] = None
-COOKIE_FILE_PATH: Optional[Path] = None
+# 每个任务的独立下载目录所在目录
+JOBS_DIR: Optional[Path] = None
+COOKIE_DIR: Optional[Path] = None
 
 enabled_groups: Set[int] = set()
 bilibili_cookie: str = ""
+# 额外的B站账号：名称 -> Cookie 字符串（默认账号使用 bilibili_cookie）
+cookie_accounts: Dict[str, str] = {}
 max_height: int = 0
 max_filesize_mb: int = 0
+# 管理员设置的总带宽上限（MB/s），None 表示使用配置文件中的值
+bandwidth_limit_mb: Optional[float] = None
+# 管理员设置的视频时长上限（分钟）与排队老化速度（MB/分钟），None 表示使用配置文件中的值
+max_duration_minutes: Optional[int] = None
+schedule_aging_mb: Optional[float] = None
+# 群号 -> 优先级调度中的权重（未设置的为 1）
+group_weights: Dict[int, float] = {}
+ffprobe_timeout: float = 30
 super_admins: List[int] = []
 
-_processing: Set[str] = set()
+_video_cache: Optional[VideoCache] = None
+_scheduler: Optional[DownloadScheduler] = None
+_download_executor: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[DownloadProcessPool] = None
+# 下载前预检专用的线程池/进程池，与下载分开，预检不必等待空闲的下载槽位
+_probe_executor: Optional[ThreadPoolExecutor] = None
+_probe_pool: Optional[DownloadProcessPool] = None
+_resolver: Optional[ShortLinkResolver] = None
+_transcode_sem: Optional[asyncio.Semaphore] = None
+_plugin_config: Optional[Config] = None
+_metrics_server: Optional[asyncio.AbstractServer] = None
+_metrics_task: Optional[asyncio.Task] = None
+_job_store: Optional[JobStore] = None
+_janitor: Optional[DiskJanitor] = None
+_cookie_pool: Optional[CookiePool] = None
+_bandwidth: Optional[BandwidthGovernor] = None
+_file_server: Optional[FileServer] = None
+_janitor_task: Optional[asyncio.Task] = None
+# yt-dlp 解析耗时的滑动平均，用于估算快速解析节省的时间
+_ytdlp_fetch_avg: Optional[float] = None
+# 上次运行中断、等待机器人连接后恢复的任务
+_resume_jobs: List[Dict] = []
 
 
 FFMPEG_DIR: Optional[str] = None
@@ -51,15 +112,22 @@ CMD_ENABLE_RE = re.compile(r"^转换\s*(\d+)$", flags=re.IGNORECASE)
 CMD_DISABLE_RE = re.compile(r"^停止转换\s*(\d+)$", flags=re.IGNORECASE)
 CMD_SET_COOKIE_RE = re.compile(r"^设置B站COOKIE\s+(.+)$", flags=re.S)
 CMD_CLEAR_COOKIE = {"清除B站COOKIE", "删除B站COOKIE"}
+CMD_ADD_ACCOUNT_RE = re.compile(r"^添加B站账号\s*([\w-]{1,32})\s+(.+)$", flags=re.S)
+CMD_DEL_ACCOUNT_RE = re.compile(r"^删除B站账号\s*([\w-]{1,32})$")
+CMD_SHOW_ACCOUNTS = {"查看B站账号", "B站账号"}
 CMD_SET_HEIGHT_RE = re.compile(r"^设置清晰度\s*(\d+)$", flags=re.IGNORECASE)
 CMD_SET_MAXSIZE_RE = re.compile(r"^设置最大大小\s*(\d+)\s*MB$", flags=re.IGNORECASE)
-CMD_SHOW_PARAMS = {"查看参数", "参数", "设置"}
-
-# 域名匹配
-BILI_URL_RE = re.compile(
-    r"(https?://(?:[\w-]+\.)?(?:bilibili\.com|b23\.tv)/[^\s\"'<>]+)",
-    flags=re.IGNORECASE,
+CMD_SET_BANDWIDTH_RE = re.compile(
+    r"^设置带宽\s*(\d+(?:\.\d+)?)\s*(?:MB(?:/S)?)?$", flags=re.IGNORECASE
+)
+CMD_SET_DURATION_RE = re.compile(r"^设置最长时长\s*(\d+)\s*(?:分钟)?$")
+CMD_SET_WEIGHT_RE = re.compile(r"^设置群权重\s*(\d+)\s+(\d+(?:\.\d+)?)$")
+CMD_SET_AGING_RE = re.compile(
+    r"^设置老化\s*(\d+(?:\.\d+)?)\s*(?:MB)?$", flags=re.IGNORECASE
 )
+CMD_SHOW_PARAMS = {"查看参数", "参数", "设置"}
+CMD_SHOW_QUEUE = {"查看队列", "队列"}
+CMD_SHOW_STATS = {"查看统计", "统计"}
 
 # =========================
 # 初始化函数
@@ -67,27 +135,129 @@ BILI_URL_RE = re.compile(
 
 
 def _init_plugin():
-    global DATA_DIR, STATE_PATH, DOWNLOAD_DIR, COOKIE_FILE_PATH
-    global super_admins, FFMPEG_DIR
+    global DATA_DIR, STATE_PATH, DOWNLOAD_DIR, COOKIE_DIR, JOBS_DIR, _cookie_pool
+    global super_admins, FFMPEG_DIR, _video_cache, _scheduler, ffprobe_timeout
+    global _download_executor, _process_pool, _resolver, _transcode_sem
+    global _probe_executor, _probe_pool
+    global _plugin_config, _job_store, _resume_jobs, _janitor, _bandwidth
+    global _file_server
 
     if DATA_DIR is not None:
         return
 
     # 读取插件配置
-    plugin_config = get_plugin_config(Config)
+    plugin_config = _plugin_config = get_plugin_config(Config)
     super_admins = plugin_config.super_admins or []
+    ffprobe_timeout = plugin_config.ffprobe_timeout
 
     # 获取数据目录
     DATA_DIR = store.get_plugin_data_dir(versioned=False)
     STATE_PATH = DATA_DIR / "state.json"
-    COOKIE_FILE_PATH = DATA_DIR / "bili_cookies.txt"
+    COOKIE_DIR = DATA_DIR / "cookies"
     DOWNLOAD_DIR = DATA_DIR / "downloads"
     DOWNLOAD_DIR.mkdir(exist_ok=True)
+    JOBS_DIR = DOWNLOAD_DIR / "jobs"
+    JOBS_DIR.mkdir(exist_ok=True)
+    _janitor = DiskJanitor(
+        DOWNLOAD_DIR,
+        int(plugin_config.download_dir_max_gb * 1024 * 1024 * 1024),
+        plugin_config.download_file_max_age_hours * 3600,
+        plugin_config.disk_min_free_mb * 1024 * 1024,
+        jobs_dir=JOBS_DIR,
+    )
+    _video_cache = VideoCache(
+        DOWNLOAD_DIR / "cache",
+        int(plugin_config.video_cache_max_gb * 1024 * 1024 * 1024),
+    )
+    _scheduler = DownloadScheduler(
+        plugin_config.download_workers,
+        plugin_config.download_group_limit,
+        plugin_config.download_queue_size,
+        plugin_config.download_queue_overflow,
+        plugin_config.priority_scheduling,
+    )
+    if plugin_config.download_process_workers > 0:
+        _process_pool = DownloadProcessPool(plugin_config.download_process_workers)
+        _probe_pool = DownloadProcessPool(max(1, plugin_config.preflight_workers))
+    else:
+        _download_executor = ThreadPoolExecutor(
+            max_workers=_scheduler.workers, thread_name_prefix="bili2mp4"
+        )
+        _probe_executor = ThreadPoolExecutor(
+            max_workers=max(1, plugin_config.preflight_workers),
+            thread_name_prefix="bili2mp4-probe",
+        )
+    if plugin_config.file_server_enabled:
+        _file_server = FileServer(
+            DOWNLOAD_DIR,
+            plugin_config.file_server_host,
+            plugin_config.file_server_port,
+            plugin_config.file_server_public_url,
+            plugin_config.file_server_url_ttl,
+        )
+    if plugin_config.transcode_enabled:
+        _transcode_sem = asyncio.Semaphore(max(1, plugin_config.transcode_workers))
+    _resolver = ShortLinkResolver(
+        plugin_config.short_link_cache_size,
+        plugin_config.short_link_cache_ttl_hours * 3600,
+        (
+            DATA_DIR / "short_links.json"
+            if plugin_config.short_link_cache_persist
+            else None
+        ),
+    )
+
+    metrics.window = max(10, plugin_config.metrics_window)
+    metrics.gauges.update(
+        {
+            "queue_depth": lambda: _scheduler.queue_depth,
+            "active_jobs": lambda: len(_scheduler.snapshot()["active"]),
+            "inflight_videos": lambda: len(_inflight),
+            "cache_hits": lambda: _video_cache.hits,
+            "cache_misses": lambda: _video_cache.misses,
+            "short_link_hits": lambda: _resolver.hits,
+            "short_link_misses": lambda: _resolver.misses,
+            "disk_free_bytes": lambda: _janitor.free_bytes(),
+            "disk_reclaimed_bytes": lambda: _janitor.reclaimed_bytes,
+            "file_server_bytes": lambda: (
+                _file_server.served_bytes if _file_server else 0
+            ),
+        }
+    )
+
+    if plugin_config.job_store_enabled:
+        _job_store = JobStore(
+            DATA_DIR / "jobs.sqlite3",
+            plugin_config.job_retention_days,
+            plugin_config.job_retention_max_rows,
+        )
+        _job_store.prune()
+        _resume_jobs = _job_store.interrupted(
+            plugin_config.job_resume_max_age_hours * 3600,
+            max(1, plugin_config.job_max_attempts),
+        )
+        if _resume_jobs:
+            logger.info(
+                f"bili2mp4: 发现 {len(_resume_jobs)} 个未完成的任务，将在连接后恢复"
+            )
+    if not _resume_jobs:
+        _clean_download_dir()
 
     logger.info(f"bili2mp4: DATA_DIR={DATA_DIR} STATE_PATH={STATE_PATH}")
 
     _load_state()
 
+    _bandwidth = BandwidthGovernor(
+        _bandwidth_limit_mb() * 1024 * 1024, plugin_config.bandwidth_send_headroom
+    )
+    _scheduler.aging = _schedule_aging_mb()
+    if _process_pool is not None:
+        _bandwidth.on_change(_process_pool.push_controls)
+    # 每个账号的 Cookie 文件只在启动或修改时生成
+    _cookie_pool = CookiePool(COOKIE_DIR)
+    _sync_cookie_pool()
+    (DATA_DIR / "bili_cookies.txt").unlink(missing_ok=True)
+
     # 解析FFmpeg路径
     if plugin_config.ffmpeg_path:
         ffmpeg_dir = Path(plugin_config.ffmpeg_path)
@@ -113,26 +283,137 @@ def _init_plugin():
     logger.info(f"bili2mp4: 初始化完成，超管={super_admins}")
 
 
+def _clean_download_dir() -> None:
+    """删除上次运行残留的下载文件与任务目录（缓存目录除外）"""
+    removed = 0
+    for f in DOWNLOAD_DIR.iterdir():
+        if f.is_file():
+            try:
+                f.unlink()
+                removed += 1
+            except Exception as e:
+                logger.debug(f"bili2mp4: 删除残留文件失败 {f.name}: {e}")
+    for d in JOBS_DIR.iterdir():
+        try:
+            shutil.rmtree(d)
+            removed += 1
+        except Exception as e:
+            logger.debug(f"bili2mp4: 删除残留任务目录失败 {d.name}: {e}")
+    if removed:
+        logger.info(f"bili2mp4: 已清理 {removed} 个残留下载文件")
+
+
 # =========================
 # 状态读写
 # =========================
 
 
-def _save_state():
-    if not STATE_PATH:
-        return
+# 状态文件格式版本，新增字段时递增并在 _migrate_state 中补全旧数据
+STATE_VERSION = 4
+
+_state_save_task: Optional[asyncio.Task] = None
+_state_written: Optional[str] = None
+
+
+def _state_snapshot() -> str:
     data = {
-        "enabled_groups": list(enabled_groups),
+        "version": STATE_VERSION,
+        "enabled_groups": sorted(enabled_groups),
         "bilibili_cookie": bilibili_cookie,
+        "cookie_accounts": cookie_accounts,
         "max_height": max_height,
         "max_filesize_mb": max_filesize_mb,
+        "bandwidth_limit_mb": bandwidth_limit_mb,
+        "max_duration_minutes": max_duration_minutes,
+        "schedule_aging_mb": schedule_aging_mb,
+        "group_weights": {str(g): w for g, w in sorted(group_weights.items())},
     }
-    with STATE_PATH.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _write_state(text: str) -> None:
+    """先写临时文件再原子替换，写入中途崩溃不会损坏原文件"""
+    tmp = STATE_PATH.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_PATH)
+
+
+def _flush_state() -> None:
+    """立即写入状态（内容未变化时跳过）"""
+    global _state_written
+
+    if not STATE_PATH:
+        return
+    text = _state_snapshot()
+    if text == _state_written:
+        return
+    _write_state(text)
+    _state_written = text
+
+
+def _save_state():
+    """合并短时间内的多次修改，在线程中写入状态文件"""
+    global _state_save_task
+
+    if not STATE_PATH:
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _flush_state()
+        return
+    if _state_save_task is not None and not _state_save_task.done():
+        return
+
+    async def save_later():
+        global _state_written
+
+        await asyncio.sleep(1)
+        # 写入期间的修改不会另起任务，写完后再检查一次，直到与文件一致
+        while True:
+            text = _state_snapshot()
+            if text == _state_written:
+                return
+            try:
+                await asyncio.to_thread(_write_state, text)
+                _state_written = text
+            except Exception as e:
+                logger.warning(f"bili2mp4: 状态保存失败: {e}")
+                return
+
+    _state_save_task = asyncio.create_task(save_later())
+
+
+def _migrate_state(data: Dict) -> Dict:
+    """把旧版本的状态数据升级到当前版本"""
+    version = int(data.get("version", 0))
+    if version < 1:
+        # 0 -> 1：仅增加 version 字段
+        data["version"] = 1
+    if version < 2:
+        # 1 -> 2：增加多账号 Cookie
+        data.setdefault("cookie_accounts", {})
+        data["version"] = 2
+    if version < 3:
+        # 2 -> 3：增加运行时设置的带宽上限
+        data.setdefault("bandwidth_limit_mb", None)
+        data["version"] = 3
+    if version < 4:
+        # 3 -> 4：增加时长上限与优先级调度设置
+        data.setdefault("max_duration_minutes", None)
+        data.setdefault("schedule_aging_mb", None)
+        data.setdefault("group_weights", {})
+        data["version"] = 4
+    return data
 
 
 def _load_state():
     global enabled_groups, bilibili_cookie, max_height, max_filesize_mb
+    global _state_written, cookie_accounts, bandwidth_limit_mb
+    global max_duration_minutes, schedule_aging_mb, group_weights
 
     if not STATE_PATH or not STATE_PATH.exists():
         return
@@ -140,12 +421,28 @@ def _load_state():
     try:
         with STATE_PATH.open("r", encoding="utf-8") as f:
             data = json.load(f)
+        loaded_version = int(data.get("version", 0))
+        data = _migrate_state(data)
         enabled_groups = set(map(int, data.get("enabled_groups", [])))
         bilibili_cookie = data.get("bilibili_cookie", "")
+        cookie_accounts = dict(data.get("cookie_accounts") or {})
+        bandwidth_limit_mb = data.get("bandwidth_limit_mb")
+        max_duration_minutes = data.get("max_duration_minutes")
+        schedule_aging_mb = data.get("schedule_aging_mb")
+        group_weights = {
+            int(g): float(w) for g, w in (data.get("group_weights") or {}).items()
+        }
         max_height = int(data.get("max_height", 0))
         max_filesize_mb = int(data.get("max_filesize_mb", 0))
+        _state_written = _state_snapshot() if loaded_version == STATE_VERSION else None
     except Exception as e:
-        logger.warning(f"bili2mp4: 状态加载失败: {e}")
+        # 保留损坏的文件以便排查，避免下次保存时被覆盖
+        broken = STATE_PATH.with_suffix(".broken")
+        try:
+            os.replace(STATE_PATH, broken)
+        except OSError:
+            pass
+        logger.error(f"bili2mp4: 状态加载失败，已另存为 {broken.name}: {e}")
 
 
 def _get_help_message() -> str:
@@ -157,428 +454,678 @@ def _get_help_message() -> str:
         "• 停止转换 <群号> - 停止指定群的B站视频转换功能\n"
         "• 设置B站COOKIE <cookie字符串> - 设置B站Cookie以获取更高清晰度\n"
         "• 清除B站COOKIE - 清除已设置的B站Cookie\n"
+        "• 添加B站账号 <名称> <cookie字符串> - 添加账号到账号池，下载时轮换使用\n"
+        "• 删除B站账号 <名称> - 从账号池删除账号\n"
+        "• 查看B站账号 - 查看各账号使用次数、失败与风控情况\n"
         "• 设置清晰度 <数字> - 设置视频清晰度限制（如 720/1080，0 代表不限制）\n"
         "• 设置最大大小 <数字>MB - 设置视频大小限制（0 代表不限制）\n"
+        "• 设置带宽 <数字>MB - 设置所有下载共享的总带宽（MB/s，0 代表不限制）\n"
+        "• 设置最长时长 <分钟> - 设置视频时长上限，超过的不下载（0 代表不限制）\n"
+        "• 设置群权重 <群号> <权重> - 设置群在优先级调度中的权重（越大越优先，默认 1）\n"
+        "• 设置老化 <数字>MB - 设置优先级调度中每等待一分钟抵扣的预估大小\n"
         "• 查看参数 - 查看当前配置参数\n"
+        "• 查看队列 - 查看下载队列与进行中的任务\n"
+        "• 查看统计 - 查看各阶段耗时分位数与次数\n"
         "• 查看转换列表 - 查看已开启转换功能的群列表\n\n"
         "Cookie中至少需要包含SESSDATA、bili_jct、DedeUserID和buvid3/buvid4四个字段"
     )
 
 
-def _find_urls_in_text(text: str) -> List[str]:
-    urls = []
-    for m in BILI_URL_RE.findall(text or ""):
-        if m not in urls:
-            urls.append(m)
-    try:
-        parsed = urlparse(text)
-        if parsed and parsed.query:
-            qs = parse_qs(parsed.query)
-            for key in ("url", "qqdocurl", "jumpUrl", "webpageUrl"):
-                for v in qs.get(key, []):
-                    v = unquote(v)
-                    for u in BILI_URL_RE.findall(v):
-                        if u not in urls:
-                            urls.append(u)
-    except Exception:
-        pass
-    return urls
+def _bandwidth_limit_mb() -> float:
+    if bandwidth_limit_mb is not None:
+        return float(bandwidth_limit_mb)
+    return _plugin_config.bandwidth_limit_mb if _plugin_config else 0.0
 
 
-def _walk_strings(obj) -> List[str]:
-    out: List[str] = []
-    try:
-        if isinstance(obj, dict):
-            for v in obj.values():
-                out.extend(_walk_strings(v))
-        elif isinstance(obj, list):
-            for it in obj:
-                out.extend(_walk_strings(it))
-        elif isinstance(obj, str):
-            out.append(obj)
-    except Exception:
-        pass
-    return out
+def _max_duration_minutes() -> int:
+    if max_duration_minutes is not None:
+        return int(max_duration_minutes)
+    return _plugin_config.max_duration_minutes if _plugin_config else 0
 
 
-def _extract_bili_urls_from_event(event: GroupMessageEvent) -> List[str]:
-    urls: List[str] = []
-    try:
-        for seg in event.message:
-            # 1) 纯文本
-            if seg.type == "text":
-                txt = seg.data.get("text", "")
-                for u in _find_urls_in_text(txt):
-                    if u not in urls:
-                        urls.append(u)
-            # 2) JSON 卡片
-            elif seg.type == "json":
-                raw = seg.data.get("data") or seg.data.get("content") or ""
-                for u in _find_urls_in_text(raw):
-                    if u not in urls:
-                        urls.append(u)
-                try:
-                    obj = json.loads(raw)
-                    for s in _walk_strings(obj):
-                        for u in _find_urls_in_text(s):
-                            if u not in urls:
-                                urls.append(u)
-                except Exception:
-                    pass
-            # 3) XML 卡片
-            elif seg.type == "xml":
-                raw = seg.data.get("data") or seg.data.get("content") or ""
-                for u in _find_urls_in_text(raw):
-                    if u not in urls:
-                        urls.append(u)
-            # 4) 分享卡片
-            elif seg.type == "share":
-                u = seg.data.get("url") or ""
-                for u2 in _find_urls_in_text(u):
-                    if u2 not in urls:
-                        urls.append(u2)
-            else:
-                s = str(seg)
-                for u in _find_urls_in_text(s):
-                    if u not in urls:
-                        urls.append(u)
-    except Exception as e:
-        logger.debug(f"bili2mp4: 提取链接异常: {e}")
-    return urls
+def _schedule_aging_mb() -> float:
+    if schedule_aging_mb is not None:
+        return float(schedule_aging_mb)
+    return _plugin_config.schedule_aging_mb if _plugin_config else 0.0
 
 
-def _build_browser_like_headers() -> dict:
-    return {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/120.0.0.0 Safari/537.36"
-        ),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-        "Referer": "https://www.bilibili.com/",
-        "Origin": "https://www.bilibili.com",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Site": "same-origin",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Dest": "document",
-    }
+def _sync_cookie_pool() -> None:
+    """按当前设置更新账号池（未变化的账号不会重写 Cookie 文件）"""
+    if _cookie_pool is None:
+        return
+    cookies = {DEFAULT_ACCOUNT: bilibili_cookie} if bilibili_cookie else {}
+    cookies.update(cookie_accounts)
+    _cookie_pool.sync(cookies)
 
 
-def _expand_short_url(u: str, timeout: float = 8.0) -> str:
+async def _check_video_file(path: str, metadata: Dict) -> Optional[str]:
+    """检查视频文件大小和分辨率，返回不满足限制的原因，满足时返回 None"""
     try:
-        host = urlparse(u).hostname or ""
-        if host.lower() not in {"b23.tv", "www.b23.tv"}:
-            return u
-        hdrs = {
-            "User-Agent": _build_browser_like_headers()["User-Agent"],
-            "Referer": "https://www.bilibili.com/",
-        }
-        try:
-            req = urllib.request.Request(u, headers=hdrs, method="HEAD")
-            with urllib.request.urlopen(req, timeout=timeout) as resp:
-                final = resp.geturl()
-                return final or u
-        except Exception:
-            req = urllib.request.Request(u, headers=hdrs, method="GET")
-            with urllib.request.urlopen(req, timeout=timeout) as resp:
-                final = resp.geturl()
-                return final or u
+        # 检查文件大小
+        path_obj = Path(path)
+        if not path_obj.exists():
+            return None
+        if max_filesize_mb:
+            size_mb = path_obj.stat().st_size / (1024 * 1024)
+            if size_mb > max_filesize_mb:
+                return f"大小 {size_mb:.1f}MB 超过限制 {max_filesize_mb}MB"
+
+        # 检查视频分辨率（yt-dlp 已给出时无需 ffprobe）
+        if max_height:
+            with metrics.timer("probe") as t:
+                if metadata.get("width") and metadata.get("height"):
+                    t.outcome = "skipped"
+                res = await video_resolution(
+                    path, metadata, FFMPEG_DIR, ffprobe_timeout
+                )
+                if res is None and t.outcome == "ok":
+                    t.outcome = "failed"
+            if res and res[1] > max_height:
+                return f"分辨率 {res[1]}p 超过限制 {max_height}p"
+        return None
     except Exception as e:
-        logger.debug(f"bili2mp4: 短链展开失败，使用原链接（{u}）：{e}")
-        return u
+        return f"检查失败: {e}"
 
 
-def _ensure_cookiefile(cookie_string: str) -> Optional[str]:
-    """
-    将 Cookie 字符串转为 Netscape 格式，供 yt-dlp 使用。
-    """
-    if COOKIE_FILE_PATH is None:
-        return None
+async def _fit_limits(path: str, metadata: Dict) -> Optional[str]:
+    """确保文件满足限制；超限时按配置转码，仍不满足则删除并返回 None"""
+    reason = await _check_video_file(path, metadata)
+    if reason is None:
+        return path
 
-    cookie_string = (cookie_string or "").strip().strip(";")
-    if not cookie_string:
-        if COOKIE_FILE_PATH.exists():
-            try:
-                if COOKIE_FILE_PATH.exists():
-                    COOKIE_FILE_PATH.unlink()
-            except Exception:
-                pass
-        return None
+    out: Optional[str] = None
+    if _transcode_sem is not None and FFMPEG_DIR:
+        logger.info(f"bili2mp4: {reason}，开始转码: {Path(path).name}")
+        async with _transcode_sem:
+            with metrics.timer("transcode") as t:
+                out = await transcode_to_fit(
+                    path,
+                    FFMPEG_DIR,
+                    max_height,
+                    max_filesize_mb,
+                    metadata.get("duration"),
+                    _plugin_config.transcode_preset,
+                    _plugin_config.transcode_threads,
+                    _plugin_config.transcode_two_pass,
+                )
+                if out:
+                    t.bytes = Path(out).stat().st_size
+                else:
+                    t.outcome = "failed"
+        if out:
+            reason = await _check_video_file(out, {})
+            if reason is not None:
+                Path(out).unlink(missing_ok=True)
+                out = None
+
+    Path(path).unlink(missing_ok=True)
+    if out is None:
+        logger.info(f"bili2mp4: 视频不满足限制，已丢弃: {reason}")
+    return out
 
-    pairs = []
-    for part in cookie_string.split(";"):
-        part = part.strip()
-        if "=" not in part:
-            continue
-        k, v = part.split("=", 1)
-        if k and v:
-            pairs.append((k.strip(), v.strip()))
 
-    if not pairs:
-        return None
+def _send_timeout(size: int) -> float:
+    """按文件大小计算发送超时"""
+    return (
+        _plugin_config.send_timeout_base
+        + size / 1024 / 1024 * _plugin_config.send_timeout_per_mb
+    )
 
-    expiry = int(time.time()) + 180 * 24 * 3600
-    lines = [
-        "# Netscape HTTP Cookie File",
-        "# Generated by nonebot_plugin_bili2mp4",
-        "",
-    ]
 
-    for k, v in pairs:
-        # domain include_subdomains path secure expiry name value
-        lines.append(f".bilibili.com\tTRUE\t/\tFALSE\t{expiry}\t{k}\t{v}")
+# 已确认发出的视频消息 ID，确认发送结果时不再把它们算作本次发送
+_sent_message_ids: Deque[int] = deque(maxlen=256)
+# 群号 -> 发送锁：同一群的视频逐个发送，确认发送结果时群里不会有本插件的其他视频
+_send_locks: Dict[int, asyncio.Lock] = {}
 
-    try:
-        with COOKIE_FILE_PATH.open("w", encoding="utf-8") as f:
-            f.write("\n".join(lines) + "\n")
-        logger.info("bili2mp4: Cookie 已设置")
-        return str(COOKIE_FILE_PATH)
-    except Exception:
-        return None
 
+def _is_ambiguous_send_error(err: Exception) -> bool:
+    """
+    超时、HTTP 请求失败等网络错误：OneBot 实现可能已经发出消息，需要确认后再重试。
 
-def _check_video_file(path: str) -> bool:
-    """检查视频文件大小和分辨率"""
-    try:
-        # 检查文件大小
-        path_obj = Path(path)
-        if max_filesize_mb and path_obj.exists():
-            size_mb = path_obj.stat().st_size / (1024 * 1024)
-            if size_mb > max_filesize_mb:
-                if path_obj.exists():
-                    path_obj.unlink()
-                return False
-
-        # 检查视频分辨率
-        if path_obj.exists():
-            ffprobe_exe = "ffprobe.exe" if os.name == "nt" else "ffprobe"
-            cmd = [ffprobe_exe]
-            if FFMPEG_DIR:
-                cmd[0] = str(Path(FFMPEG_DIR) / ffprobe_exe)
-
-            cmd.extend(
-                [
-                    "-v",
-                    "error",
-                    "-select_streams",
-                    "v:0",
-                    "-show_entries",
-                    "stream=width,height",
-                    "-of",
-                    "csv=p=0",
-                    path,
-                ]
-            )
+    ActionFailed 等明确的失败可以直接重试。
+    """
+    return isinstance(err, NetworkError) or "timeout" in str(err).lower()
 
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-            )
-            if result.returncode == 0:
-                try:
-                    width, height = result.stdout.strip().split(",")
-                    # 检查是否设置了高度限制
-                    if max_height and int(height) > max_height:
-                        path_obj.unlink()
-                        return False
-                except ValueError:
-                    pass
-        return True
-    except Exception:
+
+def _is_own_video(msg: Dict, self_id: int, since: float) -> bool:
+    """
+    是否为机器人在 since 之后发出的视频消息。
+
+    NapCat、Lagrange、go-cqhttp 会把视频与文字拆成两条消息发出，因此不匹配标题；
+    消息记录中的视频也不保留原文件名，由同一群逐个发送（_send_locks）保证匹配到的是本次发送。
+    """
+    if int((msg.get("sender") or {}).get("user_id") or 0) != self_id:
+        return False
+    if float(msg.get("time") or 0) < since:
         return False
+    if msg.get("message_id") in _sent_message_ids:
+        return False
+    content = msg.get("message")
+    if isinstance(content, list):
+        return any(seg.get("type") == "video" for seg in content)
+    content = str(content or msg.get("raw_message") or "")
+    return "[CQ:video" in content
+
+
+async def _confirm_sent(bot: Bot, group_id: int, since: float) -> Optional[bool]:
+    """
+    发送超时或网络错误后查询群消息记录，确认视频是否实际已发出，避免重复发送。
+
+    OneBot 实现可能仍在上传，因此在 send_confirm_wait 内多次查询；
+    实现不支持 get_group_msg_history 时返回 None（无法确认）。
+    """
+    deadline = time.monotonic() + _plugin_config.send_confirm_wait
+    self_id = int(bot.self_id)
+    while True:
+        try:
+            history = await bot.call_api(
+                "get_group_msg_history", group_id=group_id, count=20
+            )
+        except Exception as e:
+            logger.debug(f"bili2mp4: 无法查询群消息记录: {e}")
+            return None
+        messages = (history or {}).get("messages") or []
+        for m in messages:
+            if _is_own_video(m, self_id, since):
+                _sent_message_ids.append(m.get("message_id"))
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(min(10.0, max(0.0, deadline - time.monotonic())))
 
 
 async def _send_video_with_timeout(
-    bot: Bot, group_id: int, path: str, title: str
-) -> None:
-    """发送视频，带超时处理"""
-    sent = False
+    bot: Bot, group_id: int, path: str, title: str, cleanup: bool = True
+) -> str:
+    """
+    发送视频，返回结果：ok、confirmed（超时但确认已发出）、timeout 或 error。
+
+    超时按文件大小计算，失败后退避重试并复用已下载的文件；
+    超时或网络错误后先查询群消息记录确认，避免重复发送。cleanup 为 False 时（缓存文件）发送后保留文件。
+    """
+    title = title or "B站视频"
     try:
-        await bot.send_group_msg(
-            group_id=group_id,
-            message=MessageSegment.video(file=path)
-            + Message(f"\n{title or 'B站视频'}"),
-        )
-        logger.info(f"bili2mp4: 视频已发送到群 {group_id}: {title or 'B站视频'}")
-        sent = True
-    except Exception as e:
-        error_msg = str(e)
-        if not ("timeout" in error_msg.lower() and "websocket" in error_msg.lower()):
-            logger.warning(
-                f"bili2mp4: 发送视频失败: {Path(path).name} | group={group_id} | err={e}"
+        size = Path(path).stat().st_size
+    except OSError:
+        size = 0
+    timeout = _send_timeout(size)
+    retries = max(0, _plugin_config.send_retries)
+    outcome = "error"
+
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = _plugin_config.send_retry_backoff * 2 ** (attempt - 1)
+            logger.info(
+                f"bili2mp4: {delay:.0f}s 后重试发送（第{attempt + 1}次）| group={group_id}"
             )
-    finally:
-        if sent:
+            await asyncio.sleep(delay)
+
+        start = time.monotonic()
+        give_up = False
+        # 发送与确认期间持有群发送锁，见 _is_own_video
+        async with _send_locks.setdefault(group_id, asyncio.Lock()):
+            since = time.time() - 5
             try:
-                path_obj = Path(path)
-                if path_obj.exists():
-                    path_obj.unlink()
+                # 启用文件服务时传递签名链接，由 OneBot 实现自行下载
+                file = path
+                if _file_server is not None and _file_server.running:
+                    file = _file_server.sign(path)
+                with _bandwidth.sending():
+                    result = await bot.send_group_msg(
+                        group_id=group_id,
+                        message=MessageSegment.video(file=file) + Message(f"\n{title}"),
+                        _timeout=timeout,
+                    )
+                message_id = (
+                    (result or {}).get("message_id")
+                    if isinstance(result, dict)
+                    else None
+                )
+                if message_id is not None:
+                    _sent_message_ids.append(message_id)
+                logger.info(
+                    f"bili2mp4: 视频已发送到群 {group_id}: {title} "
+                    f"(message_id={message_id})"
+                )
+                outcome = "ok"
             except Exception as e:
-                logger.debug(f"Failed to delete temp file {path}: {e}")
+                # 超时与网络错误时结果未知，记为 timeout 并先确认
+                outcome = "timeout" if _is_ambiguous_send_error(e) else "error"
+                logger.warning(
+                    f"bili2mp4: 发送视频失败（第{attempt + 1}次，超时 {timeout:.0f}s）: "
+                    f"{Path(path).name} | group={group_id} | err={e}"
+                )
+                if outcome == "timeout":
+                    confirmed = await _confirm_sent(bot, group_id, since)
+                    if confirmed:
+                        logger.info(
+                            f"bili2mp4: 发送超时但已确认视频发出: {title} "
+                            f"| group={group_id}"
+                        )
+                        outcome = "confirmed"
+                    # 无法确认是否已发出时不再重试，以免重复发送
+                    give_up = confirmed is None
+        metrics.record("send", time.monotonic() - start, size, outcome)
+        if outcome in ("ok", "confirmed") or give_up:
+            break
+
+    if outcome in ("ok", "confirmed") and cleanup:
+        try:
+            Path(path).unlink(missing_ok=True)
+        except Exception as e:
+            logger.debug(f"Failed to delete temp file {path}: {e}")
+    return outcome
+
+
+async def _submit_download(job: Dict) -> Tuple[str, str, Dict]:
+    # 登记到总带宽限制，下载中途按任务数变化调整限速
+    with _bandwidth.download() as control:
+        job = dict(job, ratelimit=control["ratelimit"])
+        if _process_pool is not None:
+            return await _process_pool.submit(job, control)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _download_executor, download_video, job, control
+        )
 
 
-def _build_format_candidates(height_limit: int, size_limit_mb: int) -> List[str]:
-    """构建格式候选列表"""
-    h = height_limit if height_limit and height_limit > 0 else None
+def _job_dir(video_id: Optional[str], url: str) -> Path:
+    """
+    任务的独立下载目录，按视频ID命名，重启后恢复的任务仍能在其中续传 .part 文件；
+    任务进行中整个目录由清理任务保留
+    """
+    name = video_id or hashlib.sha1(url.encode()).hexdigest()[:16]
+    return JOBS_DIR / name
 
-    if not h:
-        return ["bv*+ba/best"]
 
-    # 根据清晰度限制构建格式候选
-    format_map = {
-        1080: [
-            f"bv*[height>=1080]+ba/best",
-            f"bv*[height>=720]+ba/best",
-            "bv*+ba/best",
-        ],
-        720: [f"bv*[height>=720]+ba/best", f"bv*[height>=480]+ba/best", "bv*+ba/best"],
-        480: [f"bv*[height>=480]+ba/best", "bv*+ba/best"],
+def _build_job(url: str, out_dir: Optional[Path] = None) -> Dict:
+    """按当前设置构造下载任务参数（Cookie 由调用方按账号填写）"""
+    return {
+        "url": url,
+        "cookie": "",
+        "cookiefile": None,
+        "out_dir": str(out_dir or DOWNLOAD_DIR),
+        "height_limit": max_height,
+        "size_limit_mb": max_filesize_mb,
+        # 启用转码时超限视频仍下载最小的格式，之后再压缩
+        "allow_oversize": _transcode_sem is not None,
+        "max_duration": _max_duration_minutes() * 60,
+        "ffmpeg_dir": FFMPEG_DIR,
+        "connections": _plugin_config.download_connections,
+        "parallel_streams": _plugin_config.download_parallel_streams,
+        "http_chunk_size": int(
+            _plugin_config.download_http_chunk_size_mb * 1024 * 1024
+        ),
+        "external_downloader": _plugin_config.download_external_downloader,
+        "stream_remux": _plugin_config.download_stream_remux,
+        "native": _plugin_config.native_resolver,
+        "api_base": _plugin_config.bili_api_base,
+        "info_cache_ttl": _plugin_config.info_cache_ttl,
+        "info_cache_dir": str(DATA_DIR / "info_cache"),
     }
 
-    # 根据高度选择最适合的格式列表
-    for threshold, formats in sorted(format_map.items(), reverse=True):
-        if h >= threshold:
-            return formats
 
-    # 默认格式
-    return ["bv*+ba/best"]
+async def _probe(job: Dict) -> Dict:
+    # 在预检专用的进程池或有界线程池中执行：不占用机器人进程，也不等待下载槽位，
+    # 否则任务只能在下载完成时逐个进入调度器，短任务优先无从排序
+    if _probe_pool is not None:
+        return await _probe_pool.probe(job)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_probe_executor, probe_video, job)
+
+
+async def _run_download(
+    url: str,
+    reserved: Optional[CookieAccount] = None,
+    out_dir: Optional[Path] = None,
+) -> Tuple[str, str, Dict]:
+    """
+    在下载进程池或线程池中执行 yt-dlp 下载。
 
+    优先使用任务预留的账号（与预检相同，可命中解析缓存），其余按最久未使用轮换，
+    遇到风控换下一个账号。
+    """
+    job = _build_job(url, out_dir)
+    accounts = _cookie_pool.candidates(reserved) if _cookie_pool is not None else []
+    if not accounts:
+        return await _submit_download(job)
+
+    last_error: Optional[Exception] = None
+    for account in accounts:
+        if account is not reserved:
+            _cookie_pool.mark_used(account)
+        logger.info(f"bili2mp4: 使用账号 {account.name}")
+        job["cookie"], job["cookiefile"] = account.cookie, account.cookiefile
+        try:
+            result = await _submit_download(job)
+        except SizeLimitExceeded:
+            _cookie_pool.report(account, None)
+            raise
+        except Exception as e:
+            _cookie_pool.report(account, e)
+            if not is_rate_limited(e):
+                raise
+            last_error = e
+            continue
+        _cookie_pool.report(account, None)
+        return result
+    raise last_error
 
-def _download_with_ytdlp(
-    url: str, cookie: str, out_dir, height_limit: int, size_limit_mb: int
-) -> Tuple[str, str]:
+
+def _record_fetch(resolver: str, seconds: float) -> None:
+    """
+    记录解析耗时；快速解析成功时与 yt-dlp 解析的滑动平均比较，记录节省的时间。
+    """
+    global _ytdlp_fetch_avg
+
+    metrics.record("fetch", seconds, outcome=resolver)
+    if resolver == "yt-dlp":
+        if _ytdlp_fetch_avg is None:
+            _ytdlp_fetch_avg = seconds
+        else:
+            _ytdlp_fetch_avg = 0.8 * _ytdlp_fetch_avg + 0.2 * seconds
+    elif resolver == "native" and _ytdlp_fetch_avg is not None:
+        saved = _ytdlp_fetch_avg - seconds
+        metrics.record("fetch_saved", saved)
+        logger.info(
+            f"bili2mp4: 快速解析耗时 {seconds:.2f}s，"
+            f"较 yt-dlp 平均 {_ytdlp_fetch_avg:.2f}s 节省 {saved:.2f}s"
+        )
+
+
+# 只知道时长时按约 2Mbps 估算大小（MB/秒）
+_FALLBACK_MB_PER_SECOND = 0.25
+
+
+async def _preflight(url: str, account: Optional[CookieAccount]) -> Optional[Dict]:
+    """
+    下载前只解析视频信息，返回时长与预估大小，解析结果进入解析缓存供下载复用。
+
+    account 为任务预留的账号，随后的下载使用同一账号才能命中解析缓存；
+    超过时长或大小限制时抛出对应异常，其他失败返回 None，交给下载时再检查。
+    """
+    job = _build_job(url)
+    if account is not None:
+        job["cookie"], job["cookiefile"] = account.cookie, account.cookiefile
+    start = time.monotonic()
     try:
-        from yt_dlp import YoutubeDL  # type: ignore
-        from yt_dlp.utils import DownloadError  # type: ignore
-    except Exception:
-        raise ImportError("yt_dlp not installed")
-
-    from pathlib import Path
-
-    out_dir = Path(out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    final_url = _expand_short_url(url)
-
-    # 构建 Cookie 文件
-    cookiefile = _ensure_cookiefile(cookie)
-    candidates = _build_format_candidates(height_limit, size_limit_mb)
-    last_err: Optional[Exception] = None
-
-    for i, fmt in enumerate(candidates):
-        headers = _build_browser_like_headers()
-        ydl_opts = {
-            "format": fmt,
-            "outtmpl": str(out_dir / "%(title).80s [%(id)s].%(ext)s"),
-            "noplaylist": True,
-            "merge_output_format": "mp4",
-            "quiet": False,
-            "no_warnings": False,
-            "http_headers": headers,
-            "extractor_args": {
-                "bili": {
-                    "player_client": ["android", "web"],
-                    "lang": ["zh-CN"],
-                }
-            },
-        }
+        info = await _probe(job)
+    except SizeLimitExceeded as e:
+        outcome = "too_long" if isinstance(e, DurationLimitExceeded) else "oversize"
+        metrics.record("preflight", time.monotonic() - start, outcome=outcome)
+        raise
+    except Exception as e:
+        metrics.record("preflight", time.monotonic() - start, outcome="error")
+        logger.debug(f"bili2mp4: 预检失败，按未知大小排队: {e}")
+        return None
+    metrics.record(
+        "preflight", time.monotonic() - start, outcome=info.get("resolver") or "ok"
+    )
+    return info
 
-        if FFMPEG_DIR:
-            ydl_opts["ffmpeg_location"] = FFMPEG_DIR
 
-        # 设置 Cookie
-        if cookiefile:
-            ydl_opts["cookiefile"] = cookiefile
-            logger.info(f"bili2mp4: 使用 cookiefile: {cookiefile}")
-        elif cookie:
-            headers["Cookie"] = cookie
-            logger.info("bili2mp4: 使用 Cookie header")
+def _job_cost(info: Optional[Dict]) -> Optional[float]:
+    """预检结果 -> 调度用的预估大小（MB），无法估算时返回 None"""
+    if not info:
+        return None
+    if info.get("estimated_bytes"):
+        return info["estimated_bytes"] / 1024 / 1024
+    if info.get("duration"):
+        return info["duration"] * _FALLBACK_MB_PER_SECOND
+    return None
+
+
+async def _timed_download(
+    url: str,
+    submitted: float,
+    account: Optional[CookieAccount] = None,
+    out_dir: Optional[Path] = None,
+) -> Tuple[str, str, Dict]:
+    """记录排队等待时间，并把下载器返回的各阶段耗时写入统计"""
+    metrics.record("queue", time.monotonic() - submitted)
+    start = time.monotonic()
+    try:
+        path, title, metadata = await _run_download(url, account, out_dir)
+    except Exception as e:
+        outcome = "oversize" if isinstance(e, SizeLimitExceeded) else "error"
+        if isinstance(e, DurationLimitExceeded):
+            outcome = "too_long"
+        metrics.record("download", time.monotonic() - start, outcome=outcome)
+        raise
+    timings = metadata.get("timings") or {}
+    resolver = metadata.get("resolver") or "yt-dlp"
+    _record_fetch(resolver, timings.get("extract", 0.0))
+    metrics.record("download", timings.get("download", 0.0), metadata.get("bytes", 0))
+    if timings.get("merge"):
+        metrics.record(
+            "merge", timings["merge"], outcome=metadata.get("pipeline", "ok")
+        )
+    return path, title, metadata
+
+
+class _Flight:
+    """同一视频的一次下载，结果分发给所有等待的群"""
 
+    def __init__(self) -> None:
+        self.future: "asyncio.Future[Optional[Tuple[str, str, bool]]]" = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.groups: Set[int] = set()
+        self.pending = 0
+        self.keep_file = False
+
+
+# 规范视频键 -> 正在进行的下载
+_inflight: Dict[str, _Flight] = {}
+
+
+async def _fetch_video(
+    group_id: int, url: str, video_id: Optional[str]
+) -> Optional[Tuple[str, str, bool]]:
+    """获取视频文件，返回 (路径, 标题, 是否为缓存文件)；不满足限制时返回 None"""
+    cache_key: Optional[str] = None
+    if video_id and _video_cache is not None and _video_cache.enabled:
+        cache_key = VideoCache.make_key(video_id, max_height, max_filesize_mb)
+        hit = _video_cache.get(cache_key)
+        if hit:
+            logger.info(f"bili2mp4: 命中缓存 {cache_key}")
+            # 所有群发送完成前不允许淘汰
+            _video_cache.hold(hit[0])
+            return hit[0], hit[1], True
+
+    # 从排队到交付，任务目录中的 .part 与等待合并的音视频流都不允许被清理
+    out_dir = _job_dir(video_id, url)
+    _janitor.hold(str(out_dir))
+    try:
+        return await _fetch_into(group_id, url, video_id, cache_key, out_dir)
+    finally:
+        _janitor.release(str(out_dir))
+
+
+async def _fetch_into(
+    group_id: int,
+    url: str,
+    video_id: Optional[str],
+    cache_key: Optional[str],
+    out_dir: Path,
+) -> Optional[Tuple[str, str, bool]]:
+    """未命中缓存时下载到任务目录 out_dir，检查限制并写入缓存"""
+    # 预检与下载使用同一账号；需要按大小调度或检查时长时先预检，超限的视频不进入下载队列
+    account = _cookie_pool.reserve() if _cookie_pool is not None else None
+    cost: Optional[float] = None
+    if _scheduler.priority or _max_duration_minutes():
+        cost = _job_cost(await _preflight(url, account))
+
+    # 交给调度器排队下载
+    submitted = time.monotonic()
+    path, title, metadata = await _scheduler.run(
+        group_id,
+        video_id or url,
+        lambda: _timed_download(url, submitted, account, out_dir),
+        cost,
+        group_weights.get(group_id, 1.0),
+    )
+    timings = metadata.get("timings") or {}
+    speed = metadata.get("bytes", 0) / max(timings.get("download", 0), 1e-3)
+    logger.info(
+        f"bili2mp4: 下载完成: {title} ({metadata.get('height', 0)}p) "
+        f"格式={metadata.get('format')} 解析次数={metadata.get('extractions', 1)} "
+        f"{metadata.get('bytes', 0) / 1024 / 1024:.1f}MB 用时 "
+        f"{timings.get('download', 0):.1f}s 速度 {speed / 1024 / 1024:.2f}MB/s"
+    )
+
+    # 检查文件大小和分辨率（转码不占用下载并发）
+    _janitor.hold(path)
+    try:
+        fitted = await _fit_limits(path, metadata)
+    finally:
+        _janitor.release(path)
+    if fitted is None:
+        return None
+    path = fitted
+
+    # 写入缓存
+    if cache_key:
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(final_url, download=True)
-                title = info.get("title") or "B站视频"
-
-                # 获取下载信息
-                height = info.get("height", 0)
-                logger.info(f"bili2mp4: 下载完成: {title} ({height}p)")
-
-                # 定位文件
-                final_path = _locate_final_file(ydl, info)
-                if not final_path or not Path(final_path).exists():
-                    raise RuntimeError("未找到已下载的视频文件，可能未安装 ffmpeg")
-                return final_path, title
-        except DownloadError as e:
-            last_err = e
-            continue
+            cached = await _video_cache.put(cache_key, path, title)
+            _video_cache.hold(cached)
+            return cached, title, True
         except Exception as e:
-            last_err = e
-            continue
+            logger.warning(f"bili2mp4: 写入缓存失败: {e}")
+    # 发送完成前不允许清理任务删除
+    _janitor.hold(path)
+    return path, title, False
+
+
+# 任务结果 -> 任务记录的结束状态，其余均记为 failed
+_JOB_FINAL_STATES = {
+    "ok": "done",
+    "discarded": "skipped",
+    "oversize": "skipped",
+    "too_long": "skipped",
+    "duplicate": "skipped",
+}
+
+
+async def _download_and_send(
+    bot: Bot,
+    group_id: int,
+    url: str,
+    received: Optional[float] = None,
+    job_id: Optional[int] = None,
+) -> None:
+    # 端到端耗时从收到消息算起
+    received = received or time.monotonic()
+    if job_id is not None and _job_store is not None:
+        _job_store.mark_running(job_id)
+    outcome = "error"
+    try:
+        outcome = await _deliver(bot, group_id, url)
+    except asyncio.CancelledError:
+        # 关闭时被取消的任务保持未完成状态，下次启动时恢复
+        outcome = "cancelled"
+        raise
+    finally:
+        metrics.record("total", time.monotonic() - received, outcome=outcome)
+        if job_id is not None and _job_store is not None and outcome != "cancelled":
+            state = _JOB_FINAL_STATES.get(outcome, "failed")
+            _job_store.finish(job_id, state, None if state != "failed" else outcome)
+
 
-    if last_err:
-        raise RuntimeError(str(last_err))
-    raise RuntimeError("无法下载该视频")
-
-
-def _locate_final_file(ydl, info) -> Optional[str]:
-    for key in ("requested_downloads", "requested_formats"):
-        arr = info.get(key)
-        if isinstance(arr, list):
-            for it in arr:
-                fp = it.get("filepath")
-                if fp and os.path.exists(fp):
-                    return fp
-    for key in ("filepath", "_filename"):
-        fp = info.get(key)
-        if fp and os.path.exists(fp):
-            return fp
-    # 预测合并后 mp4
-    base = ydl.prepare_filename(info)
-    root, _ = os.path.splitext(base)
-    candidate = root + ".mp4"
-    if os.path.exists(candidate):
-        return candidate
-    # 兜底：按视频ID在目录中搜
-    vid = info.get("id") or ""
-    if vid:
-        dirpath = os.path.dirname(base) or os.getcwd()
+def _spawn_job(
+    bot: Bot, group_id: int, url: str, received: float, job_id: Optional[int]
+) -> None:
+    async def work():
         try:
-            files = [dirpath / f for f in os.listdir(dirpath) if vid in f]
-            if files:
-                files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-                return str(files[0])
-        except Exception:
-            pass
-    return None
+            await _download_and_send(bot, group_id, url, received, job_id)
+        except Exception as e:
+            logger.warning(f"bili2mp4: 处理失败: {e}")
+
+    asyncio.create_task(work())
 
 
-async def _download_and_send(bot: Bot, group_id: int, url: str) -> None:
-    # 执行下载
+async def _deliver(bot: Bot, group_id: int, url: str) -> str:
+    """下载（或复用）并发送视频，返回结果标记"""
+    # 按规范视频ID合并不同群、不同形式链接的同一视频（短链已在事件处理中展开）
+    video_id = canonical_video_id(url)
+    flight_key = VideoCache.make_key(video_id or url, max_height, max_filesize_mb)
+
+    flight = _inflight.get(flight_key)
+    owner = flight is None
+    if flight is None:
+        flight = _inflight[flight_key] = _Flight()
+    elif group_id in flight.groups:
+        logger.debug(f"bili2mp4: 已在处理中，忽略重复: {group_id}|{flight_key}")
+        return "duplicate"
+    else:
+        logger.info(f"bili2mp4: 群{group_id} 复用进行中的下载 {flight_key}")
+    flight.groups.add(group_id)
+    flight.pending += 1
+
+    if owner:
+        try:
+            flight.future.set_result(await _fetch_video(group_id, url, video_id))
+        except Exception as e:
+            flight.future.set_exception(e)
+        finally:
+            _inflight.pop(flight_key, None)
+            if not flight.future.done():
+                # 下载被取消时通知其他等待的群，避免它们一直等待
+                flight.future.set_exception(RuntimeError("下载任务已取消"))
+                # 标记异常已读取，没有其他群等待时不再提示
+                flight.future.exception()
+
+    result: Optional[Tuple[str, str, bool]] = None
     try:
-        path, title = await asyncio.to_thread(
-            _download_with_ytdlp,
-            url,
-            bilibili_cookie,
-            DOWNLOAD_DIR,  # 修复：传递Path对象而不是字符串
-            max_height,
-            max_filesize_mb,
-        )
+        result = await asyncio.shield(flight.future)
+        if result is None:
+            return "discarded"
+        path, title, _ = result
+        sent = await _send_video_with_timeout(bot, group_id, path, title, cleanup=False)
+        if sent in ("ok", "confirmed"):
+            return "ok"
+        if sent == "timeout":
+            # OneBot 实现可能仍在读取文件，留给清理任务按保留时间删除
+            flight.keep_file = True
+        return "send_failed"
+    except QueueFullError as e:
+        logger.warning(f"bili2mp4: {e}，拒绝任务 | group={group_id}")
+        try:
+            await bot.send_group_msg(
+                group_id=group_id, message=Message("⏳ 当前视频任务过多，请稍后再试")
+            )
+        except Exception as e2:
+            logger.debug(f"bili2mp4: 发送排队提示失败: {e2}")
+        return "rejected"
+    except JobDroppedError as e:
+        logger.warning(f"bili2mp4: {e} | group={group_id}")
+        return "dropped"
+    except DurationLimitExceeded as e:
+        logger.info(f"bili2mp4: 跳过下载，{e} | group={group_id}")
+        return "too_long"
+    except SizeLimitExceeded as e:
+        logger.info(f"bili2mp4: 跳过下载，{e} | group={group_id}")
+        return "oversize"
     except (ImportError, RuntimeError) as e:
-        logger.warning(f"下载环境异常: {e}")
-        return
+        logger.warning(f"下载环境异常: {e} | group={group_id}")
+        return "error"
     except Exception as e:
-        logger.error(f"bili2mp4: 下载异常: {e}")
-        return
-
-    # 检查文件大小和分辨率
-    if not _check_video_file(path):
-        return
-
-    # 发送视频
-    await _send_video_with_timeout(bot, group_id, path, title)
+        logger.error(f"bili2mp4: 下载异常: {e} | group={group_id}")
+        return "error"
+    finally:
+        flight.pending -= 1
+        # 最后一个群发送完成后清理非缓存文件；发送失败的文件留给清理任务
+        if flight.pending == 0 and result and result[2]:
+            _video_cache.release(result[0])
+        if flight.pending == 0 and result and not result[2]:
+            _janitor.release(result[0])
+        if flight.pending == 0 and result and not result[2] and not flight.keep_file:
+            try:
+                Path(result[0]).unlink()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.debug(f"Failed to delete temp file {result[0]}: {e}")
 
 
 async def _handle_group_command(
@@ -629,12 +1176,14 @@ async def _handle_config_command(
     bot: Bot, event: PrivateMessageEvent, text: str
 ) -> bool:
     """处理配置相关命令"""
-    global bilibili_cookie, max_height, max_filesize_mb
+    global bilibili_cookie, max_height, max_filesize_mb, bandwidth_limit_mb
+    global max_duration_minutes, schedule_aging_mb
 
     # 设置Cookie
     m = CMD_SET_COOKIE_RE.fullmatch(text)
     if m:
         bilibili_cookie = m.group(1).strip()
+        _sync_cookie_pool()
         _save_state()
         await bot.send(event, Message("✅ 已设置B站 Cookie"))
         return True
@@ -642,10 +1191,57 @@ async def _handle_config_command(
     # 清除Cookie
     if text in CMD_CLEAR_COOKIE:
         bilibili_cookie = ""
+        _sync_cookie_pool()
         _save_state()
         await bot.send(event, Message("🧹 已清除B站 Cookie"))
         return True
 
+    # 添加账号
+    m = CMD_ADD_ACCOUNT_RE.fullmatch(text)
+    if m:
+        name, cookie = m.group(1), m.group(2).strip()
+        if name == DEFAULT_ACCOUNT:
+            bilibili_cookie = cookie
+        else:
+            cookie_accounts[name] = cookie
+        _sync_cookie_pool()
+        _save_state()
+        await bot.send(
+            event, Message(f"✅ 已设置B站账号 {name}，共 {len(_cookie_pool)} 个")
+        )
+        return True
+
+    # 删除账号
+    m = CMD_DEL_ACCOUNT_RE.fullmatch(text)
+    if m:
+        name = m.group(1)
+        if name == DEFAULT_ACCOUNT and bilibili_cookie:
+            bilibili_cookie = ""
+        elif cookie_accounts.pop(name, None) is None:
+            await bot.send(event, Message(f"ℹ️ 账号 {name} 不存在"))
+            return True
+        _sync_cookie_pool()
+        _save_state()
+        await bot.send(event, Message(f"🧹 已删除B站账号 {name}"))
+        return True
+
+    # 查看账号
+    if text in CMD_SHOW_ACCOUNTS:
+        stats = _cookie_pool.stats()
+        if not stats:
+            await bot.send(event, Message("暂未设置B站账号"))
+            return True
+        lines = [f"B站账号：共 {len(stats)} 个"]
+        for a in stats:
+            state = f"冷却中 {a['cooldown']:.0f}s" if a["cooldown"] else "可用"
+            idle = f"{a['idle']:.0f}s前" if a["idle"] is not None else "未使用"
+            lines.append(
+                f"• {a['name']}：{state}，使用{a['uses']}次 成功{a['ok']} "
+                f"失败{a['failures']}（风控{a['rate_limited']}），最近使用 {idle}"
+            )
+        await bot.send(event, Message("\n".join(lines)))
+        return True
+
     # 设置清晰度
     m = CMD_SET_HEIGHT_RE.fullmatch(text)
     if m:
@@ -673,17 +1269,119 @@ async def _handle_config_command(
         )
         return True
 
+    # 设置带宽（MB/s）
+    m = CMD_SET_BANDWIDTH_RE.fullmatch(text)
+    if m:
+        bandwidth_limit_mb = float(m.group(1))
+        _bandwidth.set_limit(bandwidth_limit_mb * 1024 * 1024)
+        _save_state()
+        limit = f"<= {bandwidth_limit_mb:g}MB/s" if bandwidth_limit_mb else "不限制"
+        await bot.send(event, Message(f"🚦 下载总带宽 {limit}"))
+        return True
+
+    # 设置时长上限（分钟）
+    m = CMD_SET_DURATION_RE.fullmatch(text)
+    if m:
+        max_duration_minutes = int(m.group(1))
+        _save_state()
+        limit = f"<= {max_duration_minutes}分钟" if max_duration_minutes else "不限制"
+        await bot.send(event, Message(f"⏱ 视频时长限制为 {limit}"))
+        return True
+
+    # 设置群权重
+    m = CMD_SET_WEIGHT_RE.fullmatch(text)
+    if m:
+        gid, weight = int(m.group(1)), float(m.group(2))
+        if weight <= 0:
+            await bot.send(event, Message("⚠️ 权重需大于 0"))
+            return True
+        if weight == 1:
+            group_weights.pop(gid, None)
+        else:
+            group_weights[gid] = weight
+        _save_state()
+        note = "" if _scheduler.priority else "（未开启优先级调度，暂不生效）"
+        await bot.send(event, Message(f"⚖️ 群 {gid} 的调度权重为 {weight:g}{note}"))
+        return True
+
+    # 设置排队老化速度（MB/分钟）
+    m = CMD_SET_AGING_RE.fullmatch(text)
+    if m:
+        schedule_aging_mb = float(m.group(1))
+        _scheduler.aging = schedule_aging_mb
+        _save_state()
+        note = "" if _scheduler.priority else "（未开启优先级调度，暂不生效）"
+        await bot.send(
+            event,
+            Message(f"⏳ 每等待一分钟抵扣 {schedule_aging_mb:g}MB 预估大小{note}"),
+        )
+        return True
+
     # 查看参数
     if text in CMD_SHOW_PARAMS:
+        cache_info = "关闭"
+        if _video_cache is not None and _video_cache.enabled:
+            st = _video_cache.stats()
+            cache_info = (
+                f"{st['entries']}个/{st['bytes'] / 1024 / 1024:.0f}MB，"
+                f"命中{st['hits']}/未命中{st['misses']}"
+            )
+        janitor_st = _janitor.stats()
+        bw = _bandwidth.stats()
+        bw_info = "不限"
+        if bw["limit"]:
+            bw_info = (
+                f"{bw['limit'] / 1024 / 1024:g}MB/s（下载中{bw['downloads']}个，"
+                f"每个{(bw['share'] or bw['budget']) / 1024 / 1024:.2f}MB/s）"
+            )
+        schedule_info = "先来先到"
+        if _scheduler.priority:
+            schedule_info = (
+                f"短任务优先（老化 {_scheduler.aging:g}MB/分钟，"
+                f"设置权重的群 {len(group_weights)} 个）"
+            )
+        max_minutes = _max_duration_minutes()
+        size_info = f"{max_filesize_mb}MB" if max_filesize_mb else "不限"
+        duration_info = f"{max_minutes}分钟" if max_minutes else "不限"
+        cookie_info = "已设置" if bilibili_cookie else "未设置"
         await bot.send(
             event,
             Message(
-                f"参数：清晰度<= {max_height or '不限'}；大小<= {str(max_filesize_mb) + 'MB' if max_filesize_mb else '不限'}；"
-                f"Cookie={'已设置' if bool(bilibili_cookie) else '未设置'}；启用群数={len(enabled_groups)}"
+                f"参数：清晰度<= {max_height or '不限'}；大小<= {size_info}；"
+                f"Cookie={cookie_info}（账号{len(_cookie_pool)}个）；"
+                f"启用群数={len(enabled_groups)}；缓存={cache_info}；"
+                f"分辨率探测 跳过{probe_stats['skipped']}/执行{probe_stats['probed']}；"
+                f"下载目录已清理 {janitor_st['removed_files']}个/"
+                f"{janitor_st['reclaimed_bytes'] / 1024 / 1024:.0f}MB，"
+                f"磁盘剩余 {janitor_st['free_bytes'] / 1024 / 1024 / 1024:.1f}GB，"
+                f"因空间不足拒绝 {janitor_st['rejected']} 次；"
+                f"总带宽={bw_info}；时长<= {duration_info}；调度={schedule_info}"
             ),
         )
         return True
 
+    # 查看队列
+    if text in CMD_SHOW_QUEUE:
+        snap = _scheduler.snapshot()
+        lines = [
+            f"队列：等待 {len(snap['queued'])} 个，进行中 {len(snap['active'])} 个"
+            f"（并发上限 {_scheduler.workers}，每群 {_scheduler.per_group or '不限'}）"
+        ]
+        for j in snap["active"]:
+            lines.append(f"▶ {j['label']} 群{j['group_id']} 已运行 {j['running']:.0f}s")
+        for j in snap["queued"]:
+            cost = f" 预估 {j['cost']:.0f}MB" if j["cost"] is not None else ""
+            lines.append(
+                f"⏸ {j['label']} 群{j['group_id']} 已等待 {j['waiting']:.0f}s{cost}"
+            )
+        await bot.send(event, Message("\n".join(lines)))
+        return True
+
+    # 查看统计
+    if text in CMD_SHOW_STATS:
+        await bot.send(event, Message(metrics.render_text()))
+        return True
+
     return False
 
 
@@ -691,10 +1389,152 @@ async def _handle_config_command(
 # 事件监听
 # =========================
 
+driver = get_driver()
+
+
+async def _start_metrics_exporters() -> None:
+    """按配置启动指标文件导出与本地 HTTP 端点"""
+    global _metrics_task, _metrics_server
+
+    if _plugin_config.metrics_file:
+        path = Path(_plugin_config.metrics_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _metrics_task = asyncio.create_task(export_file_loop(path))
+    if _plugin_config.metrics_port > 0:
+        _metrics_server = await start_http_exporter(
+            _plugin_config.metrics_host, _plugin_config.metrics_port
+        )
+
+
+@driver.on_startup
+async def _on_startup():
+    global _janitor_task
+
+    _init_plugin()
+    # 预热下载进程
+    if _process_pool is not None:
+        await _process_pool.start()
+    await _start_metrics_exporters()
+    if _file_server is not None:
+        await _file_server.start()
+    _janitor_task = asyncio.create_task(
+        _janitor.run(max(10, _plugin_config.janitor_interval_seconds))
+    )
+
+
+@driver.on_bot_connect
+async def _on_bot_connect(bot: Bot):
+    """机器人连接后恢复上次中断的任务"""
+    global _resume_jobs
+
+    _init_plugin()
+    if not _resume_jobs:
+        return
+    mine = [j for j in _resume_jobs if j["bot_id"] == str(bot.self_id)]
+    _resume_jobs = [j for j in _resume_jobs if j["bot_id"] != str(bot.self_id)]
+    for job in mine:
+        if job["group_id"] not in enabled_groups:
+            _job_store.finish(job["id"], "skipped", "group disabled")
+            continue
+        logger.info(
+            f"bili2mp4: 恢复任务 #{job['id']} 群{job['group_id']} "
+            f"{job['video_id'] or job['url']}（第{job['attempts'] + 1}次）"
+        )
+        _spawn_job(bot, job["group_id"], job["url"], time.monotonic(), job["id"])
+
+
+@driver.on_shutdown
+async def _on_shutdown():
+    if _state_save_task is not None and not _state_save_task.done():
+        await _state_save_task
+    try:
+        _flush_state()
+    except Exception as e:
+        logger.warning(f"bili2mp4: 状态保存失败: {e}")
+    if _janitor_task is not None:
+        _janitor_task.cancel()
+    if _metrics_task is not None:
+        _metrics_task.cancel()
+    if _metrics_server is not None:
+        _metrics_server.close()
+    if _process_pool is not None:
+        await _process_pool.close()
+    if _probe_pool is not None:
+        await _probe_pool.close()
+    if _download_executor is not None:
+        _download_executor.shutdown(wait=False)
+    if _probe_executor is not None:
+        _probe_executor.shutdown(wait=False)
+    if _resolver is not None:
+        await _resolver.close()
+    if _job_store is not None:
+        _job_store.close()
+    if _video_cache is not None:
+        await _video_cache.close()
+    if _file_server is not None:
+        await _file_server.close()
+
+
 # 群消息监听
 group_listener = on_message(priority=100, block=False)
 
 
+async def _expand_list(url: str, limit: int) -> List[str]:
+    """展开番剧季/合集为各视频链接，失败返回空列表"""
+    accounts = _cookie_pool.candidates() if _cookie_pool is not None else []
+    cookie = accounts[0].cookie if accounts else ""
+    cookiefile = accounts[0].cookiefile if accounts else None
+    with metrics.timer("list") as t:
+        try:
+            return await asyncio.to_thread(list_entries, url, limit, cookiefile, cookie)
+        except Exception as e:
+            t.outcome = "failed"
+            logger.warning(f"bili2mp4: 展开合集失败: {url} | err={e}")
+            return []
+
+
+async def _resolve_message_videos(urls: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    将一条消息中的链接解析为 (下载链接, 规范视频ID) 列表。
+
+    在事件处理中展开短链与番剧季/合集，保证入队前即可按规范视频ID去重；
+    总数不超过 max_videos_per_message，避免一条消息刷满下载队列。
+    """
+    limit = max(1, _plugin_config.max_videos_per_message)
+    videos: List[Tuple[str, Optional[str]]] = []
+    seen: Set[str] = set()
+    truncated = False
+    for raw in urls:
+        if len(videos) >= limit:
+            truncated = True
+            break
+        url = raw
+        if is_short_url(url):
+            with metrics.timer("expand") as t:
+                url = await _resolver.resolve(url)
+                if url == raw:
+                    t.outcome = "failed"
+        video_id = canonical_video_id(url)
+        entries = [url]
+        if video_id and is_list_id(video_id):
+            entries = await _expand_list(canonical_url(video_id), limit - len(videos))
+        for entry in entries:
+            video_id = canonical_video_id(entry)
+            if video_id:
+                entry = canonical_url(video_id)
+            key = video_id or entry
+            if key in seen:
+                continue
+            if len(videos) >= limit:
+                truncated = True
+                break
+            seen.add(key)
+            videos.append((entry, video_id))
+    if truncated:
+        logger.info(f"bili2mp4: 单条消息最多处理 {limit} 个视频，其余已忽略")
+    return videos
+
+
 @group_listener.handle()
 async def handle_group(bot: Bot, event: Event):
     try:
@@ -707,28 +1547,39 @@ async def handle_group(bot: Bot, event: Event):
         if group_id not in enabled_groups:
             return
 
-        urls = _extract_bili_urls_from_event(event)
+        received = time.monotonic()
+        with metrics.timer("extract") as t:
+            urls = extract_bili_urls(event.message)
+            if not urls:
+                t.outcome = "none"
         if not urls:
             logger.debug(f"bili2mp4: 群{group_id} 未在该消息中发现B站链接")
             return
 
-        url = urls[0]
-        key = f"{group_id}|{url}"
-        if key in _processing:
-            logger.debug(f"bili2mp4: 已在处理中，忽略重复: {key}")
+        videos = await _resolve_message_videos(urls)
+        if not videos:
             return
-        _processing.add(key)
-        logger.info(f"bili2mp4: 检测到B站链接")
-
-        async def work():
-            try:
-                await _download_and_send(bot, group_id, url)
-            except Exception as e:
-                logger.warning(f"bili2mp4: 处理失败: {e}")
-            finally:
-                _processing.discard(key)
-
-        asyncio.create_task(work())
+        logger.info(f"bili2mp4: 检测到B站链接 {len(videos)} 个")
+
+        # 磁盘空间不足时先尝试清理，仍不足则拒绝
+        if not _janitor.has_space():
+            await asyncio.to_thread(_janitor.sweep)
+            if not _janitor.has_space():
+                _janitor.rejected += 1
+                logger.warning(
+                    f"bili2mp4: 磁盘剩余空间不足，拒绝任务 | group={group_id}"
+                )
+                await bot.send_group_msg(
+                    group_id=group_id, message=Message("💾 磁盘空间不足，请稍后再试")
+                )
+                return
+
+        # 每个视频作为独立任务调度，同群并发由调度器限制
+        for url, video_id in videos:
+            job_id = None
+            if _job_store is not None:
+                job_id = _job_store.add(bot.self_id, group_id, url, video_id)
+            _spawn_job(bot, group_id, url, received, job_id)
     except Exception as e:
         logger.warning(f"bili2mp4: 群消息处理异常: {e}")
 
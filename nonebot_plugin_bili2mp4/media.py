@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import glob
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from nonebot import logger
+
+# 分辨率探测统计：probed 实际调用 ffprobe 次数，skipped 直接使用 yt-dlp 信息的次数
+probe_stats: Dict[str, int] = {"probed": 0, "skipped": 0, "timeout": 0}
+
+
+def ffmpeg_tool(name: str, ffmpeg_dir: Optional[str]) -> str:
+    """返回 ffmpeg 目录下的工具路径，未配置目录时使用 PATH 中的同名程序"""
+    exe = f"{name}.exe" if os.name == "nt" else name
+    return str(Path(ffmpeg_dir) / exe) if ffmpeg_dir else exe
+
+
+async def probe_resolution(
+    path: str, ffmpeg_dir: Optional[str], timeout: float = 30
+) -> Optional[Tuple[int, int]]:
+    """异步调用 ffprobe 获取首个视频流的 (宽, 高)，失败或超时返回 None"""
+    probe_stats["probed"] += 1
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            ffmpeg_tool("ffprobe", ffmpeg_dir),
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height",
+            "-of",
+            "csv=p=0",
+            path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except Exception as e:
+        logger.debug(f"bili2mp4: 启动 ffprobe 失败: {e}")
+        return None
+
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        probe_stats["timeout"] += 1
+        proc.kill()
+        await proc.wait()
+        logger.warning(f"bili2mp4: ffprobe 超时（{timeout}s）: {Path(path).name}")
+        return None
+
+    if proc.returncode != 0:
+        return None
+    try:
+        width, height = stdout.decode().strip().split(",")[:2]
+        return int(width), int(height)
+    except ValueError:
+        return None
+
+
+async def video_resolution(
+    path: str,
+    metadata: Dict,
+    ffmpeg_dir: Optional[str],
+    timeout: float = 30,
+) -> Optional[Tuple[int, int]]:
+    """优先使用 yt-dlp 已知的合并后分辨率，缺失时才调用 ffprobe"""
+    width, height = metadata.get("width"), metadata.get("height")
+    if width and height:
+        probe_stats["skipped"] += 1
+        return int(width), int(height)
+    return await probe_resolution(path, ffmpeg_dir, timeout)
+
+
+async def probe_duration(
+    path: str, ffmpeg_dir: Optional[str], timeout: float = 30
+) -> Optional[float]:
+    """异步获取媒体时长（秒），失败返回 None"""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            ffmpeg_tool("ffprobe", ffmpeg_dir),
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "csv=p=0",
+            path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        return float(stdout.decode().strip())
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    except Exception:
+        return None
+
+
+async def _run_ffmpeg(args: List[str]) -> Tuple[int, str]:
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode or 0, stderr.decode(errors="replace")[-500:]
+
+
+async def transcode_to_fit(
+    src: str,
+    ffmpeg_dir: Optional[str],
+    max_height: int,
+    max_size_mb: int,
+    duration: Optional[float],
+    preset: str = "veryfast",
+    threads: int = 0,
+    two_pass: bool = False,
+) -> Optional[str]:
+    """
+    重新编码视频以满足清晰度与大小限制，成功返回新文件路径。
+
+    有大小限制时按 目标大小/时长 计算码率：默认 CRF+maxrate 单遍编码，
+    two_pass 为 True 时使用两遍 ABR 编码；输出带 +faststart 以便QQ客户端边下边播。
+    """
+    src_path = Path(src)
+    out_path = src_path.with_name(f"{src_path.stem}.transcoded.mp4")
+    ffmpeg = ffmpeg_tool("ffmpeg", ffmpeg_dir)
+    audio_kbps = 128
+
+    video_args = ["-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p"]
+    if max_height and max_height > 0:
+        video_args += ["-vf", f"scale=-2:'min(ih,{max_height})'"]
+
+    video_kbps = 0
+    if max_size_mb and max_size_mb > 0:
+        if not duration:
+            duration = await probe_duration(src, ffmpeg_dir)
+        if not duration:
+            logger.warning(f"bili2mp4: 无法获取时长，放弃转码: {src_path.name}")
+            return None
+        # 预留 5% 给容器开销
+        total_kbps = max_size_mb * 1024 * 1024 * 8 * 0.95 / duration / 1000
+        video_kbps = int(total_kbps - audio_kbps)
+        if video_kbps < 100:
+            logger.warning(
+                f"bili2mp4: 时长 {duration:.0f}s 在 {max_size_mb}MB 内码率过低，放弃转码"
+            )
+            return None
+
+    common = ["-threads", str(threads)] if threads and threads > 0 else []
+    tail = [
+        "-c:a",
+        "aac",
+        "-b:a",
+        f"{audio_kbps}k",
+        "-movflags",
+        "+faststart",
+        str(out_path),
+    ]
+
+    start = time.monotonic()
+    if video_kbps and two_pass:
+        passlog = str(out_path) + ".passlog"
+        rate = ["-b:v", f"{video_kbps}k", "-passlogfile", passlog]
+        null_out = "NUL" if os.name == "nt" else "/dev/null"
+        steps = [
+            [ffmpeg, "-y", "-i", src, *video_args, *rate, *common]
+            + ["-pass", "1", "-an", "-f", "mp4", null_out],
+            [ffmpeg, "-y", "-i", src, *video_args, *rate, *common, "-pass", "2"] + tail,
+        ]
+    else:
+        rate = ["-crf", "23"]
+        if video_kbps:
+            rate += ["-maxrate", f"{video_kbps}k", "-bufsize", f"{video_kbps * 2}k"]
+        steps = [[ffmpeg, "-y", "-i", src, *video_args, *rate, *common] + tail]
+
+    try:
+        for args in steps:
+            code, err = await _run_ffmpeg(args)
+            if code != 0:
+                logger.warning(f"bili2mp4: 转码失败（{code}）: {err}")
+                out_path.unlink(missing_ok=True)
+                return None
+    except Exception as e:
+        logger.warning(f"bili2mp4: 转码异常: {e}")
+        out_path.unlink(missing_ok=True)
+        return None
+    finally:
+        for f in out_path.parent.glob(glob.escape(out_path.name) + ".passlog*"):
+            f.unlink(missing_ok=True)
+
+    elapsed = time.monotonic() - start
+    src_size, out_size = src_path.stat().st_size, out_path.stat().st_size
+    logger.info(
+        f"bili2mp4: 转码完成 {src_path.name} 用时 {elapsed:.1f}s "
+        f"{src_size / 1024 / 1024:.1f}MB -> {out_size / 1024 / 1024:.1f}MB "
+        f"压缩比 {src_size / max(out_size, 1):.2f}"
+    )
+    return str(out_path)
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from nonebot import logger
+
+# 阶段名 -> 管理员查看时的中文名
+STAGES = {
+    "extract": "链接提取",
+    "expand": "短链展开",
+    "list": "合集展开",
+    "preflight": "下载前预检",
+    "queue": "排队等待",
+    "fetch": "解析视频",
+    "fetch_saved": "快速解析节省",
+    "download": "媒体下载",
+    "merge": "合并",
+    "probe": "文件检查",
+    "transcode": "转码",
+    "send": "上传发送",
+    "total": "端到端",
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class StageTimer:
+    """with 语句计时，可在块内设置 bytes 与 outcome"""
+
+    def __init__(self, registry: "Metrics", stage: str) -> None:
+        self.registry = registry
+        self.stage = stage
+        self.bytes = 0
+        self.outcome = "ok"
+        self._start = 0.0
+
+    def __enter__(self) -> "StageTimer":
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self.outcome == "ok":
+            self.outcome = "error"
+        self.registry.record(
+            self.stage, time.monotonic() - self._start, self.bytes, self.outcome
+        )
+
+
+class Metrics:
+    """
+    按阶段记录耗时、字节数与结果。
+
+    耗时保留最近 window 个样本用于计算滚动分位数，次数、字节数与结果为累计值。
+    """
+
+    def __init__(self, window: int = 500) -> None:
+        self.window = max(10, int(window))
+        self._samples: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.window)
+        )
+        self._count: Dict[str, int] = defaultdict(int)
+        self._sum: Dict[str, float] = defaultdict(float)
+        self._bytes: Dict[str, int] = defaultdict(int)
+        self._outcomes: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def record(
+        self, stage: str, seconds: float, nbytes: int = 0, outcome: str = "ok"
+    ) -> None:
+        self._samples[stage].append(seconds)
+        self._count[stage] += 1
+        self._sum[stage] += seconds
+        self._bytes[stage] += int(nbytes or 0)
+        self._outcomes[(stage, outcome)] += 1
+
+    def timer(self, stage: str) -> StageTimer:
+        return StageTimer(self, stage)
+
+    def summary(self) -> Dict[str, Dict]:
+        out: Dict[str, Dict] = {}
+        for stage in self._count:
+            values = sorted(self._samples[stage])
+            out[stage] = {
+                "count": self._count[stage],
+                "sum": self._sum[stage],
+                "bytes": self._bytes[stage],
+                "quantiles": {q: _quantile(values, q) for q in QUANTILES},
+                "outcomes": {
+                    o: n for (s, o), n in self._outcomes.items() if s == stage
+                },
+            }
+        return out
+
+    def render_text(self) -> str:
+        """管理员命令展示用"""
+        summary = self.summary()
+        if not summary:
+            return "暂无统计数据"
+        lines = ["阶段耗时（p50 / p95，最近样本）："]
+        for stage in [s for s in STAGES if s in summary] + [
+            s for s in summary if s not in STAGES
+        ]:
+            st = summary[stage]
+            q = st["quantiles"]
+            outcomes = "，".join(f"{o}={n}" for o, n in sorted(st["outcomes"].items()))
+            line = (
+                f"• {STAGES.get(stage, stage)}: {q[0.5]:.2f}s / {q[0.95]:.2f}s "
+                f"共{st['count']}次（{outcomes}）"
+            )
+            if st["bytes"]:
+                line += f" {st['bytes'] / 1024 / 1024:.1f}MB"
+            lines.append(line)
+        for name, fn in self.gauges.items():
+            try:
+                lines.append(f"• {name}: {fn():g}")
+            except Exception:
+                pass
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        summary = self.summary()
+        lines = [
+            "# HELP bili2mp4_stage_seconds Stage latency over the recent window.",
+            "# TYPE bili2mp4_stage_seconds summary",
+        ]
+        for stage, st in summary.items():
+            for q, v in st["quantiles"].items():
+                lines.append(
+                    f'bili2mp4_stage_seconds{{stage="{stage}",quantile="{q}"}} {v:.6f}'
+                )
+            lines.append(
+                f'bili2mp4_stage_seconds_sum{{stage="{stage}"}} {st["sum"]:.6f}'
+            )
+            lines.append(
+                f'bili2mp4_stage_seconds_count{{stage="{stage}"}} {st["count"]}'
+            )
+        lines += [
+            "# HELP bili2mp4_stage_bytes_total Bytes processed per stage.",
+            "# TYPE bili2mp4_stage_bytes_total counter",
+        ]
+        for stage, st in summary.items():
+            lines.append(f'bili2mp4_stage_bytes_total{{stage="{stage}"}} {st["bytes"]}')
+        lines += [
+            "# HELP bili2mp4_stage_outcomes_total Stage results by outcome.",
+            "# TYPE bili2mp4_stage_outcomes_total counter",
+        ]
+        for stage, st in summary.items():
+            for outcome, n in st["outcomes"].items():
+                lines.append(
+                    f'bili2mp4_stage_outcomes_total{{stage="{stage}",'
+                    f'outcome="{outcome}"}} {n}'
+                )
+        for name, fn in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"# TYPE bili2mp4_{name} gauge")
+            lines.append(f"bili2mp4_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# =========================
+# 导出
+# =========================
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+async def export_file_loop(path: Path, interval: float = 15) -> None:
+    """定期把 Prometheus 文本写入文件，供 node_exporter textfile 收集"""
+    while True:
+        try:
+            await asyncio.to_thread(_write_atomic, path, metrics.render_prometheus())
+        except Exception as e:
+            logger.debug(f"bili2mp4: 写入指标文件失败: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _handle_http(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        while (await asyncio.wait_for(reader.readline(), timeout=10)) not in (
+            b"\r\n",
+            b"\n",
+            b"",
+        ):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] in ("/metrics", "/"):
+            status, body = "200 OK", metrics.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_exporter(host: str, port: int) -> Optional[asyncio.AbstractServer]:
+    """在本地端口提供 /metrics"""
+    try:
+        server = await asyncio.start_server(_handle_http, host, port)
+    except Exception as e:
+        logger.warning(f"bili2mp4: 指标端口 {host}:{port} 启动失败: {e}")
+        return None
+    logger.info(f"bili2mp4: 指标服务已启动 http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from nonebot import logger
+
+from .downloader import SizeLimitExceeded, DurationLimitExceeded
+
+# 以 runpy 启动下载模块，避免把插件目录加入子进程的 sys.path
+_BOOTSTRAP = "import runpy, sys; runpy.run_path(sys.argv[1], run_name='__main__')"
+_WORKER_SCRIPT = str(Path(__file__).with_name("downloader.py"))
+# 重启下载进程失败时的重试间隔（秒）
+_RESPAWN_BACKOFF = (1, 2, 4)
+
+
+class _Worker:
+    def __init__(self, proc: asyncio.subprocess.Process) -> None:
+        self.proc = proc
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    async def call(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        assert self.proc.stdin is not None and self.proc.stdout is not None
+        self.proc.stdin.write((json.dumps(job, ensure_ascii=False) + "\n").encode())
+        await self.proc.stdin.drain()
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise ConnectionError("下载进程异常退出")
+        return json.loads(line)
+
+    def send_control(self, job_id: int, control: Dict[str, Any]) -> None:
+        """下发运行中任务的设置变更（如限速），无需等待"""
+        if not self.alive or self.proc.stdin is None:
+            return
+        msg = {"id": job_id, "control": control}
+        self.proc.stdin.write((json.dumps(msg) + "\n").encode())
+
+    async def close(self) -> None:
+        if not self.alive:
+            return
+        try:
+            assert self.proc.stdin is not None
+            self.proc.stdin.close()
+            await asyncio.wait_for(self.proc.wait(), timeout=5)
+        except Exception:
+            self.proc.kill()
+
+
+class DownloadProcessPool:
+    """
+    常驻的 yt-dlp 下载进程池。
+
+    每个进程预先导入 yt-dlp 并逐个处理任务，使解析与后处理不占用机器人进程的 GIL；
+    进程崩溃时自动重启（失败时退避重试），当前任务以 RuntimeError 失败；
+    所有进程都无法启动时，等待中的任务同样以 RuntimeError 失败。
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = max(1, int(size))
+        # None 用于唤醒等待者重新检查（所有进程都已退出时）
+        self._idle: "Optional[asyncio.Queue[Optional[_Worker]]]" = None
+        self._spawning = 0
+        self._workers: List[_Worker] = []
+        self._ids = itertools.count(1)
+        self._running: Dict[int, Tuple[_Worker, Dict[str, Any]]] = {}
+        self.restarts = 0
+
+    async def _spawn(self) -> _Worker:
+        self._spawning += 1
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-c",
+                _BOOTSTRAP,
+                _WORKER_SCRIPT,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+            worker = _Worker(proc)
+            assert proc.stdout is not None
+            line = await proc.stdout.readline()
+            if not line:
+                raise RuntimeError("下载进程启动失败")
+            self._workers.append(worker)
+            return worker
+        finally:
+            self._spawning -= 1
+
+    async def start(self) -> None:
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            try:
+                self._idle.put_nowait(await self._spawn())
+            except Exception as e:
+                logger.warning(f"bili2mp4: 启动下载进程失败: {e}")
+        logger.info(f"bili2mp4: 下载进程池已启动，进程数={self._idle.qsize()}")
+
+    async def _replace(self, worker: _Worker) -> None:
+        if worker in self._workers:
+            self._workers.remove(worker)
+        await worker.close()
+        self.restarts += 1
+        for delay in (0,) + _RESPAWN_BACKOFF:
+            await asyncio.sleep(delay)
+            if self._idle is None:
+                # 进程池已关闭
+                return
+            try:
+                self._idle.put_nowait(await self._spawn())
+                logger.warning("bili2mp4: 下载进程已重启")
+                return
+            except Exception as e:
+                logger.error(f"bili2mp4: 下载进程重启失败: {e}")
+        if not self._workers and self._idle is not None:
+            # 没有可用进程：唤醒等待者，由其再尝试启动并把错误返回给调用方
+            self._idle.put_nowait(None)
+
+    async def _acquire(self) -> _Worker:
+        assert self._idle is not None
+        while True:
+            if not self._workers and not self._spawning:
+                # 所有进程都已退出且重启失败：当场再启动一次，失败时直接报错
+                try:
+                    return await self._spawn()
+                except Exception as e:
+                    raise RuntimeError(f"没有可用的下载进程: {e}") from e
+            worker = await self._idle.get()
+            if worker is None:
+                if not self._workers:
+                    # 继续唤醒下一个等待者
+                    self._idle.put_nowait(None)
+                continue
+            if worker.alive:
+                return worker
+            await self._replace(worker)
+
+    async def submit(
+        self, job: Dict[str, Any], control: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, str, Dict[str, Any]]:
+        """
+        在空闲进程中执行下载任务，返回 (路径, 标题, 元数据)。
+
+        control 为调用方持有的设置字典，修改后调用 push_controls 下发给下载进程。
+        """
+        reply = await self._call(job, control)
+        path, title, metadata = reply["result"]
+        return path, title, metadata
+
+    async def probe(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """在空闲进程中执行下载前预检（probe_video），返回时长与预估大小"""
+        reply = await self._call(dict(job, action="probe"))
+        return reply["result"]
+
+    async def _call(
+        self, job: Dict[str, Any], control: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        await self.start()
+        assert self._idle is not None
+        worker = await self._acquire()
+
+        payload = dict(job, id=next(self._ids))
+        if control is not None:
+            payload.update(control)
+            self._running[payload["id"]] = (worker, control)
+        try:
+            reply = await worker.call(payload)
+        except BaseException as e:
+            # 进程崩溃、协议错误或任务被取消：丢弃该进程并补充新进程
+            asyncio.create_task(self._replace(worker))
+            if isinstance(e, Exception):
+                raise RuntimeError(f"下载进程异常: {e}") from e
+            raise
+        finally:
+            self._running.pop(payload["id"], None)
+        self._idle.put_nowait(worker)
+
+        if reply.get("ok"):
+            return reply
+        if reply.get("kind") == "ImportError":
+            raise ImportError(reply.get("error"))
+        if reply.get("kind") == "DurationLimitExceeded":
+            raise DurationLimitExceeded(reply.get("error"))
+        if reply.get("kind") == "SizeLimitExceeded":
+            raise SizeLimitExceeded(reply.get("error"))
+        raise RuntimeError(reply.get("error") or "下载失败")
+
+    def push_controls(self) -> None:
+        for job_id, (worker, control) in list(self._running.items()):
+            worker.send_control(job_id, control)
+
+    async def close(self) -> None:
+        workers, self._workers = self._workers, []
+        await asyncio.gather(*(w.close() for w in workers), return_exceptions=True)
+        self._idle = None
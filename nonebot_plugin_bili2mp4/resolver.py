@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import urllib.request
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from nonebot import logger
+
+from .downloader import build_browser_like_headers
+
+SHORT_HOSTS = {"b23.tv", "www.b23.tv"}
+
+
+def is_short_url(u: str) -> bool:
+    return (urlparse(u).hostname or "").lower() in SHORT_HOSTS
+
+
+def _short_headers() -> Dict[str, str]:
+    return {
+        "User-Agent": build_browser_like_headers()["User-Agent"],
+        "Referer": "https://www.bilibili.com/",
+    }
+
+
+def _expand_short_url(u: str, timeout: float = 8.0) -> str:
+    """阻塞式展开短链，未安装 httpx 时使用"""
+    try:
+        if not is_short_url(u):
+            return u
+        hdrs = _short_headers()
+        try:
+            req = urllib.request.Request(u, headers=hdrs, method="HEAD")
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                final = resp.geturl()
+                return final or u
+        except Exception:
+            req = urllib.request.Request(u, headers=hdrs, method="GET")
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                final = resp.geturl()
+                return final or u
+    except Exception as e:
+        logger.debug(f"bili2mp4: 短链展开失败，使用原链接（{u}）：{e}")
+        return u
+
+
+class ShortLinkResolver:
+    """
+    b23.tv 短链异步解析器。
+
+    复用同一个长连接 HTTP 客户端，只读取第一跳重定向的 Location，不下载页面内容；
+    解析结果放入 LRU+TTL 缓存，可选持久化到数据目录。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 7 * 24 * 3600,
+        persist_path: Optional[Path] = None,
+        timeout: float = 8.0,
+    ) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl)
+        self.persist_path = persist_path
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._pending: Dict[str, "asyncio.Future[str]"] = {}
+        self._client = None
+        self._save_task: Optional[asyncio.Task] = None
+        self._load()
+
+    @staticmethod
+    def _cache_key(u: str) -> str:
+        parsed = urlparse(u)
+        return "b23.tv" + parsed.path.rstrip("/")
+
+    def _load(self) -> None:
+        if not self.persist_path or not self.persist_path.exists():
+            return
+        try:
+            with self.persist_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for key, (target, expires) in data.items():
+                if expires > now:
+                    self._cache[key] = (target, expires)
+            # 文件按最近使用顺序保存；缓存上限调小后只保留最近使用的部分
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        except Exception as e:
+            logger.warning(f"bili2mp4: 短链缓存加载失败: {e}")
+
+    def _write(self, data: Dict[str, Tuple[str, float]]) -> None:
+        assert self.persist_path is not None
+        tmp = self.persist_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.persist_path)
+
+    def _schedule_save(self) -> None:
+        if not self.persist_path or (self._save_task and not self._save_task.done()):
+            return
+
+        async def save_later():
+            # 合并短时间内的多次写入
+            await asyncio.sleep(5)
+            try:
+                await asyncio.to_thread(self._write, dict(self._cache))
+            except Exception as e:
+                logger.debug(f"bili2mp4: 短链缓存保存失败: {e}")
+
+        self._save_task = asyncio.create_task(save_later())
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                headers=_short_headers(),
+                follow_redirects=False,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60),
+            )
+        return self._client
+
+    async def _fetch_location(self, u: str) -> str:
+        try:
+            client = self._get_client()
+        except ImportError:
+            return await asyncio.to_thread(_expand_short_url, u, self.timeout)
+
+        resp = await client.head(u)
+        if not resp.is_redirect:
+            # 部分短链不支持 HEAD，退回只读响应头的 GET
+            async with client.stream("GET", u) as resp:
+                pass
+        location = resp.headers.get("location")
+        if not location:
+            return u
+        return urljoin(u, location)
+
+    async def resolve(self, u: str) -> str:
+        """展开短链，非短链原样返回；失败时返回原链接"""
+        if not is_short_url(u):
+            return u
+
+        key = self._cache_key(u)
+        cached = self._cache.get(key)
+        if cached and cached[1] > time.time():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        fut: "asyncio.Future[str]" = asyncio.get_running_loop().create_future()
+        self._pending[key] = fut
+        target = u
+        try:
+            target = await self._fetch_location(u)
+        except Exception as e:
+            logger.debug(f"bili2mp4: 短链展开失败，使用原链接（{u}）：{e}")
+        else:
+            if target != u and self.max_entries:
+                self._cache[key] = (target, time.time() + self.ttl)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                self._schedule_save()
+        finally:
+            self._pending.pop(key, None)
+            if not fut.done():
+                fut.set_result(target)
+        return target
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.persist_path and self._cache:
+            try:
+                await asyncio.to_thread(self._write, dict(self._cache))
+            except Exception as e:
+                logger.debug(f"bili2mp4: 短链缓存保存失败: {e}")
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from nonebot import logger
+
+OVERFLOW_REJECT = "reject"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+# 未能预估大小的任务按此大小（MB）参与优先级调度
+DEFAULT_COST_MB = 64.0
+
+
+class QueueFullError(Exception):
+    """队列已满且策略为拒绝新任务"""
+
+
+class JobDroppedError(Exception):
+    """排队中的任务因队列溢出被丢弃"""
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        group_id: int,
+        label: str,
+        factory: Callable[[], Awaitable[Any]],
+        cost: Optional[float] = None,
+        weight: float = 1.0,
+    ) -> None:
+        self.id = next(self._ids)
+        self.group_id = group_id
+        self.label = label
+        self.factory = factory
+        self.cost = cost
+        self.weight = weight if weight > 0 else 1.0
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+
+
+class DownloadScheduler:
+    """
+    下载任务调度器：全局并发上限 + 每群并发上限 + 有界等待队列。
+
+    队列满时按 overflow 策略处理：reject 直接拒绝新任务，
+    drop_oldest 丢弃最早排队的任务为新任务腾出位置。
+
+    priority 为真时不再先来先到，而是短任务优先：优先级分数为
+    预估大小（MB）/ 群权重 - aging × 已等待分钟数，分数最小的可运行任务先开始，
+    等待足够久的大任务最终也会排到最前。
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        per_group: int,
+        max_queue: int,
+        overflow: str = OVERFLOW_REJECT,
+        priority: bool = False,
+        aging: float = 0,
+    ) -> None:
+        self.workers = max(1, int(workers))
+        self.per_group = max(0, int(per_group))
+        self.max_queue = max(0, int(max_queue))
+        self.overflow = overflow
+        self.priority = priority
+        self.aging = max(0.0, float(aging))
+        self._queue: Deque[Job] = deque()
+        self._active: Dict[int, Job] = {}
+        self._group_active: Dict[int, int] = {}
+
+    async def run(
+        self,
+        group_id: int,
+        label: str,
+        factory: Callable[[], Awaitable[Any]],
+        cost: Optional[float] = None,
+        weight: float = 1.0,
+    ) -> Any:
+        """
+        提交任务并等待其完成，返回 factory 协程的结果。
+
+        cost 为预估大小（MB，未知为 None），weight 为所在群的权重，仅在优先级调度时使用。
+        """
+        job = Job(group_id, label, factory, cost, weight)
+        self._enqueue(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # 等待者被取消时撤回仍在排队的任务，不再为它占用下载槽位
+            if job in self._queue:
+                self._queue.remove(job)
+                logger.debug(f"bili2mp4: 等待者已取消，移出队列: {job.label}")
+            raise
+
+    def _enqueue(self, job: Job) -> None:
+        if self.max_queue and len(self._queue) >= self.max_queue:
+            if self.overflow != OVERFLOW_DROP_OLDEST:
+                raise QueueFullError(f"等待队列已满（{self.max_queue}）")
+            dropped = self._queue.popleft()
+            logger.warning(f"bili2mp4: 队列已满，丢弃最早的任务: {dropped.label}")
+            if not dropped.future.done():
+                dropped.future.set_exception(JobDroppedError("任务因队列溢出被丢弃"))
+        self._queue.append(job)
+
+    def _eligible(self, job: Job) -> bool:
+        if not self.per_group:
+            return True
+        return self._group_active.get(job.group_id, 0) < self.per_group
+
+    def _score(self, job: Job, now: float) -> float:
+        cost = DEFAULT_COST_MB if job.cost is None else job.cost
+        return cost / job.weight - self.aging * (now - job.created) / 60
+
+    def _pick(self) -> Optional[Job]:
+        eligible = [j for j in self._queue if self._eligible(j)]
+        if not eligible:
+            return None
+        if not self.priority:
+            return eligible[0]
+        now = time.monotonic()
+        return min(eligible, key=lambda j: (self._score(j, now), j.id))
+
+    def _dispatch(self) -> None:
+        while len(self._active) < self.workers:
+            job = self._pick()
+            if job is None:
+                return
+            self._queue.remove(job)
+            self._start(job)
+
+    def _start(self, job: Job) -> None:
+        job.started = time.monotonic()
+        self._active[job.id] = job
+        self._group_active[job.group_id] = self._group_active.get(job.group_id, 0) + 1
+        asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: Job) -> None:
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            # 执行中的任务被取消时同样结束等待者，避免其一直等待
+            if not job.future.done():
+                job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._active.pop(job.id, None)
+            left = self._group_active.get(job.group_id, 1) - 1
+            if left > 0:
+                self._group_active[job.group_id] = left
+            else:
+                self._group_active.pop(job.group_id, None)
+            self._dispatch()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """当前排队与运行中的任务，用于管理员查看"""
+        now = time.monotonic()
+        queue = list(self._queue)
+        if self.priority:
+            # 按开始顺序列出（不考虑每群并发限制）
+            queue.sort(key=lambda j: (self._score(j, now), j.id))
+        return {
+            "active": [
+                {
+                    "label": j.label,
+                    "group_id": j.group_id,
+                    "cost": j.cost,
+                    "running": now - (j.started or now),
+                }
+                for j in self._active.values()
+            ],
+            "queued": [
+                {
+                    "label": j.label,
+                    "group_id": j.group_id,
+                    "cost": j.cost,
+                    "score": self._score(j, now) if self.priority else None,
+                    "waiting": now - j.created,
+                }
+                for j in queue
+            ],
+        }
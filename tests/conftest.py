@@ -0,0 +1,7 @@
+import nonebot
+from nonebot.adapters.onebot.v11 import Adapter
+
+# 插件导入时需要已初始化的 nonebot（读取配置、注册事件处理）
+nonebot.init()
+nonebot.get_driver().register_adapter(Adapter)
+nonebot.load_plugin("nonebot_plugin_bili2mp4")
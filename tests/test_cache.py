@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from nonebot_plugin_bili2mp4.cache import VideoCache
+
+
+def _download(tmp_path, name, size):
+    path = tmp_path / "downloads" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b"0" * size)
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return VideoCache(tmp_path / "cache", 250)
+
+
+async def test_put_and_get(tmp_path, cache):
+    cached = await cache.put("BV1|h0|s0", _download(tmp_path, "a.mp4", 100), "标题")
+
+    assert cache.get("BV1|h0|s0") == (cached, "标题")
+    assert cache.get("BV2|h0|s0") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    # 索引延迟写入，关闭时保存
+    assert not (tmp_path / "cache" / "index.json").exists()
+    await cache.close()
+    index = json.loads((tmp_path / "cache" / "index.json").read_text("utf-8"))
+    assert list(index["entries"]) == ["BV1|h0|s0"]
+
+
+async def test_evicts_least_recently_used(tmp_path, cache):
+    await cache.put("a", _download(tmp_path, "a.mp4", 100), "a")
+    await cache.put("b", _download(tmp_path, "b.mp4", 100), "b")
+    cache.get("a")
+    await cache.put("c", _download(tmp_path, "c.mp4", 100), "c")
+
+    assert list(cache.entries) == ["a", "c"]
+    assert not (tmp_path / "cache" / "b.mp4").exists()
+
+
+async def test_held_entry_is_not_evicted_until_released(tmp_path, cache):
+    held = await cache.put("a", _download(tmp_path, "a.mp4", 100), "a")
+    cache.hold(held)
+    await cache.put("b", _download(tmp_path, "b.mp4", 100), "b")
+    await cache.put("c", _download(tmp_path, "c.mp4", 100), "c")
+
+    # a 仍在发送，淘汰跳过它
+    assert list(cache.entries) == ["a", "c"]
+    cache.hold(held)
+    await cache.put("d", _download(tmp_path, "d.mp4", 100), "d")
+    assert list(cache.entries) == ["a", "d"]
+    assert cache.total_bytes == 200
+
+    cache.release(held)
+    assert "a" in cache.entries
+    cache.release(held)
+    assert "a" in cache.entries
+
+
+async def test_release_runs_deferred_eviction(tmp_path):
+    cache = VideoCache(tmp_path / "cache", 150)
+    held = await cache.put("a", _download(tmp_path, "a.mp4", 100), "a")
+    cache.hold(held)
+    await cache.put("b", _download(tmp_path, "b.mp4", 100), "b")
+
+    # 两个条目都无法淘汰：a 被占用，b 是刚写入的
+    assert cache.total_bytes == 200
+    cache.release(held)
+    assert list(cache.entries) == ["b"]
+    assert not (tmp_path / "cache" / "a.mp4").exists()
+
+
+async def test_index_survives_reload(tmp_path, cache):
+    await cache.put("a", _download(tmp_path, "a.mp4", 100), "标题")
+    await cache.close()
+
+    reloaded = VideoCache(tmp_path / "cache", 250)
+    assert reloaded.get("a")[1] == "标题"
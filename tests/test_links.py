@@ -0,0 +1,66 @@
+import pytest
+from nonebot.adapters.onebot.v11 import MessageSegment
+
+from nonebot_plugin_bili2mp4.links import canonical_video_id, extract_bili_urls
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://www.bilibili.com/video/BV1xx411c7mD/", "BV1xx411c7mD"),
+        ("https://m.bilibili.com/video/BV1xx411c7mD?p=1&share=x", "BV1xx411c7mD"),
+        ("https://www.bilibili.com/video/BV1xx411c7mD/?p=3", "BV1xx411c7mD_p3"),
+        ("https://www.bilibili.com/video/av170001/", "av170001"),
+        ("https://www.bilibili.com/video/AV170001?p=2", "av170001_p2"),
+        ("https://www.bilibili.com/bangumi/play/ep123456", "ep123456"),
+        ("https://www.bilibili.com/bangumi/play/ss4321", "ss4321"),
+        (
+            "https://space.bilibili.com/12/channel/collectiondetail?sid=34",
+            "col12-34",
+        ),
+        (
+            "https://space.bilibili.com/12/channel/seriesdetail?sid=34&ctype=0",
+            "ser12-34",
+        ),
+        ("https://space.bilibili.com/12/lists/34?type=series", "ser12-34"),
+        ("https://space.bilibili.com/12/lists/34", "col12-34"),
+        ("https://www.bilibili.com/read/cv123", None),
+    ],
+)
+def test_canonical_video_id(url, expected):
+    assert canonical_video_id(url) == expected
+
+
+def test_extract_dedupes_by_video_id():
+    segments = [
+        MessageSegment.text(
+            "看这个 https://www.bilibili.com/video/BV1xx411c7mD?share_source=qq "
+            "和 https://m.bilibili.com/video/BV1xx411c7mD/ 还有 "
+            "https://www.bilibili.com/video/BV1xx411c7mD?p=2"
+        )
+    ]
+    assert extract_bili_urls(segments) == [
+        "https://www.bilibili.com/video/BV1xx411c7mD/",
+        "https://www.bilibili.com/video/BV1xx411c7mD/?p=2",
+    ]
+
+
+def test_extract_keeps_short_links():
+    segments = [MessageSegment.text("https://b23.tv/AbCd12 https://b23.tv/AbCd12")]
+    assert extract_bili_urls(segments) == ["https://b23.tv/AbCd12"]
+
+
+def test_extract_from_escaped_json_card():
+    data = (
+        '{"meta":{"detail_1":{"qqdocurl":'
+        '"https:\\/\\/www.bilibili.com\\/video\\/BV1xx411c7mD?p=1&amp;from=qq"}}}'
+    )
+    segments = [MessageSegment.json(data)]
+    assert extract_bili_urls(segments) == [
+        "https://www.bilibili.com/video/BV1xx411c7mD/"
+    ]
+
+
+def test_extract_ignores_unrelated_text():
+    segments = [MessageSegment.text("https://example.com/video/BV1xx411c7mD 无关")]
+    assert extract_bili_urls(segments) == []
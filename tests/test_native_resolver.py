@@ -0,0 +1,179 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from nonebot_plugin_bili2mp4 import downloader
+
+VIEW = {
+    "code": 0,
+    "data": {
+        "bvid": "BV1xx411c7mD",
+        "title": "测试视频",
+        "duration": 120,
+        "pages": [
+            {"cid": 11, "part": "上", "duration": 60},
+            {"cid": 12, "part": "下", "duration": 60},
+        ],
+    },
+}
+
+
+def _playurl(base: str) -> dict:
+    return {
+        "code": 0,
+        "data": {
+            "dash": {
+                "video": [
+                    {
+                        "id": 80,
+                        "codecid": 7,
+                        "baseUrl": f"{base}/v80.m4s",
+                        "bandwidth": 2000000,
+                        "width": 1920,
+                        "height": 1080,
+                        "frameRate": "30",
+                        "codecs": "avc1.640032",
+                    },
+                    {
+                        "id": 32,
+                        "codecid": 12,
+                        "base_url": f"{base}/v32.m4s",
+                        "bandwidth": 500000,
+                        "width": 852,
+                        "height": 480,
+                        "codecs": "hev1.1.6.L120.90",
+                    },
+                ],
+                "audio": [
+                    {
+                        "id": 30280,
+                        "baseUrl": f"{base}/a.m4s",
+                        "bandwidth": 192000,
+                        "codecs": "mp4a.40.2",
+                    }
+                ],
+            }
+        },
+    }
+
+
+class _Api(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(
+            (url.path, parse_qs(url.query), self.headers.get("Cookie"))
+        )
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        if self.server.fail:
+            body = {"code": -404, "message": "啥都木有"}
+        elif url.path == "/x/web-interface/view":
+            body = VIEW
+        elif url.path == "/x/player/playurl":
+            body = _playurl(base)
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Api)
+    server.requests = []
+    server.fail = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _job(api, url="https://www.bilibili.com/video/BV1xx411c7mD/", **kw):
+    return dict({"url": url, "api_base": api.base, "native": True}, **kw)
+
+
+def test_native_extract_formats(api):
+    info = downloader._native_extract(_job(api, cookie="SESSDATA=abc"))
+
+    # 多P视频与 yt-dlp 一样按分P命名
+    assert info["id"] == "BV1xx411c7mD_p1"
+    assert info["title"] == "测试视频 p01 上"
+    assert info["duration"] == 60
+    formats = {f["format_id"]: f for f in info["formats"]}
+    assert list(formats) == ["80-7", "32-12", "30280"]
+    assert formats["80-7"]["tbr"] == 2000
+    assert formats["80-7"]["height"] == 1080
+    assert formats["80-7"]["fps"] == 30
+    assert formats["80-7"]["acodec"] == "none"
+    assert formats["32-12"]["url"] == f"{api.base}/v32.m4s"
+    assert formats["30280"]["tbr"] == formats["30280"]["abr"] == 192
+    assert formats["30280"]["vcodec"] == "none"
+    for f in info["formats"]:
+        # CDN 只校验 Referer，Cookie 只发给接口
+        assert f["http_headers"]["Referer"] == "https://www.bilibili.com/"
+        assert "Cookie" not in f["http_headers"]
+
+    (view_path, view_query, view_cookie), (play_path, play_query, _) = api.requests
+    assert view_path == "/x/web-interface/view"
+    assert view_query["bvid"] == ["BV1xx411c7mD"]
+    assert view_cookie == "SESSDATA=abc"
+    assert play_path == "/x/player/playurl"
+    assert play_query["cid"] == ["11"]
+
+
+def test_native_extract_page(api):
+    url = "https://www.bilibili.com/video/BV1xx411c7mD/?p=2"
+    info = downloader._native_extract(_job(api, url))
+
+    assert info["id"] == "BV1xx411c7mD_p2"
+    assert info["title"] == "测试视频 p02 下"
+    assert api.requests[1][1]["cid"] == ["12"]
+
+
+def test_native_extract_av(api):
+    downloader._native_extract(_job(api, "https://www.bilibili.com/video/av170001"))
+
+    assert api.requests[0][1] == {"aid": ["170001"]}
+
+
+class _FakeYdl:
+    def __init__(self):
+        self.urls = []
+
+    def extract_info(self, url, download=False):
+        self.urls.append(url)
+        return {"id": "BV1xx411c7mD", "title": "yt-dlp", "formats": []}
+
+    def sanitize_info(self, info, remove_private_keys=False):
+        return info
+
+
+def test_resolve_info_native(api):
+    ydl = _FakeYdl()
+    info, resolver = downloader._resolve_info(ydl, _job(api), True)
+
+    assert resolver == "native"
+    assert info["extractor_key"] == "BiliBiliNative"
+    assert ydl.urls == []
+
+
+def test_resolve_info_falls_back_on_api_error(api):
+    api.fail = True
+    ydl = _FakeYdl()
+    info, resolver = downloader._resolve_info(ydl, _job(api), True)
+
+    assert resolver == "fallback"
+    assert info["title"] == "yt-dlp"
+    assert ydl.urls == ["https://www.bilibili.com/video/BV1xx411c7mD/"]
+    assert [path for path, _, _ in api.requests] == ["/x/web-interface/view"]
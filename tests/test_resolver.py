@@ -0,0 +1,47 @@
+import json
+import time
+
+from nonebot_plugin_bili2mp4.resolver import ShortLinkResolver
+
+
+def _persist(path, count):
+    expires = time.time() + 3600
+    data = {
+        f"b23.tv/k{i}": (f"https://www.bilibili.com/video/{i}", expires)
+        for i in range(count)
+    }
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+def test_load_trims_to_max_entries(tmp_path):
+    path = tmp_path / "short_links.json"
+    _persist(path, 5)
+
+    resolver = ShortLinkResolver(3, persist_path=path)
+    # 保留最近使用（文件末尾）的条目
+    assert list(resolver._cache) == ["b23.tv/k2", "b23.tv/k3", "b23.tv/k4"]
+
+
+def test_load_skips_expired(tmp_path):
+    path = tmp_path / "short_links.json"
+    path.write_text(
+        json.dumps({"b23.tv/old": ["https://x", time.time() - 1]}), encoding="utf-8"
+    )
+
+    assert not ShortLinkResolver(10, persist_path=path)._cache
+
+
+async def test_resolve_uses_cache_and_evicts_lru(monkeypatch):
+    resolver = ShortLinkResolver(2)
+    fetched = []
+
+    async def fetch(u):
+        fetched.append(u)
+        return "https://www.bilibili.com/video/BV1xx411c7mD/" + u[-1]
+
+    monkeypatch.setattr(resolver, "_fetch_location", fetch)
+    for code in ("a", "b", "a", "c", "b"):
+        await resolver.resolve(f"https://b23.tv/{code}")
+
+    assert [u[-1] for u in fetched] == ["a", "b", "c", "b"]
+    assert list(resolver._cache) == ["b23.tv/c", "b23.tv/b"]
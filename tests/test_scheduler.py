@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from nonebot_plugin_bili2mp4.scheduler import (
+    QueueFullError,
+    JobDroppedError,
+    DownloadScheduler,
+)
+
+
+class _Gate:
+    """阻塞中的任务：记录开始顺序，放行后才结束"""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    def job(self, name):
+        async def run():
+            self.started.append(name)
+            await self.release.wait()
+            return name
+
+        return lambda: run()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_fifo_by_default():
+    sched = DownloadScheduler(1, 0, 10)
+    gate = _Gate()
+    tasks = [
+        asyncio.create_task(sched.run(1, name, gate.job(name), cost))
+        for name, cost in (("a", 10), ("b", 500), ("c", 1))
+    ]
+    await _settle()
+    gate.release.set()
+    assert await asyncio.gather(*tasks) == ["a", "b", "c"]
+    assert gate.started == ["a", "b", "c"]
+
+
+async def test_priority_runs_smallest_first():
+    sched = DownloadScheduler(1, 0, 10, priority=True)
+    gate = _Gate()
+    tasks = [
+        asyncio.create_task(sched.run(1, name, gate.job(name), cost))
+        for name, cost in (("first", 10), ("long", 900), ("mid", 20), ("short", 5))
+    ]
+    await _settle()
+    assert [j["label"] for j in sched.snapshot()["queued"]] == ["short", "mid", "long"]
+    gate.release.set()
+    await asyncio.gather(*tasks)
+    assert gate.started == ["first", "short", "mid", "long"]
+
+
+async def test_priority_weight_and_unknown_cost():
+    sched = DownloadScheduler(1, 0, 10, priority=True)
+    gate = _Gate()
+    tasks = [
+        asyncio.create_task(sched.run(1, "first", gate.job("first"), 1)),
+        # 未知大小按 DEFAULT_COST_MB（64）计
+        asyncio.create_task(sched.run(1, "unknown", gate.job("unknown"), None)),
+        asyncio.create_task(sched.run(2, "heavy", gate.job("heavy"), 100, 4.0)),
+        asyncio.create_task(sched.run(1, "plain", gate.job("plain"), 50)),
+    ]
+    await _settle()
+    gate.release.set()
+    await asyncio.gather(*tasks)
+    assert gate.started == ["first", "heavy", "plain", "unknown"]
+
+
+async def test_aging_promotes_waiting_jobs(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(
+        "nonebot_plugin_bili2mp4.scheduler.time.monotonic", lambda: now[0]
+    )
+    sched = DownloadScheduler(1, 0, 10, priority=True, aging=10)
+    gate = _Gate()
+    tasks = [asyncio.create_task(sched.run(1, "first", gate.job("first"), 1))]
+    tasks.append(asyncio.create_task(sched.run(1, "big", gate.job("big"), 100)))
+    await _settle()
+    # 大任务已等待 10 分钟：100 - 10 × 10 = 0，小于新来的 50MB 任务
+    now[0] += 600
+    tasks.append(asyncio.create_task(sched.run(1, "new", gate.job("new"), 50)))
+    await _settle()
+    gate.release.set()
+    await asyncio.gather(*tasks)
+    assert gate.started == ["first", "big", "new"]
+
+
+async def test_per_group_cap():
+    sched = DownloadScheduler(2, 1, 10)
+    gate = _Gate()
+    tasks = [
+        asyncio.create_task(sched.run(group, name, gate.job(name)))
+        for group, name in ((1, "a1"), (1, "a2"), (2, "b1"))
+    ]
+    await _settle()
+    # 群1已有任务在运行，空闲槽位给群2
+    assert gate.started == ["a1", "b1"]
+    gate.release.set()
+    await asyncio.gather(*tasks)
+    assert gate.started == ["a1", "b1", "a2"]
+
+
+async def test_reject_when_full():
+    sched = DownloadScheduler(1, 0, 1)
+    gate = _Gate()
+    running = asyncio.create_task(sched.run(1, "a", gate.job("a")))
+    queued = asyncio.create_task(sched.run(1, "b", gate.job("b")))
+    await _settle()
+    with pytest.raises(QueueFullError):
+        await sched.run(1, "c", gate.job("c"))
+    gate.release.set()
+    assert await asyncio.gather(running, queued) == ["a", "b"]
+
+
+async def test_drop_oldest_when_full():
+    sched = DownloadScheduler(1, 0, 2, overflow="drop_oldest")
+    gate = _Gate()
+    tasks = [
+        asyncio.create_task(sched.run(1, name, gate.job(name)))
+        for name in ("a", "b", "c", "d")
+    ]
+    await _settle()
+    gate.release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert results[0] == "a"
+    assert isinstance(results[1], JobDroppedError)
+    assert results[2:] == ["c", "d"]
+    assert gate.started == ["a", "c", "d"]
+
+
+async def test_cancelled_waiter_leaves_queue():
+    sched = DownloadScheduler(1, 0, 10)
+    gate = _Gate()
+    running = asyncio.create_task(sched.run(1, "a", gate.job("a")))
+    queued = asyncio.create_task(sched.run(1, "b", gate.job("b")))
+    await _settle()
+    queued.cancel()
+    await _settle()
+    assert sched.queue_depth == 0
+    gate.release.set()
+    assert await running == "a"
+    await _settle()
+    assert gate.started == ["a"]
@@ -0,0 +1,85 @@
+import pytest
+
+from nonebot_plugin_bili2mp4.downloader import (
+    SizeLimitExceeded,
+    _select_format,
+    _build_format_candidates,
+)
+
+MB = 1024 * 1024
+
+
+def _info(duration=100):
+    # 码率单位 kbps：1080p 8000kbps × 100s ≈ 95MB，480p 800kbps ≈ 9.5MB
+    return {
+        "duration": duration,
+        "formats": [
+            {
+                "format_id": "v1080",
+                "vcodec": "avc1",
+                "acodec": "none",
+                "height": 1080,
+                "tbr": 8000,
+            },
+            {
+                "format_id": "v480",
+                "vcodec": "avc1",
+                "acodec": "none",
+                "height": 480,
+                "tbr": 800,
+            },
+            {"format_id": "a", "vcodec": "none", "acodec": "mp4a", "abr": 80},
+        ],
+    }
+
+
+def test_best_without_limits():
+    spec, est = _select_format(_info(), 0, 0)
+    assert spec == "v1080+a"
+    assert est == pytest.approx((8000 + 80) * 1000 / 8 * 100)
+
+
+def test_height_limit():
+    assert _select_format(_info(), 720, 0)[0] == "v480+a"
+
+
+def test_falls_back_to_smaller_format_under_size_limit():
+    spec, est = _select_format(_info(), 0, 50)
+    assert spec == "v480+a"
+    assert est < 50 * MB
+
+
+def test_all_oversize_raises():
+    with pytest.raises(SizeLimitExceeded):
+        _select_format(_info(), 0, 5)
+
+
+def test_all_oversize_returns_smallest_when_transcoding():
+    spec, est = _select_format(_info(), 0, 5, allow_oversize=True)
+    assert spec == "v480+a"
+    assert est > 5 * MB
+
+
+def test_filesize_preferred_over_bitrate():
+    info = _info()
+    info["formats"][0]["filesize"] = 10 * MB
+    assert _select_format(info, 0, 50) == ("v1080+a", pytest.approx(10 * MB + 1e6))
+
+
+def test_unknown_size_passes_limit():
+    info = _info(duration=None)
+    assert _select_format(info, 0, 5) == ("v1080+a", None)
+
+
+def test_no_video_formats():
+    assert _select_format({"formats": []}, 0, 50) is None
+
+
+def test_fallback_candidates_filter_size():
+    assert _build_format_candidates(0, 0) == ["bv*+ba/best"]
+    size = "[filesize<?50MiB][filesize_approx<?50MiB]"
+    assert _build_format_candidates(720, 50) == [
+        f"bv*[height<=720]{size}+ba/best[height<=720]{size}",
+        f"bv*{size}+ba/best{size}",
+    ]
+    assert _build_format_candidates(0, 50, allow_oversize=True)[-1] == "bv*+ba/best"